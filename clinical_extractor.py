@@ -0,0 +1,219 @@
+"""
+Rule- and lexicon-based extraction of ClinicalInfo fields from patient messages.
+
+The team needs location, duration, appearance and symptoms before it can say
+anything useful, and discovering that one of them is missing used to cost a
+coordinator call plus a Conversation Handler call. A ClinicalIntake fills the
+fields from each message locally, asks for whatever is still missing, and
+only hands the conversation to the team once the record is complete.
+"""
+import re
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+from clinical_tools import ClinicalInfo
+
+_NUMBER = r"(?:\d+(?:\.\d+)?|a|an|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|few|a few|couple of|a couple of|several|many)"
+_UNIT = r"(?:hours?|hrs?|days?|nights?|weeks?|wks?|months?|mos?|years?|yrs?)"
+
+BODY_SITES = (
+    "scalp", "hairline", "forehead", "eyebrows?", "eyelids?", "eyes?", "ears?", "nose", "cheeks?", "lips?",
+    "mouth", "chin", "jaw(?:line)?", "neck", "throat", "shoulders?", "armpits?", "underarms?", "axilla(?:e)?",
+    "upper arms?", "arms?", "elbows?", "forearms?", "wrists?", "hands?", "palms?", "knuckles?", "fingers?", "thumbs?",
+    "fingernails?", "nails?", "chest", "breasts?", "nipples?", "spine",
+    "abdomen", "stomach", "belly", "tummy", "waist", "flanks?", "torso", "hips?", "groin",
+    "genitals?", "genital area", "penis", "vulva", "buttocks?", "bum", "thighs?", "inner thighs?", "knees?",
+    "legs?", "lower legs?", "shins?", "calf", "calves", "ankles?", "feet", "foot", "heels?", "soles?", "toes?", "toenails?",
+    "whole body", "all over(?: my body)?", "everywhere",
+)
+_SITE = re.compile(
+    r"\b(?:(?:left|right|both|upper|lower|inner|outer|back of (?:my|the)|front of (?:my|the))\s+)?(?:" + "|".join(BODY_SITES) + r")\b",
+    re.IGNORECASE,
+)
+# Words that are body sites only in context: "on my back" and "lower back" are
+# places, "it came back" is not
+AMBIGUOUS_SITES = ("back", "sides?", "bottom", "face", "front", "temples?", "trunk")
+_CONTEXT_SITE = re.compile(
+    r"\b(?:(?P<context>my|the|his|her|their|our|(?:baby|son|daughter|child|kid|husband|wife|partner|mum|mom|dad)'s|on|across|along)\s+)?"
+    r"(?P<site>(?:(?P<side>left|right|both|upper|lower|small of (?:my|the))\s+)?(?:" + "|".join(AMBIGUOUS_SITES) + r"))\b"
+    # "the back of my hand" names the hand, "the bottom of the list" nothing
+    r"(?!\s+of\b)",
+    re.IGNORECASE,
+)
+
+_DURATIONS = (
+    re.compile(rf"\b(?:for|since|about|around|almost|nearly|over|past|last|ago)?\s*(?:the\s+)?(?:past\s+|last\s+)?{_NUMBER}\s+{_UNIT}(?:\s+(?:ago|back))?\b", re.IGNORECASE),
+    re.compile(r"\b(?:since|from)\s+(?:yesterday|last\s+\w+|the weekend|(?:mon|tues|wednes|thurs|fri|satur|sun)day|childhood|birth|i was (?:a )?(?:child|kid|baby|teen(?:ager)?)|(?:january|february|march|april|may|june|july|august|september|october|november|december)|\d{4})\b", re.IGNORECASE),
+    re.compile(r"\b(?:yesterday|today|this morning|the other day|(?:last|this|earlier this) (?:night|week(?:end)?|month|year|summer|winter|spring|autumn|(?:mon|tues|wednes|thurs|fri|satur|sun)day)|overnight|a while|ages|years|months|weeks|days|recently|lifelong|since forever)\b", re.IGNORECASE),
+)
+
+APPEARANCE_TERMS = (
+    "rash(?:es)?", "spots?", "patch(?:es)?", "plaques?", "papules?", "pustules?", "vesicles?", "blisters?", "bumps?",
+    "lumps?", "moles?", "lesions?", "ulcers?", "sores?", "warts?", "hives", "welts?", "wheals?", "pimples?", "zits?",
+    "blackheads?", "whiteheads?", "cysts?", "nodules?", "macules?", "boils?", "scabs?", "crust(?:s|y|ed)?", "scal(?:es|y|ing)",
+    "flak(?:es|y|ing)", "peeling", "cracked", "cracks?", "ring(?:-shaped| shaped)?", "rings?", "circular", "round", "oval",
+    "raised", "flat", "bumpy", "rough", "smooth", "dry", "oily", "shiny", "thick(?:ened)?", "oozing", "weeping",
+    "spreading", "discolou?r(?:ed|ation)", "red(?:dish|ness)?", "pink(?:ish)?", "brown(?:ish)?", "black(?:ish)?",
+    "white(?:ish)?", "purple|purplish", "yellow(?:ish)?", "silver(?:y)?", "dark(?:er)?", "light(?:er)?", "pale",
+    "skin[- ]colou?red", "irregular", "uneven", "blotch(?:es|y)?", "freckles?", "pigment(?:ed|ation)",
+    r"\d+(?:\.\d+)?\s?(?:mm|cm|millimet(?:er|re)s?|centimet(?:er|re)s?)", r"(?:coin|pea|grape|thumbnail)[- ]sized?",
+)
+_APPEARANCE = re.compile(r"\b(?:" + "|".join(APPEARANCE_TERMS) + r")\b", re.IGNORECASE)
+
+SYMPTOM_TERMS = (
+    "itch(?:y|ing|es)?", "pain(?:ful)?", "hurts?", "hurting", "sore(?:ness)?", "tender(?:ness)?", "burn(?:s|ing)?",
+    "sting(?:s|ing)?", "tingl(?:e|es|ing)", "numb(?:ness)?", "bleed(?:s|ing)?", "swell(?:ing|s)?", "swollen",
+    "throb(?:s|bing)?", "fever(?:ish)?", "chills", "tired(?:ness)?", "fatigue", "hot to the touch", "warm",
+)
+_SYMPTOM = re.compile(r"\b(?:" + "|".join(SYMPTOM_TERMS) + r")\b", re.IGNORECASE)
+_NO_SYMPTOMS = re.compile(
+    r"\b(?:no (?:other )?symptoms?|asymptomatic|(?:does ?n[o']t|doesnt|not|never) (?:itch(?:y)?|hurt(?:ing)?|painful|sore|bother(?:ing)? me)|no (?:itch(?:ing)?|pain))\b",
+    re.IGNORECASE,
+)
+_NEGATIVE_REPLY = re.compile(r"^\s*(?:no|nope|none|nothing|not really|no symptoms?)\s*[.!]*\s*$", re.IGNORECASE)
+_GREETING = re.compile(r"^\s*(?:hi|hello|hey|good (?:morning|afternoon|evening)|greetings|hola|yo)\b[\s!.,]*$", re.IGNORECASE)
+_QUESTION = re.compile(r"^\s*(?:what|why|how|which|who|when|where|can|could|should|is|are|does|do|will)\b.*\?\s*$", re.IGNORECASE | re.DOTALL)
+
+# Say that something is there, not what it looks like
+GENERIC_TERMS = {"rash", "rashes", "spot", "spots", "lesion", "lesions", "bump", "bumps", "lump", "lumps", "patch", "patches", "sore", "sores"}
+
+QUESTIONS: Dict[str, str] = {
+    "location": "Where on your body is it?",
+    "duration": "How long have you had it?",
+    "appearance": "What does it look like (colour, size, texture, e.g. red, raised, scaly, about 2 cm)?",
+    "symptoms": "Any symptoms, such as itching, pain, burning or bleeding? (Say \"none\" if not.)",
+}
+
+
+def _phrases(pattern: re.Pattern, text: str) -> List[str]:
+    found: List[str] = []
+    for match in pattern.finditer(text):
+        phrase = " ".join(match.group(0).lower().split())
+        if phrase and phrase not in found:
+            found.append(phrase)
+    return found
+
+
+def _sites(text: str, bare: bool = False) -> List[str]:
+    """Body sites in `text`, in order; `bare` also takes ambiguous words without context ("back")."""
+    found = [(match.start(), match.group(0)) for match in _SITE.finditer(text)]
+    for match in _CONTEXT_SITE.finditer(text):
+        if bare or match.group("context") or match.group("side"):
+            found.append((match.start("site"), match.group("site")))
+    sites: List[str] = []
+    for _, site in sorted(found):
+        site = " ".join(site.lower().split())
+        if site not in sites:
+            sites.append(site)
+    return sites
+
+
+def extract_fields(text: str, asked: Optional[List[str]] = None) -> Dict[str, str]:
+    """
+    ClinicalInfo fields found in one message. `asked` lets a bare "no" answer
+    the symptoms question, and a bare "back" the location question.
+    """
+    extracted: Dict[str, str] = {}
+    locations = _sites(text, bare=bool(asked and "location" in asked and len(text.split()) <= 3))
+    if locations:
+        extracted["location"] = ", ".join(locations)
+    for pattern in _DURATIONS:
+        durations = _phrases(pattern, text)
+        if durations:
+            extracted["duration"] = ", ".join(durations)
+            break
+    appearance = _phrases(_APPEARANCE, text)
+    if appearance:
+        extracted["appearance"] = ", ".join(appearance)
+    if _NO_SYMPTOMS.search(text) or (asked and "symptoms" in asked and _NEGATIVE_REPLY.match(text)):
+        extracted["symptoms"] = "none reported"
+    else:
+        symptoms = _phrases(_SYMPTOM, text)
+        if symptoms:
+            extracted["symptoms"] = ", ".join(symptoms)
+    return extracted
+
+
+@dataclass
+class IntakeStep:
+    reply: Optional[str] = None  # answer the sender locally with this
+    prompt: Optional[str] = None  # otherwise run the team on this
+
+
+@dataclass
+class ClinicalIntake:
+    """Partial ClinicalInfo for one sender's conversation, filled in across messages."""
+
+    location: Optional[str] = None
+    duration: Optional[str] = None
+    appearance: Optional[str] = None
+    symptoms: Optional[str] = None
+    messages: List[str] = field(default_factory=list)
+    asked: List[str] = field(default_factory=list)
+    complete: bool = False
+
+    def missing(self) -> List[str]:
+        def known(name: str) -> bool:
+            value = getattr(self, name)
+            if name == "appearance" and value:
+                return any(term not in GENERIC_TERMS for term in value.split(", "))
+            return bool(value)
+        return [f.name for f in fields(ClinicalInfo) if not known(f.name)]
+
+    def _merge(self, name: str, value: str) -> None:
+        current = getattr(self, name)
+        if not current or current == "none reported":
+            setattr(self, name, value)
+        elif value != "none reported":
+            known = current.split(", ")
+            setattr(self, name, ", ".join(known + [v for v in value.split(", ") if v not in known]))
+
+    def info(self) -> ClinicalInfo:
+        return ClinicalInfo(**{f.name: getattr(self, f.name) for f in fields(ClinicalInfo)})
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSON-ready state, for sessions shared between worker processes."""
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ClinicalIntake":
+        return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+    def step(self, message: str) -> IntakeStep:
+        if self.complete:
+            return IntakeStep(prompt=message)
+
+        extracted = extract_fields(message, self.asked)
+        if not extracted and not self.messages:
+            # General questions and chit-chat are the team's business
+            if _QUESTION.match(message):
+                return IntakeStep(prompt=message)
+            if _GREETING.match(message):
+                self.asked = self.missing()
+                return IntakeStep(reply=(
+                    "Hello! I can help with a skin concern. Please tell me:\n"
+                    + "\n".join(f"{n}. {QUESTIONS[name]}" for n, name in enumerate(self.asked, 1))
+                ))
+
+        for name, value in extracted.items():
+            self._merge(name, value)
+        self.messages.append(message.strip())
+
+        missing = self.missing()
+        if missing:
+            self.asked = missing
+            lines = ["Thanks. To assess this properly I also need:" if extracted else "To assess this properly, please tell me:"]
+            lines += [f"{n}. {QUESTIONS[name]}" for n, name in enumerate(missing, 1)]
+            return IntakeStep(reply="\n".join(lines))
+
+        self.complete = True
+        self.asked = []
+        info = self.info()
+        return IntakeStep(prompt=(
+            "Clinical information collected from the patient:\n"
+            f"- Location: {info.location}\n"
+            f"- Duration: {info.duration}\n"
+            f"- Appearance: {info.appearance}\n"
+            f"- Symptoms: {info.symptoms}\n"
+            "Patient's own words:\n" + "\n".join(f"> {text}" for text in self.messages)
+        ))
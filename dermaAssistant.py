@@ -1,72 +1,119 @@
-from agno.agent import Agent
+import asyncio
 import os
-from agno.models.groq import Groq
-from agno.models.google import Gemini
-from agno.storage.sqlite import SqliteStorage
-from agno.team import Team
-from agno.tools.function import UserInputField
-from agno.tools.user_control_flow import UserControlFlowTools
-from agno.utils import pprint
+import sys
 from fastapi.responses import PlainTextResponse
-from fastapi import FastAPI, Request, Form
-from agno.tools.duckduckgo import DuckDuckGoTools
-from agno.tools.pubmed import PubmedTools
-from agno.tools.twilio import TwilioTools
-from agno.exceptions import ModelProviderError
-from skin.skin_kb import DermaKnowledgeBase
-#Twilio imports
-from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-from clinical_tools import get_clinical_input, ClinicalInfo
+from fastapi import APIRouter, FastAPI, Request, Form
+from http_client import client_lifespan
+from jobs import JobQueue, JobQueueFull, send_whatsapp
+from idempotency import store_from_env
+from sessions import ConversationSession, forget_session_runs, registry_from_env
+from clinical_extractor import ClinicalIntake
+from pipeline import Consultation, ConsultationPipeline
+from startup import Components, health_router, import_module, startup_mode
+from telemetry import get_logger, metrics_router, observe_run, span, start_trace
 
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
 
 load_dotenv()
 
+log = get_logger(__name__)
+
 #api_key = os.getenv("GOOGLE_API_KEY")
 account_sid = os.getenv("TWILIO_ACCOUNT_SID")
 auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 twilio_phone_number = os.getenv("TWILIO_PHONE_NUMBER")
 
-client = Client(account_sid, auth_token)
-
 agent_storage: str = "tmp/agents.db"
 
-kb = None
+kb_table = "derma_knowledge"
+kb_path = "./my_local_lancedb"
+
+# Knowledge table maintenance runs as its own process (`make maintain-kb`),
+# never in a web worker, since it publishes new table builds
+
+# Seconds between session/memory retention passes (see retention.py); 0 disables it
+retention_interval = float(os.getenv("RETENTION_INTERVAL", "3600"))
+
+# "async": acknowledge the webhook at once and reply over the REST API from a
+# worker; "sync": answer inline in the TwiML response
+webhook_mode = os.getenv("WEBHOOK_MODE", "sync")
+job_queue = JobQueue(
+    workers=int(os.getenv("JOB_WORKERS", "4")),
+    max_size=int(os.getenv("JOB_QUEUE_SIZE", "100")),
+)
+# "local": collect location/duration/appearance/symptoms with the rule-based
+# extractor and only run the team once they are complete; "off": team only
+clinical_intake = os.getenv("CLINICAL_INTAKE", "local")
+# "team": every turn goes through the Team coordinator; "pipeline": collect,
+# validate and analyze run as a state machine (see pipeline.py)
+team_mode = os.getenv("TEAM_MODE", "team")
+# Finished responses by MessageSid, so Twilio retries never re-run the team
+webhook_responses = store_from_env()
 
-derma_agent = None
+async def run_loop(module: str, loop: str, interval: float, **kwargs) -> None:
+    """Import a background loop's module off the event loop, then run the loop."""
+    await getattr(await import_module(module), loop)(interval, **kwargs)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: Load KB and create team
-    global kb, derma_agent
-    kb = await load_derma_kb()
-    derma_agent = await create_teams()
-    print("[INFO] Dermatology team initialized and ready.")
-    yield
-    # Shutdown: Clean up if needed
-    print("[INFO] Shutting down dermatology service")
-
-app = FastAPI(lifespan=lifespan)
-
-# Load derma knowledge base (async only for this step)
-async def load_derma_kb():
+    # The knowledge base and the team are built on first use (see startup.py);
+    # startup only schedules them, so the worker starts serving at once
+    warmup = startup_mode()
+    if warmup == "blocking":
+        await components.warm()
+    warm_task = asyncio.create_task(components.warm()) if warmup == "background" else None
+    retention_task = (
+        asyncio.create_task(run_loop("retention", "retention_loop", retention_interval)) if retention_interval > 0 else None
+    )
+    if webhook_mode == "async":
+        job_queue.start()
+    log.info(f"Dermatology service started ({webhook_mode} webhook mode, {warmup} warmup).")
+    # Shared, pooled HTTP client for media downloads (see http_client.py)
+    async with client_lifespan():
+        yield
+        # Shutdown: let queued replies go out while the client is still open
+        await job_queue.stop()
+    for task in (warm_task, retention_task):
+        if task:
+            task.cancel()
+    # Commit any agent session writes still queued
+    if "sqlite_store" in sys.modules:
+        sys.modules["sqlite_store"].close_writers()
+    log.info("Shutting down dermatology service")
+
+# Open the derma knowledge base read-only; it is built by `python -m skin.ingest`
+def load_derma_kb():
+    from skin.skin_kb import DermaKnowledgeBase
+
     kb = DermaKnowledgeBase(
-        table_name="derma_knowledge",
-        db_path="./my_local_lancedb",
+        table_name=kb_table,
+        db_path=kb_path,
         pdf_paths=["resources"],
         urls = []
     )
-    await kb.aload(upsert=True, recreate=False)
-    return kb
+    return kb.open()
+
+def twilio_client():
+    from twilio.rest import Client
+
+    return Client(account_sid, auth_token)
+
+async def create_teams(mode: str = None):
+    mode = mode or team_mode
+    kb = await components.get("kb")
+    # agno, the Groq SDK and the toolkits are only needed from here on
+    for name in ("agno.agent", "agno.team", "agno.models.groq", "agno.tools.twilio", "tool_cache", "sqlite_store"):
+        await import_module(name)
+    from agno.agent import Agent
+    from agno.models.groq import Groq
+    from agno.team import Team
+    from agno.tools.twilio import TwilioTools
+    from agno.tools.user_control_flow import UserControlFlowTools
+    from clinical_tools import get_clinical_input
+    from sqlite_store import WalSqliteStorage
+    from tool_cache import CachedDuckDuckGoTools, CachedPubmedTools
 
-async def create_teams():
-    # First ensure KB is loaded
-    global kb
-    if kb is None:
-        kb = await load_derma_kb()
-    
     # Conversation agent to handle initial interaction and data collection
     conversation_agent = Agent(
         name="Conversation Handler",
@@ -93,7 +140,7 @@ async def create_teams():
             Always respond to greetings politely and guide the conversation to collect clinical details.
             """
         ],
-        storage=SqliteStorage(table_name="conversation_agent", db_file="./derma_agent.sqlite")
+        storage=WalSqliteStorage(table_name="conversation_agent", db_file="./derma_agent.sqlite")
     )
 
     # Medical analysis agent
@@ -101,8 +148,8 @@ async def create_teams():
         name="Medical Analyzer",
         model=Groq(id="meta-llama/llama-4-scout-17b-16e-instruct"),
         tools=[
-            DuckDuckGoTools(),
-            PubmedTools(),
+            CachedDuckDuckGoTools(),
+            CachedPubmedTools(),
             UserControlFlowTools()
         ],
         knowledge=kb.get_knowledge_base() if kb else None,
@@ -122,7 +169,7 @@ async def create_teams():
             Always include appropriate medical disclaimers.
             """
         ],
-        storage=SqliteStorage(table_name="analysis_agent", db_file="./derma_agent.sqlite")
+        storage=WalSqliteStorage(table_name="analysis_agent", db_file="./derma_agent.sqlite")
     )
 
     # Create the team
@@ -141,83 +188,178 @@ async def create_teams():
         - Once complete, second agent (Medical Analyzer) provides assessment based on ClinicalInfo
         
         The team must ensure complete information before proceeding with analysis.
-        """
+        """,
+        # Sessions are per sender and per conversation (see sessions.py); only the
+        # last few runs of the current one are replayed into each turn
+        enable_team_history=True,
+        num_history_runs=int(os.getenv("SESSION_HISTORY_RUNS", "3")),
     )
 
+    if mode == "pipeline":
+        # The coordinator only sees off-script turns; analysis goes straight to its agent
+        return ConsultationPipeline(coordinator=derma_team, analyzer=analysis_agent)
     return derma_team
 
+# The knowledge base, the team (or pipeline) and the Twilio REST client, built on first use
+components = Components()
+components.register("kb", load_derma_kb)
+components.register("team", create_teams)
+components.register("twilio", twilio_client, required=False)
+
+# Current conversation session per sender
 user_sessions = {}
+session_registry = registry_from_env(
+    user_sessions,
+    on_expire=lambda session_id: forget_session_runs(components.peek("team"), session_id),
+)
+
+router = APIRouter()
+
+@router.get("/kb/stats")
+async def kb_stats():
+    """Knowledge table version, query and embedding cache hit rates and context tokens saved by packing."""
+    kb = components.peek("kb")
+    if kb is None:
+        return {"status": "initializing"}
+    return kb.stats()
+
+@router.get("/tools/stats")
+async def tools_stats():
+    """Cache, coalescing and rate-limit counters for the PubMed and DuckDuckGo tools."""
+    if "tool_cache" not in sys.modules:
+        return {"status": "initializing"}
+    return sys.modules["tool_cache"].tool_cache_stats()
+
+@router.get("/jobs/stats")
+async def jobs_stats():
+    """Webhook job queue depth, wait time and run time."""
+    team = components.peek("team")
+    return {
+        "mode": webhook_mode,
+        **job_queue.stats(),
+        "idempotency": webhook_responses.stats(),
+        "sessions": session_registry.stats(),
+        "pipeline": team.stats() if isinstance(team, ConsultationPipeline) else None,
+    }
 
-@app.post("/twilio/whatsapp", response_class=PlainTextResponse)
+@router.post("/twilio/whatsapp", response_class=PlainTextResponse)
 async def whatsapp_webhook(request: Request):
-    print("[DEBUG] /twilio/whatsapp endpoint hit")
     try:
         # Get form data from the request
-        form = await request.form()
-        print(f"[DEBUG] Form data received: {form}")
-        
-        # Extract message details with proper validation and type conversion
-        sender = str(form.get("From") or form.get("from", ""))
-        message = str(form.get("Body") or form.get("body", ""))
-        media_url = form.get("MediaUrl0")  # Handle images if present
-        print(f"[DEBUG] Sender: {sender}, Message: {message}, Media URL: {media_url}")
-        
+        with span("webhook.parse"):
+            form = await request.form()
+            start_trace(form.get("MessageSid") or form.get("SmsMessageSid"))
+            log.debug("Form data received: %s", form)
+
+            # Extract message details with proper validation and type conversion
+            sender = str(form.get("From") or form.get("from", ""))
+            message = str(form.get("Body") or form.get("body", ""))
+            media_url = form.get("MediaUrl0")  # Handle images if present
+        log.debug("Sender: %s, Message: %s, Media URL: %s", sender, message, media_url)
+
         if not sender or not message:
-            print("[ERROR] Missing sender or message in request.")
+            log.error("Missing sender or message in request.")
             return PlainTextResponse(
                 content="<Response><Message>Invalid request: Missing sender or message.</Message></Response>",
                 media_type="application/xml"
             )
 
-        print(f"Incoming WhatsApp from {sender}: {message}")
-        
-        # Initialize agent if needed
-        global derma_agent
-        if derma_agent is None:
-            print("[ERROR] derma_agent is not initialized.")
-            return PlainTextResponse(
-                content="<Response><Message>Service is initializing. Please try again in a moment.</Message></Response>",
-                media_type="application/xml"
-            )
+        log.info("Incoming WhatsApp message", extra={"fields": {"sender": sender, "chars": len(message)}})
 
-        # Process the message
-        print("[DEBUG] Calling process_whatsapp_message...")
-        response = await process_whatsapp_message(message, sender)
-        print(f"[DEBUG] Response from agent: {response}")
+        # Retries of the same MessageSid attach to the first run or replay its TwiML
+        message_sid = form.get("MessageSid") or form.get("SmsMessageSid")
+        content = await webhook_responses.run(message_sid, lambda: answer_whatsapp_message(message, sender))
+        return PlainTextResponse(content=content, media_type="application/xml")
+    except JobQueueFull:
+        log.warning("Job queue full; asking sender to retry")
         return PlainTextResponse(
-            content=f"<Response><Message>{response}</Message></Response>",
+            content="<Response><Message>We are handling a lot of requests right now. Please try again in a few minutes.</Message></Response>",
             media_type="application/xml"
         )
     except Exception as e:
-        print(f"[ERROR] Exception in whatsapp_webhook: {str(e)}")
+        log.error(f"Exception in whatsapp_webhook: {e}")
         return PlainTextResponse(
             content="<Response><Message>Sorry, I had trouble processing that. Please describe your skin issue—e.g.,\"I have a red rash on my arm that has been there for 3 days.\"</Message></Response>",
             media_type="application/xml"
         )
 
+async def answer_whatsapp_message(message: str, sender: str) -> str:
+    """TwiML for one delivery: the answer itself, or an empty acknowledgement in async mode."""
+    if webhook_mode == "async":
+        # Acknowledge inside Twilio's deadline; the answer follows over the REST API
+        if not job_queue.submit(sender, lambda: reply_whatsapp_message(message, sender)):
+            raise JobQueueFull()
+        return "<Response></Response>"
+
+    # Process the message
+    response = await process_whatsapp_message(message, sender)
+    log.debug("Response from agent: %s", response)
+    return f"<Response><Message>{response}</Message></Response>"
+
+async def reply_whatsapp_message(message: str, sender: str) -> None:
+    """Job-queue worker body: run the team and deliver its answer over the REST API."""
+    try:
+        response = await process_whatsapp_message(message, sender)
+    except Exception:
+        response = ("Sorry, I had trouble processing that. Please describe your skin issue—e.g.,"
+                    "\"I have a red rash on my arm that has been there for 3 days.\"")
+    await send_whatsapp(await components.get("twilio"), twilio_phone_number, sender, response)
+
 async def process_whatsapp_message(message: str, sender: str) -> str:
     """Process incoming WhatsApp messages using the dermatology team."""
     try:
-        print("[DEBUG] process_whatsapp_message called")
-        # Run the team with the message
-        if derma_agent is None:
-            print("[ERROR] Dermatology team is not initialized")
-            raise RuntimeError("Dermatology team is not initialized")
-        print("[DEBUG] Running derma_agent.arun...")
-        run_response = await derma_agent.arun(message)
-        print(f"[DEBUG] derma_agent.arun response: {run_response}")
+        # One session per sender and conversation; a sender's turns run one at a time
+        session = session_registry.session_for(sender, message)
+        async with session.lock:
+            try:
+                with span("agent.run", session=session.session_id) as fields:
+                    run_response = await consult(message, session, sender)
+                    fields.update(observe_run(run_response))
+            finally:
+                # The sender's next turn may land on another worker
+                session_registry.save_intake(session)
         return str(run_response)
 
-    except ModelProviderError as e:
-        print(f"[ERROR] ModelProviderError: {str(e)}")
+    except Exception as e:
+        # Only a built team raises it, so agno is imported by then
+        provider_error = getattr(sys.modules.get("agno.exceptions"), "ModelProviderError", ())
+        if not isinstance(e, provider_error):
+            log.error(f"Exception in process_whatsapp_message: {e}")
+            raise
+        log.error(f"ModelProviderError: {e}")
         if "tool_use_failed" in str(e):
             return ("To provide an accurate assessment, please share:\n"
                    "1. Where is the skin condition located?\n"
                    "2. When did you first notice it?\n"
                    "3. What does it look like (color, size, texture)?\n"
                    "4. Are there any symptoms (itching, pain, etc)?")
-        print(f"Error details: {str(e)}")
-        raise
-    except Exception as e:
-        print(f"[ERROR] Exception in process_whatsapp_message: {str(e)}")
         raise
+
+async def consult(message: str, session: ConversationSession, sender: str):
+    """One turn of a consultation: a local reply (str) or the run response of the agent or team that answered."""
+    derma_agent = await components.get("team")
+    if isinstance(derma_agent, ConsultationPipeline):
+        consultation = session_registry.intake(session, Consultation.from_dict)
+        return await derma_agent.arun(message, consultation, session_id=session.session_id, user_id=sender)
+
+    prompt = message
+    if clinical_intake == "local":
+        step = session_registry.intake(session, ClinicalIntake.from_dict).step(message)
+        if step.reply:
+            log.debug("Clinical details incomplete (%s); asking locally", ", ".join(session.intake.asked))
+            return step.reply
+        prompt = step.prompt
+    return await derma_agent.arun(prompt, session_id=session.session_id, user_id=sender)
+
+
+def create_app() -> FastAPI:
+    """The dermatology webhook app; cheap to call, since nothing heavy is built until it is needed."""
+    app = FastAPI(lifespan=lifespan)
+    # /healthz and /readyz (see startup.py)
+    app.include_router(health_router(components))
+    # Stage latency histograms and model/tool counters (see telemetry.py)
+    app.include_router(metrics_router())
+    app.include_router(router)
+    return app
+
+app = create_app()
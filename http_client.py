@@ -0,0 +1,87 @@
+"""Application-scoped, pooled async HTTP client shared by the WhatsApp and Twilio media paths."""
+import asyncio
+import os
+import random
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+
+# Transient statuses worth retrying for idempotent requests
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_client() -> httpx.AsyncClient:
+    """
+    One client, one connection pool: keep-alive across requests and
+    connection-level retries.
+
+    httpx ignores the client's pool settings once a transport is given, so the
+    limits are set on the transport itself.
+    """
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "20")), connect=5.0),
+        transport=httpx.AsyncHTTPTransport(
+            retries=2,
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=60.0,
+            ),
+        ),
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """The shared client; created on first use if no app lifespan has opened it."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+@asynccontextmanager
+async def client_lifespan():
+    """Open the shared client for the lifetime of a FastAPI app."""
+    client = get_client()
+    try:
+        yield client
+    finally:
+        await close_client()
+
+
+def backoff_delay(attempt: int, base: float = 0.3, cap: float = 5.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def request_with_retry(
+    method: str,
+    url: str,
+    retries: int = 3,
+    client: Optional[httpx.AsyncClient] = None,
+    **kwargs,
+) -> httpx.Response:
+    """Send a request on the shared client, retrying transport errors and 429/5xx with backoff."""
+    client = client or get_client()
+    for attempt in range(retries + 1):
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            await response.aclose()
+        await asyncio.sleep(backoff_delay(attempt))
+    raise RuntimeError("unreachable")
@@ -0,0 +1,143 @@
+"""
+Idempotent webhook handling keyed by Twilio's MessageSid.
+
+Twilio retries a webhook that is slow or fails, and sends the same MessageSid
+each time. The first delivery runs the handler. A retry that arrives while that
+run is still going waits for the same result. A retry that arrives after it has
+finished gets the stored TwiML back without anything being run again.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+class IdempotencyStore:
+    """
+    Bounded LRU of finished responses plus the futures of in-flight runs.
+
+    With `db_path` set, every finished response is also written to SQLite and
+    looked up there on an LRU miss. Responses then survive restarts and are
+    shared between worker processes. Failed runs are not stored, so Twilio's
+    next retry gets a fresh attempt.
+    """
+
+    def __init__(self, max_entries: int = 2048, ttl: float = 86400.0, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.counts = {"runs": 0, "attached": 0, "replayed": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS webhook_responses ("
+                " key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _db_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT response FROM webhook_responses WHERE key = ? AND created_at > ?",
+                (key, time.time() - self.ttl),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _db_put(self, key: str, response: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO webhook_responses (key, response, created_at) VALUES (?, ?, ?)",
+                    (key, response, time.time()),
+                )
+                self._writes += 1
+                if self._writes % 500 == 0:
+                    conn.execute("DELETE FROM webhook_responses WHERE created_at <= ?", (time.time() - self.ttl,))
+
+    def _remember(self, key: str, response: str) -> None:
+        self._entries[key] = (time.monotonic(), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[str]:
+        item = self._entries.get(key)
+        if item is not None:
+            if time.monotonic() - item[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                return item[1]
+            del self._entries[key]
+        if self.db_path:
+            response = await asyncio.to_thread(self._db_get, key)
+            if response is not None:
+                self._remember(key, response)
+                return response
+        return None
+
+    async def run(self, key: Optional[str], handler: Callable[[], Awaitable[str]]) -> str:
+        """Return the response for `key`, running `handler` only for its first delivery."""
+        if not key:
+            return await handler()
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self.counts["attached"] += 1
+            log.info(f"Duplicate delivery of {key}; waiting for the run in progress")
+            # shield: a retry that disconnects must not cancel the original run
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await self.get(key)
+            if response is not None:
+                self.counts["replayed"] += 1
+                log.info(f"Duplicate delivery of {key}; replaying stored response")
+            else:
+                self.counts["runs"] += 1
+                response = await handler()
+                self._remember(key, response)
+                if self.db_path:
+                    await asyncio.to_thread(self._db_put, key, response)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; don't let the loop warn about an unretrieved exception
+            future.exception()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "in_flight": len(self._in_flight), **self.counts}
+
+
+def store_from_env() -> IdempotencyStore:
+    """IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL and, to spill to SQLite, IDEMPOTENCY_DB."""
+    return IdempotencyStore(
+        max_entries=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "2048")),
+        ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400")),
+        db_path=os.getenv("IDEMPOTENCY_DB") or None,
+    )
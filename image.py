@@ -3,6 +3,10 @@ import cloudinary.uploader
 import os
 from typing import Optional
 
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
 # Configure Cloudinary once (can be in your main app startup or environment setup)
 cloudinary.config(
     cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
@@ -21,13 +25,13 @@ def upload_to_cloudinary(image_bytes: bytes) -> Optional[str]:
         str: Secure URL of the uploaded image, or None if failed.
     """
     try:
-        print("[Cloudinary] Starting upload...")
         upload_result = cloudinary.uploader.upload(image_bytes)
-        print(f"[Cloudinary] Upload result: {upload_result}")
         secure_url = upload_result.get("secure_url")
         if not secure_url:
-            print("[Cloudinary] No secure_url in upload result!")
+            log.error("Cloudinary upload returned no secure_url")
+        else:
+            log.debug("Cloudinary upload of %d bytes: %s", len(image_bytes), upload_result.get("public_id"))
         return secure_url
     except Exception as e:
-        print(f"[Cloudinary] Upload failed: {e}")
+        log.error(f"Cloudinary upload failed: {e}")
         return None
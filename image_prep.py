@@ -0,0 +1,265 @@
+"""
+Preprocessing and perceptual-hash dedup for patient photos.
+
+    python -m image_prep photo.jpg [more.jpg ...]   # sizes before/after and pairwise hash distances
+
+Phone photos arrive as 3-12 MB JPEGs or PNGs, usually rotated by an EXIF tag.
+The vision model gains nothing above roughly a megapixel, so prepare_image
+decodes the photo, applies the EXIF orientation, scales it down to
+IMAGE_MAX_SIDE pixels on the long side and re-encodes it as JPEG. That also
+drops the EXIF block, including any GPS position.
+
+Each prepared image also gets a 64-bit DCT perceptual hash. Patients often
+resend a photo, or another shot of it, and ImageDedup matches those by Hamming
+distance so the earlier upload (and analysis) can be reused. With
+IMAGE_DEDUP_DB set the seen images are kept in SQLite, so a resend is matched
+whichever worker process receives it.
+"""
+import argparse
+import io
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image, ImageOps
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+_HASH_SIZE = 8
+_DCT_SIZE = 32
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    width: int
+    height: int
+    phash: int
+    original_bytes: int
+    content_type: str = "image/jpeg"
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def phash(image: Image.Image) -> int:
+    """64-bit perceptual hash: signs of the low-frequency DCT terms against their median."""
+    pixels = np.asarray(image.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.Resampling.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:_HASH_SIZE, :_HASH_SIZE].flatten()
+    # The DC term is overall brightness, which says nothing about the picture
+    bits = low > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def prepare_image(raw: bytes, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY) -> PreparedImage:
+    """Orient, downsample and re-encode `raw`; raises PIL.UnidentifiedImageError for non-images."""
+    with Image.open(io.BytesIO(raw)) as image:
+        image.draft("RGB", (max_side, max_side))  # lets JPEG decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, "white")
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+        return PreparedImage(
+            data=out.getvalue(),
+            width=image.width,
+            height=image.height,
+            phash=phash(image),
+            original_bytes=len(raw),
+        )
+
+
+@dataclass
+class SeenImage:
+    phash: int
+    url: str
+    caption: str = ""
+    reply: Optional[str] = None
+    seen_at: float = field(default_factory=time.time)
+    # Row id when ImageDedup keeps its images in SQLite
+    id: Optional[int] = None
+
+
+class ImageDedup:
+    """
+    Recently seen images per sender, matched by perceptual hash.
+
+    Entries are scoped to the sender, so one patient's analysis is never
+    replayed to another. Senders are kept in LRU order up to `max_senders`,
+    each with at most `per_sender` images younger than `ttl` seconds.
+
+    With `db_path` set the images are kept in SQLite instead, shared by every
+    process; changes to a SeenImage are written back with `update`.
+    """
+
+    def __init__(
+        self,
+        max_distance: int = 6,
+        ttl: float = 7 * 86400,
+        per_sender: int = 32,
+        max_senders: int = 4096,
+        db_path: Optional[str] = None,
+    ):
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.per_sender = per_sender
+        self.max_senders = max_senders
+        self.db_path = db_path
+        self._seen: "OrderedDict[str, List[SeenImage]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self.counts = {"lookups": 0, "duplicates": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Hashes are stored as hex: SQLite integers are signed 64-bit
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS seen_images ("
+                " id INTEGER PRIMARY KEY, sender TEXT NOT NULL, phash TEXT NOT NULL, url TEXT NOT NULL,"
+                " caption TEXT NOT NULL, reply TEXT, seen_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS seen_images_sender ON seen_images (sender, seen_at)")
+            self._conn = conn
+        return self._conn
+
+    def _db_images(self, sender: str, now: float) -> List[SeenImage]:
+        rows = self._connection().execute(
+            "SELECT id, phash, url, caption, reply, seen_at FROM seen_images"
+            " WHERE sender = ? AND seen_at > ? ORDER BY seen_at DESC LIMIT ?",
+            (sender, now - self.ttl, self.per_sender),
+        )
+        return [
+            SeenImage(phash=int(h, 16), url=url, caption=caption, reply=reply, seen_at=seen_at, id=row_id)
+            for row_id, h, url, caption, reply, seen_at in rows
+        ]
+
+    def lookup(self, sender: str, image_hash: int) -> Optional[SeenImage]:
+        """The closest earlier image from `sender` within `max_distance`, if any."""
+        now = time.time()
+        with self._lock:
+            self.counts["lookups"] += 1
+            if self.db_path:
+                images = self._db_images(sender, now)
+                best = min(images, key=lambda image: hamming(image.phash, image_hash), default=None)
+                if best is None or hamming(best.phash, image_hash) > self.max_distance:
+                    return None
+                self.counts["duplicates"] += 1
+                return best
+            images = self._seen.get(sender)
+            if not images:
+                return None
+            self._seen.move_to_end(sender)
+            images[:] = [image for image in images if now - image.seen_at <= self.ttl]
+            best = min(images, key=lambda image: hamming(image.phash, image_hash), default=None)
+            if best is None or hamming(best.phash, image_hash) > self.max_distance:
+                return None
+            self.counts["duplicates"] += 1
+            return best
+
+    def remember(self, sender: str, image_hash: int, url: str, caption: str = "") -> SeenImage:
+        seen = SeenImage(phash=image_hash, url=url, caption=caption)
+        with self._lock:
+            if self.db_path:
+                conn = self._connection()
+                with conn:
+                    seen.id = conn.execute(
+                        "INSERT INTO seen_images (sender, phash, url, caption, reply, seen_at) VALUES (?, ?, ?, ?, NULL, ?)",
+                        (sender, format(image_hash, "x"), url, caption, seen.seen_at),
+                    ).lastrowid
+                    conn.execute(
+                        "DELETE FROM seen_images WHERE sender = ? AND id NOT IN"
+                        " (SELECT id FROM seen_images WHERE sender = ? ORDER BY seen_at DESC LIMIT ?)",
+                        (sender, sender, self.per_sender),
+                    )
+                    self._writes += 1
+                    if self._writes % 500 == 0:
+                        conn.execute("DELETE FROM seen_images WHERE seen_at <= ?", (seen.seen_at - self.ttl,))
+                return seen
+            images = self._seen.setdefault(sender, [])
+            self._seen.move_to_end(sender)
+            images.append(seen)
+            del images[: -self.per_sender]
+            while len(self._seen) > self.max_senders:
+                self._seen.popitem(last=False)
+        return seen
+
+    def update(self, seen: SeenImage) -> None:
+        """Store changes to an image's url, caption or reply (in memory they are shared already)."""
+        if seen.id is None or not self.db_path:
+            return
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "UPDATE seen_images SET url = ?, caption = ?, reply = ? WHERE id = ?",
+                    (seen.url, seen.caption, seen.reply, seen.id),
+                )
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            if self.db_path:
+                senders, images = self._connection().execute("SELECT COUNT(DISTINCT sender), COUNT(*) FROM seen_images").fetchone()
+                return {"senders": senders, "images": images, **self.counts}
+            return {"senders": len(self._seen), "images": sum(len(i) for i in self._seen.values()), **self.counts}
+
+
+image_dedup = ImageDedup(
+    max_distance=int(os.getenv("IMAGE_DEDUP_DISTANCE", "6")),
+    ttl=float(os.getenv("IMAGE_DEDUP_TTL", str(7 * 86400))),
+    db_path=os.getenv("IMAGE_DEDUP_DB") or None,
+)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Show what preprocessing does to patient photos")
+    parser.add_argument("paths", nargs="+", help="image files")
+    parser.add_argument("--max-side", type=int, default=IMAGE_MAX_SIDE)
+    args = parser.parse_args(argv)
+
+    prepared: Dict[str, PreparedImage] = {}
+    for path in args.paths:
+        with open(path, "rb") as f:
+            raw = f.read()
+        start = time.perf_counter()
+        image = prepare_image(raw, max_side=args.max_side)
+        prepared[path] = image
+        print(
+            f"[INFO] {path}: {image.original_bytes / 1024:.0f} KB -> {len(image.data) / 1024:.0f} KB "
+            f"({image.width}x{image.height}) in {(time.perf_counter() - start) * 1000:.0f} ms, phash {image.phash:016x}"
+        )
+    paths = list(prepared)
+    for i, a in enumerate(paths):
+        for b in paths[i + 1:]:
+            print(f"[INFO] distance {a} <-> {b}: {hamming(prepared[a].phash, prepared[b].phash)}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
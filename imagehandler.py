@@ -2,16 +2,20 @@
 
 import os
 import cloudinary
-import cloudinary.uploader
-import httpx
 from fastapi import Request
 from agno.app.whatsapp.router import WhatsAppRouter
 
-# Import your derma agent
-from dermaAssistant import derma_agent  # Ensure this is correct or refactor to avoid circular imports
+# The derma team is built on first use (see dermaAssistant.components)
+from dermaAssistant import components, session_registry
+from http_client import request_with_retry
+from media import earlier_reply, fetch_media, host_image, remember_reply
+from streaming import deliver_stream
+from telemetry import get_logger
 
-# Setup WhatsApp Router
-router = WhatsAppRouter(agent=derma_agent)
+log = get_logger(__name__)
+
+# Setup WhatsApp Router; handle_image fetches the team itself
+router = WhatsAppRouter(agent=None)
 
 # Cloudinary config
 cloudinary.config(
@@ -21,26 +25,19 @@ cloudinary.config(
 )
 
 # Helper: Get media URL from WhatsApp (requires bearer token)
+# Both helpers use the shared pooled client, so the Graph API lookup and the
+# download reuse kept-alive connections instead of two fresh TLS handshakes
 async def get_media_url(media_id: str, access_token: str) -> str:
     url = f"https://graph.facebook.com/v19.0/{media_id}"
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        res = await client.get(url, headers=headers)
-        res.raise_for_status()
-        return res.json()["url"]
+    res = await request_with_retry("GET", url, headers=headers)
+    res.raise_for_status()
+    return res.json()["url"]
 
-# Helper: Download image content
+# Helper: Download image content (streamed, size-capped)
 async def download_image(url: str, access_token: str) -> bytes:
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        res = await client.get(url, headers=headers)
-        res.raise_for_status()
-        return res.content
-
-# Helper: Upload to Cloudinary
-def upload_to_cloudinary(image_bytes: bytes) -> str:
-    uploaded = cloudinary.uploader.upload(image_bytes)
-    return uploaded["secure_url"]
+    return await fetch_media(url, headers=headers)
 
 # WhatsApp image message handler
 # 
@@ -52,8 +49,15 @@ async def handle_image(agent, wa_id: str, media_id: str, caption: str | None, re
         image_url = await get_media_url(media_id, token)
         image_bytes = await download_image(image_url, token)
 
-        # Step 2: Upload to Cloudinary
-        cloud_url = upload_to_cloudinary(image_bytes)
+        # Step 2: Downsample and upload to Cloudinary, or reuse the upload of the same picture
+        image = await host_image(image_bytes, wa_id)
+        if image is None:
+            raise RuntimeError("image upload failed")
+        earlier = earlier_reply([image], caption or "")
+        if earlier:
+            await router.reply(wa_id, earlier)
+            return
+        cloud_url = image.url
 
         # Step 3: Send to Derma Agent using vision-compatible format
         content = [
@@ -61,9 +65,21 @@ async def handle_image(agent, wa_id: str, media_id: str, caption: str | None, re
             {"type": "image_url", "image_url": {"url": cloud_url}},
         ]
 
-        response = await agent.astream(input=content, user_id=wa_id)
-        async for chunk in response:
-            await router.reply(wa_id, chunk)
+        # Coalesce the stream into a few message-sized segments instead of one reply per chunk
+        agent = agent or await components.get("team")
+        sent = []
+
+        async def reply(segment: str) -> None:
+            await router.reply(wa_id, segment)
+            sent.append(segment)
+
+        # The sender's conversation session, as for text messages; their turns run one at a time
+        session = session_registry.session_for(wa_id, caption or "")
+        async with session.lock:
+            response = await agent.astream(input=content, session_id=session.session_id, user_id=wa_id)
+            stats = await deliver_stream(response, reply)
+        log.debug("Streamed %d chunks to %s in %d messages", stats.chunks, wa_id, stats.messages)
+        remember_reply([image], caption or "", "\n\n".join(sent))
 
     except Exception as e:
         await router.reply(wa_id, f"❌ Error analyzing image: {str(e)}")
@@ -0,0 +1,151 @@
+"""
+Bounded in-process job queue for webhook work that outlives the HTTP request.
+
+Twilio gives a webhook about 15 seconds before it times out and retries, which a
+full team run can easily exceed. In async mode the webhook enqueues the work and
+acknowledges at once; a fixed pool of worker tasks runs the jobs and delivers the
+answers over the Twilio REST API instead of TwiML.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from telemetry import get_logger, percentile
+
+log = get_logger(__name__)
+
+# Twilio rejects WhatsApp message bodies longer than this
+WHATSAPP_MAX_CHARS = 1600
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    name: str
+    run: Callable[[], Awaitable[Any]]
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def _summary(samples: Deque[float]) -> Dict[str, float]:
+    values = list(samples)
+    return {
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "max_ms": round(max(values, default=0.0) * 1000, 1),
+    }
+
+
+class JobQueue:
+    """
+    A bounded asyncio.Queue drained by `workers` tasks.
+
+    `submit` never waits: when the queue is full it returns False so the caller
+    can shed load. Wait and run times are kept for the last `window` jobs.
+    """
+
+    def __init__(self, workers: int = 4, max_size: int = 100, window: int = 1000):
+        self.workers = workers
+        self.max_size = max_size
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+        self.in_flight = 0
+        self.counts = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.wait_times: Deque[float] = deque(maxlen=window)
+        self.run_times: Deque[float] = deque(maxlen=window)
+
+    @property
+    def running(self) -> bool:
+        return bool(self.tasks)
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 10.0) -> None:
+        """Give queued jobs up to `drain_timeout` seconds to finish, then cancel the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            log.warning(f"Dropping {self.queue.qsize()} queued job(s) at shutdown")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, name: str, run: Callable[[], Awaitable[Any]]) -> bool:
+        if not self.running:
+            raise RuntimeError("JobQueue is not started")
+        try:
+            self.queue.put_nowait(Job(name=name, run=run))
+        except asyncio.QueueFull:
+            self.counts["rejected"] += 1
+            return False
+        self.counts["submitted"] += 1
+        return True
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job = await self.queue.get()
+            started = time.perf_counter()
+            self.wait_times.append(started - job.enqueued_at)
+            self.in_flight += 1
+            try:
+                await job.run()
+                self.counts["completed"] += 1
+            except Exception as e:
+                self.counts["failed"] += 1
+                log.error(f"Job {job.name} failed in worker {n}: {e}")
+            finally:
+                self.in_flight -= 1
+                self.run_times.append(time.perf_counter() - started)
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "depth": self.queue.qsize() if self.queue else 0,
+            "capacity": self.max_size,
+            "in_flight": self.in_flight,
+            **self.counts,
+            "wait": _summary(self.wait_times),
+            "run": _summary(self.run_times),
+        }
+
+
+def whatsapp_address(number: str) -> str:
+    return number if number.startswith("whatsapp:") else f"whatsapp:{number}"
+
+
+def split_message(text: str, limit: int = WHATSAPP_MAX_CHARS) -> List[str]:
+    """Split a reply into Twilio-sized parts, breaking at the last newline or space that fits."""
+    parts = []
+    text = text.strip()
+    while len(text) > limit:
+        cut = max(text.rfind("\n\n", 0, limit), text.rfind("\n", 0, limit), text.rfind(" ", 0, limit))
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+async def send_whatsapp(twilio_client, from_number: str, to: str, body: str) -> None:
+    """Deliver `body` over the Twilio REST API; the SDK is blocking, so it runs in a thread."""
+    for part in split_message(body):
+        await asyncio.to_thread(
+            twilio_client.messages.create,
+            from_=whatsapp_address(from_number),
+            to=whatsapp_address(to),
+            body=part,
+        )
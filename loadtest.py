@@ -0,0 +1,444 @@
+"""
+Offline load test for the WhatsApp webhooks.
+
+    python -m loadtest                                   # both apps, 5 req/s for 30 s
+    python -m loadtest --apps twilio_response --rate 20 --duration 60 --json tmp/loadtest.json
+    python -m loadtest --baseline tmp/loadtest-main.json --json tmp/loadtest.json
+
+Starts dermaAssistant:app and twilio_response:app in this process, lifespan
+included, and drives them over ASGI with form-encoded Twilio webhook traffic:
+single text messages, multi-turn conversations, image messages and Twilio
+retries of an already delivered MessageSid. Conversations arrive as a Poisson
+process at `--rate` webhook requests per second.
+
+Nothing leaves the machine. Groq is replaced at its SDK client, PubMed and
+DuckDuckGo at their agno toolkits, Twilio media downloads at the shared HTTP
+client, Cloudinary at image.upload_to_cloudinary and Twilio's REST client as
+dermaAssistant's "twilio" component. Each stand-in sleeps for the injected
+latency (with ±30% jitter); the blocking ones (tools, upload, Twilio REST)
+block their thread just as the real SDKs do.
+
+The report gives p50/p95/p99 latency and throughput per app and message kind,
+the latency of each stage (model call, tool, media download, preprocessing,
+upload) as measured around the real code path, and event-loop lag. All
+databases and media go to a temporary working directory.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from telemetry import percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TEXT_MESSAGES = [
+    "What causes acne?",
+    "I have a red itchy rash on my left arm for 3 days",
+    "Is eczema contagious?",
+    "I have a dark mole on my back that has changed shape over the past few months",
+]
+CONVERSATION = [
+    "Hi",
+    "I have a rash on my forearm",
+    "About 2 weeks, it is red and scaly, around 3 cm",
+    "It is itchy",
+]
+ANSWER = (
+    "**Clinical Features Analysis**\n\nA red, scaly, itchy plaque on the forearm for two weeks.\n\n"
+    "**Potential Diagnoses**\n\n1. Tinea corporis.\n2. Nummular eczema.\n3. Psoriasis.\n\n"
+    "**Recommended Actions**\n\nTry a topical antifungal for two weeks and see a doctor if it spreads.\n\n"
+    "*This is not a diagnosis. Please consult a dermatologist.*"
+)
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    if not samples:
+        return {"count": 0}
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+
+class Recorder:
+    """Latency samples by stage name."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.samples[stage].append(seconds)
+
+    def timed(self, stage: str, fn: Callable) -> Callable:
+        """Wrap a sync or async callable so every call is recorded under `stage`."""
+        if asyncio.iscoroutinefunction(fn):
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.add(stage, time.perf_counter() - start)
+            return async_wrapper
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - start)
+        return wrapper
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        return {stage: _summary(values) for stage, values in sorted(self.samples.items())}
+
+
+@dataclass
+class Latencies:
+    model: float = 0.8
+    tool: float = 0.4
+    media: float = 0.3
+    upload: float = 0.5
+    twilio: float = 0.2
+    tool_rate: float = 0.3
+
+    def jitter(self, seconds: float) -> float:
+        return max(0.0, random.uniform(0.7, 1.3) * seconds)
+
+
+# Stand-ins
+
+
+class StubGroqCompletions:
+    """chat.completions for agno's Groq model: a canned answer, or a search tool call now and then."""
+
+    def __init__(self, latencies: Latencies):
+        self.latencies = latencies
+
+    async def create(self, model: str, messages: List[Dict[str, Any]], tools: Optional[List[Dict]] = None, **kwargs):
+        from groq.types.chat import ChatCompletion
+
+        await asyncio.sleep(self.latencies.jitter(self.latencies.model))
+        prompt_tokens = sum(len(json.dumps(m.get("content"), default=str)) for m in messages) // 4
+        names = {t.get("function", {}).get("name") for t in tools or []}
+        searched = any(m.get("role") == "tool" for m in messages)
+        message: Dict[str, Any] = {"role": "assistant", "content": ANSWER}
+        search = next((n for n in ("search_pubmed", "duckduckgo_search") if n in names), None)
+        if search and not searched and random.random() < self.latencies.tool_rate:
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:8]}",
+                    "type": "function",
+                    "function": {"name": search, "arguments": json.dumps({"query": "tinea corporis treatment"})},
+                }],
+            }
+        completion_tokens = len(message["content"] or "") // 4 + 10
+        return ChatCompletion.model_validate({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop", "message": message}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+
+class StubGroqClient:
+    def __init__(self, latencies: Latencies):
+        self.chat = type("Chat", (), {})()
+        self.chat.completions = StubGroqCompletions(latencies)
+
+
+class StubTwilioMessages:
+    def __init__(self, latencies: Latencies, recorder: Recorder):
+        self.latencies = latencies
+        self.recorder = recorder
+
+    def create(self, **kwargs):
+        start = time.perf_counter()
+        time.sleep(self.latencies.jitter(self.latencies.twilio))
+        self.recorder.add("twilio_send", time.perf_counter() - start)
+        return type("Message", (), {"sid": f"SM{uuid.uuid4().hex}"})()
+
+
+def _photo(seed: int, width: int = 2048, height: int = 1536) -> bytes:
+    """A noisy JPEG about the size of a phone photo, distinct per seed."""
+    import numpy as np
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = np.random.default_rng(seed)
+    image = Image.new("RGB", (width, height), (220, 180, 160))
+    draw = ImageDraw.Draw(image)
+    for _ in range(20):
+        x, y, r = int(rng.integers(0, width)), int(rng.integers(0, height)), int(rng.integers(40, 400))
+        draw.ellipse([x - r, y - r, x + r, y + r], fill=tuple(int(v) for v in rng.integers(0, 255, 3)))
+    pixels = np.asarray(image.filter(ImageFilter.GaussianBlur(6)), dtype=np.int16) + rng.integers(-25, 25, (height, width, 3))
+    out = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(out, "JPEG", quality=92)
+    return out.getvalue()
+
+
+def install_stubs(latencies: Latencies, recorder: Recorder) -> None:
+    """Swap every external provider for a local stand-in and time the real stages around them."""
+    import httpx
+    from agno.models.groq import Groq
+    from agno.tools.duckduckgo import DuckDuckGoTools
+    from agno.tools.pubmed import PubmedTools
+
+    import http_client
+    import image
+    import media
+
+    client = StubGroqClient(latencies)
+    Groq.get_async_client = lambda self: client
+    Groq.ainvoke = recorder.timed("model", Groq.ainvoke)
+
+    def blocking_search(name: str):
+        def search(self, query: str, max_results: Optional[int] = 5) -> str:
+            time.sleep(latencies.jitter(latencies.tool))
+            return json.dumps([{"title": f"{name} result for {query}"}])
+        return recorder.timed(f"tool_{name}", search)
+
+    PubmedTools.search_pubmed = blocking_search("pubmed")
+    DuckDuckGoTools.duckduckgo_search = blocking_search("duckduckgo")
+    DuckDuckGoTools.duckduckgo_news = blocking_search("duckduckgo")
+
+    photos = [_photo(seed) for seed in range(4)]
+
+    async def media_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latencies.jitter(latencies.media))
+        photo = photos[int(request.url.path.rsplit("/", 1)[-1]) % len(photos)]
+        return httpx.Response(200, content=photo, headers={"content-type": "image/jpeg"})
+
+    http_client.create_client = lambda: httpx.AsyncClient(transport=httpx.MockTransport(media_handler))
+    media.fetch_media = recorder.timed("media_download", media.fetch_media)
+    media.prepare_image = recorder.timed("preprocess", media.prepare_image)
+    media.upload_image = recorder.timed("upload", media.upload_image)
+
+    def upload(data: bytes) -> str:
+        time.sleep(latencies.jitter(latencies.upload))
+        return f"https://res.cloudinary.test/{uuid.uuid4().hex}.jpg"
+
+    image.upload_to_cloudinary = upload
+
+
+# Traffic
+
+
+@dataclass
+class Delivery:
+    kind: str
+    form: Dict[str, str]
+    retry: bool = False
+
+
+def conversation(kind: str, n: int) -> List[Delivery]:
+    """The webhook deliveries one arriving conversation makes, in order."""
+    sender = f"whatsapp:+1555{n:07d}"
+
+    def form(body: str, **extra: str) -> Dict[str, str]:
+        return {"From": sender, "To": "whatsapp:+14155238886", "Body": body, "MessageSid": f"SM{uuid.uuid4().hex}", "NumMedia": "0", **extra}
+
+    if kind == "text":
+        return [Delivery(kind, form(random.choice(TEXT_MESSAGES)))]
+    if kind == "multi_turn":
+        return [Delivery(kind, form(body)) for body in CONVERSATION]
+    if kind == "image":
+        photo = random.randrange(4)
+        media_form = {
+            "NumMedia": "1",
+            "MediaUrl0": f"https://api.twilio.com/2010-04-01/Accounts/ACtest/Messages/MM{n}/Media/{photo}",
+            "MediaContentType0": "image/jpeg",
+        }
+        return [Delivery(kind, form("What is this rash?", **media_form))]
+    if kind == "retry":
+        first = form(random.choice(TEXT_MESSAGES))
+        return [Delivery(kind, first), Delivery(kind, dict(first), retry=True)]
+    raise ValueError(kind)
+
+
+KINDS = {"text": 0.4, "multi_turn": 0.2, "image": 0.25, "retry": 0.15}
+
+
+async def _loop_lag(samples: List[float], interval: float = 0.01) -> None:
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def run_app(name: str, rate: float, duration: float, latencies: Latencies, recorder: Recorder, seed: int) -> Dict[str, Any]:
+    import importlib
+
+    import httpx
+
+    random.seed(seed)
+    recorder.samples.clear()
+    module = importlib.import_module(name)
+    if name == "dermaAssistant":
+        # The knowledge base needs an embedding model; the stub model never searches it
+        module.components.provide("kb", None)
+        # Async webhook mode replies through the REST client
+        module.components.provide("twilio", type("StubTwilioClient", (), {"messages": StubTwilioMessages(latencies, recorder)})())
+
+    app = module.app
+    results: List[Dict[str, Any]] = []
+    lag: List[float] = []
+    async with app.router.lifespan_context(app):
+        monitor = asyncio.create_task(_loop_lag(lag))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120) as client:
+
+            async def deliver(delivery: Delivery) -> None:
+                if delivery.retry:
+                    # Twilio retries after its timeout; this one lands while the first is in flight
+                    await asyncio.sleep(random.uniform(0.05, 0.5))
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/twilio/whatsapp", data=delivery.form)
+                    ok = response.status_code == 200 and "Sorry" not in response.text
+                except Exception as e:
+                    print(f"[WARN] {name} request failed: {e}")
+                    ok = False
+                results.append({"kind": delivery.kind, "retry": delivery.retry, "seconds": time.perf_counter() - start, "ok": ok})
+
+            async def converse(deliveries: List[Delivery]) -> None:
+                if deliveries[0].kind == "retry":
+                    await asyncio.gather(*(deliver(d) for d in deliveries))
+                    return
+                for delivery in deliveries:
+                    await deliver(delivery)
+
+            tasks = []
+            start = time.perf_counter()
+            n = 0
+            kinds, weights = zip(*KINDS.items())
+            while time.perf_counter() - start < duration:
+                deliveries = conversation(random.choices(kinds, weights)[0], n)
+                n += 1
+                tasks.append(asyncio.create_task(converse(deliveries)))
+                # Arrivals are counted in webhook requests, so long conversations space out the next one
+                await asyncio.sleep(random.expovariate(rate / len(deliveries)))
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - start
+        monitor.cancel()
+
+    by_kind: Dict[str, List[float]] = defaultdict(list)
+    for result in results:
+        by_kind[result["kind"] + ("_replayed" if result["retry"] else "")].append(result["seconds"])
+    report = {
+        "requests": len(results),
+        "errors": sum(1 for r in results if not r["ok"]),
+        "throughput_rps": round(len(results) / elapsed, 2),
+        "latency": _summary([r["seconds"] for r in results]),
+        "by_kind": {kind: _summary(values) for kind, values in sorted(by_kind.items())},
+        "stages": recorder.report(),
+        "event_loop_lag": _summary(lag),
+    }
+    print(f"[INFO] {name}: {report['requests']} requests, {report['errors']} errors, {report['throughput_rps']} req/s, latency {report['latency']}")
+    return report
+
+
+def _commit() -> Optional[str]:
+    with contextlib.suppress(Exception):
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    return None
+
+
+def compare(baseline: Dict[str, Any], report: Dict[str, Any]) -> None:
+    """Print p50/p95/p99 changes against an earlier report."""
+    for app, result in report["apps"].items():
+        before = baseline.get("apps", {}).get(app)
+        if not before:
+            continue
+        rows = [("all", before["latency"], result["latency"])]
+        rows += [(f"stage {s}", before["stages"].get(s, {}), v) for s, v in result["stages"].items()]
+        rows += [("loop lag", before["event_loop_lag"], result["event_loop_lag"])]
+        print(f"--- {app}: {baseline.get('commit')} -> {report.get('commit')}")
+        for label, old, new in rows:
+            cells = []
+            for key in ("p50_ms", "p95_ms", "p99_ms"):
+                if key in old and key in new:
+                    change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                    cells.append(f"{key[:3]} {old[key]:>8} -> {new[key]:>8} ({change:+.0f}%)")
+            if cells:
+                print(f"{label:<24}" + "  ".join(cells))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Offline load test for the WhatsApp webhooks")
+    parser.add_argument("--apps", default="dermaAssistant,twilio_response", help="comma-separated app modules")
+    parser.add_argument("--rate", type=float, default=5.0, help="webhook requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of arrivals per app")
+    parser.add_argument("--model-latency", type=float, default=Latencies.model)
+    parser.add_argument("--tool-latency", type=float, default=Latencies.tool)
+    parser.add_argument("--media-latency", type=float, default=Latencies.media)
+    parser.add_argument("--upload-latency", type=float, default=Latencies.upload)
+    parser.add_argument("--twilio-latency", type=float, default=Latencies.twilio)
+    parser.add_argument("--tool-rate", type=float, default=Latencies.tool_rate, help="share of model calls that search first")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", dest="json_path", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args(argv)
+
+    latencies = Latencies(args.model_latency, args.tool_latency, args.media_latency, args.upload_latency, args.twilio_latency, args.tool_rate)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Credentials the apps read at import time; nothing uses them
+    for name, value in {"TWILIO_ACCOUNT_SID": "ACloadtest", "TWILIO_AUTH_TOKEN": "loadtest", "TWILIO_PHONE_NUMBER": "+14155238886",
+                        "GROQ_API_KEY": "loadtest", "RETENTION_INTERVAL": "0"}.items():
+        os.environ.setdefault(name, value)
+    sys.path.insert(0, REPO_DIR)
+    workdir = tempfile.mkdtemp(prefix="derma-loadtest-")
+    os.chdir(workdir)
+    os.makedirs("tmp", exist_ok=True)
+    print(f"[INFO] Working directory {workdir}")
+
+    report: Dict[str, Any] = {
+        "commit": _commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"rate": args.rate, "duration": args.duration, "seed": args.seed, "latencies": latencies.__dict__, "kinds": KINDS},
+        "apps": {},
+    }
+    recorder = Recorder()
+    install_stubs(latencies, recorder)
+    for name in [a.strip() for a in args.apps.split(",") if a.strip()]:
+        report["apps"][name] = asyncio.run(run_app(name, args.rate, args.duration, latencies, recorder, args.seed))
+
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Report written to {json_path}")
+    else:
+        print(json.dumps(report, indent=2))
+    if baseline:
+        compare(baseline, report)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,176 @@
+"""Async media handling for incoming WhatsApp attachments."""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Mapping, Optional, Tuple
+
+import httpx
+from PIL import Image, UnidentifiedImageError
+
+from http_client import RETRY_STATUSES, backoff_delay, get_client
+from image_prep import SeenImage, image_dedup, prepare_image
+from media_store import store_from_env
+from telemetry import get_logger, span, timed
+
+log = get_logger(__name__)
+
+# Phone photos are a few MB; anything much larger is not worth downloading
+MAX_MEDIA_BYTES = int(os.getenv("MAX_MEDIA_BYTES", str(16 * 1024 * 1024)))
+# Cloudinary's SDK is blocking and image decoding is CPU-bound, so both run
+# on a small dedicated pool
+upload_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("MEDIA_UPLOAD_WORKERS", "4")),
+    thread_name_prefix="media-upload",
+)
+# Where the model fetches images from: Cloudinary, the local store or inline (see media_store.py)
+media_store = store_from_env(upload_executor)
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+@dataclass
+class HostedImage:
+    url: str
+    # The dedup record for this picture; `duplicate` when it was seen before
+    seen: Optional[SeenImage] = None
+    duplicate: bool = False
+
+
+@timed("media.download")
+async def fetch_media(
+    url: str,
+    auth: Optional[Tuple[str, str]] = None,
+    headers: Optional[Mapping[str, str]] = None,
+    max_bytes: int = MAX_MEDIA_BYTES,
+    retries: int = 2,
+    client: Optional[httpx.AsyncClient] = None,
+) -> bytes:
+    """
+    Stream a media file into memory over the shared client, refusing anything over `max_bytes`.
+
+    The size is checked against Content-Length up front and again while reading,
+    so an oversized or mislabelled body is abandoned without being buffered whole.
+    Transport errors and 429/5xx responses are retried with backoff.
+    """
+    client = client or get_client()
+    for attempt in range(retries + 1):
+        try:
+            async with client.stream("GET", url, auth=auth, headers=headers, follow_redirects=True) as response:
+                if response.status_code in RETRY_STATUSES and attempt < retries:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+                response.raise_for_status()
+                declared = response.headers.get("content-length")
+                if declared and int(declared) > max_bytes:
+                    raise MediaTooLarge(f"{declared} bytes exceeds the {max_bytes} byte limit")
+                chunks = []
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received > max_bytes:
+                        raise MediaTooLarge(f"body exceeds the {max_bytes} byte limit")
+                    chunks.append(chunk)
+                return b"".join(chunks)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+            await asyncio.sleep(backoff_delay(attempt))
+    raise RuntimeError("unreachable")
+
+
+@timed("media.upload")
+async def upload_image(image_bytes: bytes, content_type: str = "image/jpeg") -> Optional[str]:
+    """Host an image on the configured media backend without blocking the event loop."""
+    return await media_store.put(image_bytes, content_type)
+
+
+async def host_image(image_bytes: bytes, sender: str) -> Optional[HostedImage]:
+    """
+    Preprocess a patient photo and upload it, unless the sender already sent it.
+
+    A repeat or near-duplicate (see image_prep.ImageDedup) reuses the earlier
+    upload. Bytes Pillow cannot decode are uploaded as they are.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        with span("media.preprocess", bytes=len(image_bytes)):
+            prepared = await loop.run_in_executor(upload_executor, prepare_image, image_bytes)
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError) as e:
+        log.warning(f"Could not preprocess image ({e}); uploading it unchanged")
+        url = await upload_image(image_bytes, "application/octet-stream")
+        return HostedImage(url=url) if url else None
+
+    seen = image_dedup.lookup(sender, prepared.phash)
+    if seen is not None:
+        url = await media_store.reuse(seen.url)
+        if url:
+            log.debug("Image from %s matches one sent earlier; reusing its upload", sender)
+            return HostedImage(url=url, seen=seen, duplicate=True)
+    url = await upload_image(prepared.data, prepared.content_type)
+    if not url:
+        return None
+    if seen is not None:
+        # The earlier copy was evicted from the store; keep the analysis, point at the new upload
+        seen.url = url
+        image_dedup.update(seen)
+        return HostedImage(url=url, seen=seen, duplicate=True)
+    log.debug("Uploaded %d bytes (%dx%d) instead of %d", len(prepared.data), prepared.width, prepared.height, prepared.original_bytes)
+    return HostedImage(url=url, seen=image_dedup.remember(sender, prepared.phash, url))
+
+
+def earlier_reply(images: List[HostedImage], caption: str) -> Optional[str]:
+    """The analysis already given for exactly these pictures and caption, if any."""
+    if not images or not all(image.duplicate for image in images):
+        return None
+    replies = {image.seen.reply for image in images}
+    captions = {image.seen.caption for image in images}
+    if len(replies) != 1 or None in replies or (caption.strip() and captions != {caption.strip()}):
+        return None
+    return replies.pop()
+
+
+def remember_reply(images: List[HostedImage], caption: str, reply: str) -> None:
+    for image in images:
+        if image.seen is not None:
+            image.seen.caption = caption.strip()
+            image.seen.reply = reply
+            image_dedup.update(image.seen)
+
+
+def twilio_attachments(form: Mapping[str, str]) -> List[Tuple[str, str]]:
+    """(MediaUrlN, MediaContentTypeN) pairs from a Twilio webhook form."""
+    try:
+        count = int(form.get("NumMedia") or 0)
+    except ValueError:
+        count = 0
+    # Older payloads and some tests only send MediaUrl0
+    count = max(count, 1 if form.get("MediaUrl0") else 0)
+    attachments = []
+    for n in range(count):
+        url = form.get(f"MediaUrl{n}")
+        if url:
+            attachments.append((str(url), str(form.get(f"MediaContentType{n}") or "")))
+    return attachments
+
+
+async def _twilio_image(url: str, auth: Tuple[str, str], sender: str) -> Optional[HostedImage]:
+    try:
+        image_bytes = await fetch_media(url, auth=auth)
+    except (httpx.HTTPError, MediaTooLarge) as e:
+        log.error(f"Failed to download media {url}: {e}")
+        return None
+    return await host_image(image_bytes, sender)
+
+
+async def twilio_images(attachments: List[Tuple[str, str]], auth: Tuple[str, str], sender: str) -> List[Optional[HostedImage]]:
+    """
+    Download, preprocess and re-host every image attachment concurrently.
+
+    Returns one HostedImage per image attachment, in order, with None for
+    attachments that could not be downloaded or uploaded.
+    """
+    images = [url for url, content_type in attachments if not content_type or content_type.startswith("image/")]
+    return list(await asyncio.gather(*(_twilio_image(url, auth, sender) for url in images)))
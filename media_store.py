@@ -0,0 +1,294 @@
+"""
+Pluggable hosting for patient images the vision model has to fetch.
+
+MEDIA_BACKEND picks the backend per deployment:
+
+* "cloudinary" (default): upload to Cloudinary, as before;
+* "local": LocalMediaStore, a content-addressed directory served by this app
+  under /media with short-lived signed URLs, which saves the upload to a third
+  party and one transfer per image.
+
+Independently of the backend, images up to MEDIA_INLINE_BYTES are sent to the
+model inline as a base64 data URL and never stored at all (0 disables this).
+"""
+import asyncio
+import base64
+import glob
+import hashlib
+import hmac
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from telemetry import REGISTRY, get_logger
+
+log = get_logger(__name__)
+
+MEDIA_IMAGES = REGISTRY.counter(
+    "derma_media_images_total", "Images handled by the media store, by backend and outcome", ["backend", "outcome"]
+)
+
+# Stored files are named <sha256 hex>[.ext]
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+
+
+class MediaBackend:
+    """Somewhere the model provider can fetch an image from."""
+
+    name = "base"
+
+    async def put(self, data: bytes, content_type: str) -> Optional[str]:
+        """Store `data` and return a URL for it, or None on failure."""
+        raise NotImplementedError
+
+    async def reuse(self, url: str) -> Optional[str]:
+        """A usable URL for media stored earlier under `url`, or None if it is gone."""
+        return url
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class CloudinaryBackend(MediaBackend):
+    name = "cloudinary"
+
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None):
+        # Cloudinary's SDK is blocking
+        self.executor = executor
+
+    async def put(self, data: bytes, content_type: str) -> Optional[str]:
+        from image import upload_to_cloudinary
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, upload_to_cloudinary, data)
+
+
+class LocalMediaStore(MediaBackend):
+    """
+    Files under `root` named by the SHA-256 of their content.
+
+    Storing the same bytes twice is free. The directory is the only index, so
+    every worker sharing `root` can serve every other worker's URLs, and
+    `max_bytes` caps the directory as a whole: past it, the files least recently
+    stored or reused (oldest mtime) are deleted. URLs point at
+    `public_url`/media/<key> and carry an HMAC signature that expires after
+    `url_ttl` seconds; every worker serving the URLs needs the same `secret`.
+    """
+
+    name = "local"
+
+    def __init__(self, root: str, public_url: str, secret: bytes, max_bytes: int = 1 << 30, url_ttl: float = 900.0):
+        self.root = root
+        self.public_url = public_url.rstrip("/")
+        self.secret = secret
+        self.max_bytes = max_bytes
+        self.url_ttl = url_ttl
+        # File name by key; only a hint, the directory decides what exists
+        self._names: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self.counts = {"stored": 0, "deduplicated": 0, "evicted": 0}
+        os.makedirs(root, exist_ok=True)
+
+    def _scan(self) -> List[Tuple[float, str, int]]:
+        """(mtime, file name, size) of every stored file, oldest first."""
+        entries = []
+        for entry in os.scandir(self.root):
+            if KEY_PATTERN.fullmatch(entry.name.split(".", 1)[0]) and not entry.name.endswith(".tmp"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        return sorted(entries)
+
+    def sign(self, key: str, expires: Optional[int] = None) -> str:
+        expires = expires or int(time.time() + self.url_ttl)
+        signature = hmac.new(self.secret, f"{key}:{expires}".encode(), hashlib.sha256).hexdigest()
+        return f"{self.public_url}/media/{key}?exp={expires}&sig={signature}"
+
+    def verify(self, key: str, expires: int, signature: str) -> bool:
+        if expires < time.time():
+            return False
+        expected = hmac.new(self.secret, f"{key}:{expires}".encode(), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature)
+
+    def path_for(self, key: str) -> Optional[str]:
+        """Path of the file stored under `key` by any worker, or None if there is none."""
+        if not KEY_PATTERN.fullmatch(key):
+            return None
+        with self._lock:
+            name = self._names.get(key)
+        if name and os.path.isfile(os.path.join(self.root, name)):
+            return os.path.join(self.root, name)
+        for path in glob.glob(os.path.join(self.root, glob.escape(key) + "*")):
+            name = os.path.basename(path)
+            if name.split(".", 1)[0] == key and not name.endswith(".tmp"):
+                with self._lock:
+                    self._names[key] = name
+                return path
+        with self._lock:
+            self._names.pop(key, None)
+        return None
+
+    def _touch(self, path: str) -> bool:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another worker meanwhile
+            return False
+        return True
+
+    def _store(self, data: bytes, content_type: str) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path_for(key)
+        if path is not None and self._touch(path):
+            with self._lock:
+                self.counts["deduplicated"] += 1
+            MEDIA_IMAGES.inc(backend=self.name, outcome="deduplicated")
+            return key
+        name = key + (mimetypes.guess_extension(content_type) or "")
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._names[key] = name
+            self.counts["stored"] += 1
+        MEDIA_IMAGES.inc(backend=self.name, outcome="stored")
+        self._evict(keep=name)
+        return key
+
+    def _evict(self, keep: str) -> None:
+        """Delete the oldest files until the directory fits in `max_bytes`."""
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        for _, name, size in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(self.root, name))
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        if evicted:
+            with self._lock:
+                self.counts["evicted"] += evicted
+            MEDIA_IMAGES.inc(evicted, backend=self.name, outcome="evicted")
+
+    async def put(self, data: bytes, content_type: str) -> Optional[str]:
+        try:
+            key = await asyncio.to_thread(self._store, data, content_type)
+        except OSError as e:
+            log.error(f"Could not store media locally: {e}")
+            return None
+        return self.sign(key)
+
+    async def reuse(self, url: str) -> Optional[str]:
+        key = urlsplit(url).path.rsplit("/", 1)[-1]
+        path = self.path_for(key)
+        if path is None or not self._touch(path):
+            return None
+        return self.sign(key)
+
+    def stats(self) -> dict:
+        entries = self._scan()
+        with self._lock:
+            counts = dict(self.counts)
+        return {"backend": self.name, "files": len(entries), "bytes": sum(size for _, _, size in entries), **counts}
+
+
+def data_url(data: bytes, content_type: str) -> str:
+    return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+
+
+class MediaStore:
+    """Inline small images; hand everything else to `backend`."""
+
+    def __init__(self, backend: MediaBackend, inline_bytes: int = 0):
+        self.backend = backend
+        self.inline_bytes = inline_bytes
+        self.counts = {"inline": 0, "hosted": 0, "reused": 0}
+
+    async def put(self, data: bytes, content_type: str = "image/jpeg") -> Optional[str]:
+        if len(data) <= self.inline_bytes:
+            self.counts["inline"] += 1
+            MEDIA_IMAGES.inc(backend=self.backend.name, outcome="inline")
+            return data_url(data, content_type)
+        url = await self.backend.put(data, content_type)
+        if url:
+            self.counts["hosted"] += 1
+            MEDIA_IMAGES.inc(backend=self.backend.name, outcome="hosted")
+        return url
+
+    async def reuse(self, url: str) -> Optional[str]:
+        if url.startswith("data:"):
+            return url
+        url = await self.backend.reuse(url)
+        if url:
+            self.counts["reused"] += 1
+            MEDIA_IMAGES.inc(backend=self.backend.name, outcome="reused")
+        return url
+
+    def stats(self) -> dict:
+        return {**self.backend.stats(), "inline_bytes": self.inline_bytes, **self.counts}
+
+
+def store_from_env(executor: Optional[ThreadPoolExecutor] = None) -> MediaStore:
+    """
+    MEDIA_BACKEND ("cloudinary" or "local") and MEDIA_INLINE_BYTES; the local
+    store also reads MEDIA_DIR, MEDIA_PUBLIC_URL, MEDIA_URL_SECRET,
+    MEDIA_URL_TTL and MEDIA_MAX_BYTES.
+    """
+    backend_name = os.getenv("MEDIA_BACKEND", "cloudinary")
+    if backend_name == "local":
+        secret = os.getenv("MEDIA_URL_SECRET")
+        if not secret:
+            # A per-process secret would make every other worker reject the URLs
+            raise ValueError("MEDIA_BACKEND=local needs MEDIA_URL_SECRET, shared by every worker")
+        backend: MediaBackend = LocalMediaStore(
+            root=os.getenv("MEDIA_DIR", "tmp/media"),
+            public_url=os.getenv("MEDIA_PUBLIC_URL", "http://localhost:8000"),
+            secret=secret.encode(),
+            max_bytes=int(os.getenv("MEDIA_MAX_BYTES", str(1 << 30))),
+            url_ttl=float(os.getenv("MEDIA_URL_TTL", "900")),
+        )
+    elif backend_name == "cloudinary":
+        backend = CloudinaryBackend(executor)
+    else:
+        raise ValueError(f"unknown MEDIA_BACKEND {backend_name!r}")
+    return MediaStore(backend, inline_bytes=int(os.getenv("MEDIA_INLINE_BYTES", "0")))
+
+
+def media_router(store: MediaStore) -> APIRouter:
+    """
+    GET /media/{key} for the local store's signed URLs; serves nothing for other backends.
+
+    Nothing else is public here: the store's counts are exported as
+    derma_media_images_total on the internal /metrics endpoint.
+    """
+    router = APIRouter()
+
+    @router.get("/media/{key}")
+    async def get_media(key: str, exp: int, sig: str):
+        backend = store.backend
+        if not isinstance(backend, LocalMediaStore) or not backend.verify(key, exp, sig):
+            raise HTTPException(status_code=404)
+        path = backend.path_for(key)
+        if path is None:
+            raise HTTPException(status_code=404)
+        return FileResponse(path, headers={"Cache-Control": f"private, max-age={int(backend.url_ttl)}"})
+
+    return router
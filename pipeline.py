@@ -0,0 +1,224 @@
+"""
+Direct-dispatch consultation pipeline.
+
+    python -m pipeline                  # tokens and latency per consultation, team vs pipeline
+    python -m pipeline --json report.json
+
+In team mode every message goes to the Team coordinator model first, which
+spends a round-trip deciding to hand over to the Conversation Handler and then
+to the Medical Analyzer. ConsultationPipeline runs that fixed workflow as an
+explicit state machine instead:
+
+* collect:  ClinicalIntake fills the ClinicalInfo fields and asks for whatever
+  is missing, locally;
+* validate: the completed record is checked and turned into a ClinicalInfo;
+* analyze:  the Medical Analyzer runs directly on it.
+
+Only off-script turns go to the coordinator: general questions before any
+clinical details, and follow-ups once the assessment has been given.
+"""
+import argparse
+import asyncio
+import json
+import time
+from dataclasses import dataclass, fields
+from enum import Enum
+from typing import Any, Dict, List, Optional, Sequence
+
+from clinical_extractor import QUESTIONS, ClinicalIntake
+from clinical_tools import ClinicalInfo
+from telemetry import get_logger, percentile
+
+log = get_logger(__name__)
+
+
+class Stage(str, Enum):
+    COLLECT = "collect"
+    VALIDATE = "validate"
+    ANALYZE = "analyze"
+    DONE = "done"
+
+
+@dataclass
+class Consultation(ClinicalIntake):
+    """A ClinicalIntake that also tracks where the consultation is in the pipeline."""
+
+    stage: Stage = Stage.COLLECT
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Consultation":
+        consultation = super().from_dict(data)
+        consultation.stage = Stage(consultation.stage)
+        return consultation
+
+
+def validate(consultation: Consultation) -> ClinicalInfo:
+    """The consultation's ClinicalInfo; ValueError names any field that is still missing."""
+    missing = consultation.missing()
+    if missing:
+        raise ValueError(f"missing clinical fields: {', '.join(missing)}")
+    return consultation.info()
+
+
+class ConsultationPipeline:
+    """
+    collect -> validate -> analyze, calling `coordinator` only for off-script turns.
+
+    `arun` returns the local reply as a str, or the run response of whichever
+    agent or team answered.
+    """
+
+    def __init__(self, coordinator, analyzer):
+        self.coordinator = coordinator
+        self.analyzer = analyzer
+        # Turns answered locally, records validated, analyses run and turns sent to the coordinator
+        self.counts = {"collect": 0, "validate": 0, "analyze": 0, "coordinator": 0}
+
+    @property
+    def members(self) -> List[Any]:
+        # Lets sessions.forget_session_runs reach both agents
+        return [self.coordinator, self.analyzer]
+
+    async def arun(self, message: str, consultation: Consultation, session_id: str, user_id: Optional[str] = None) -> Any:
+        if consultation.stage == Stage.COLLECT:
+            step = consultation.step(message)
+            if step.reply:
+                self.counts[Stage.COLLECT.value] += 1
+                return step.reply
+            if not consultation.complete:
+                return await self._off_script(message, consultation, session_id, user_id)
+            consultation.stage = Stage.VALIDATE
+            prompt = step.prompt
+        elif consultation.stage == Stage.DONE:
+            return await self._off_script(message, consultation, session_id, user_id)
+        else:
+            # A validate or analyze turn that failed; retry it with the record so far
+            prompt = None
+
+        self.counts[Stage.VALIDATE.value] += 1
+        try:
+            info = validate(consultation)
+        except ValueError as e:
+            log.warning(f"Consultation failed validation ({e}); collecting again")
+            consultation.stage = Stage.COLLECT
+            consultation.complete = False
+            consultation.asked = consultation.missing()
+            return "To assess this properly, please tell me:\n" + "\n".join(
+                f"{n}. {QUESTIONS[name]}" for n, name in enumerate(consultation.asked, 1)
+            )
+
+        consultation.stage = Stage.ANALYZE
+        self.counts[Stage.ANALYZE.value] += 1
+        log.debug("Clinical record complete; running %s directly", self.analyzer.name)
+        response = await self.analyzer.arun(prompt or _record_prompt(info, message), session_id=session_id, user_id=user_id)
+        consultation.stage = Stage.DONE
+        return response
+
+    async def _off_script(self, message: str, consultation: Consultation, session_id: str, user_id: Optional[str]) -> Any:
+        self.counts["coordinator"] += 1
+        prompt = message
+        if consultation.stage == Stage.DONE:
+            # The coordinator did not see the analysis run, so give it the record it was based on
+            prompt = _record_prompt(consultation.info(), message, assessed=True)
+        log.debug("Off-script turn in stage %s; calling the coordinator", consultation.stage.value)
+        return await self.coordinator.arun(prompt, session_id=session_id, user_id=user_id)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counts)
+
+
+def _record_prompt(info: ClinicalInfo, message: str, assessed: bool = False) -> str:
+    heading = "Clinical information already collected and assessed:" if assessed else "Clinical information collected from the patient:"
+    lines = [heading] + [f"- {f.name.capitalize()}: {getattr(info, f.name)}" for f in fields(ClinicalInfo)]
+    return "\n".join(lines + ["Patient's message:", f"> {message}"])
+
+
+# Benchmark
+
+SCRIPTS: List[List[str]] = [
+    ["Hi", "I have a rash on my left forearm", "About 2 weeks, red and scaly, about 3 cm", "It is itchy"],
+    ["I've had a dark mole on my back for years, it's irregular and about 7mm. No pain or itching."],
+    ["What causes eczema?", "I have dry, cracked patches on both hands since last winter, they burn"],
+    ["I have red bumps on my chin", "For a few days", "Sore and painful", "Should I pop them?"],
+]
+
+
+@dataclass
+class Usage:
+    calls: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    seconds: float = 0.0
+
+    def add(self, response: Any) -> None:
+        """Count the model calls and tokens in a run response and its member responses."""
+        if isinstance(response, str) or response is None:
+            return
+        metrics = getattr(response, "metrics", None) or {}
+        self.calls += len(metrics.get("input_tokens", []))
+        self.input_tokens += sum(metrics.get("input_tokens", []))
+        self.output_tokens += sum(metrics.get("output_tokens", []))
+        for member in getattr(response, "member_responses", None) or []:
+            self.add(member)
+
+
+async def bench(modes: Sequence[str], scripts: List[List[str]], repeat: int = 1) -> Dict[str, Dict[str, float]]:
+    """
+    Run every script through dermaAssistant.consult in each mode and average per consultation.
+
+    The "team" baseline runs with CLINICAL_INTAKE off, so every turn goes through the coordinator.
+    """
+    import dermaAssistant as derma
+    from sessions import ConversationSession
+
+    report: Dict[str, Dict[str, float]] = {}
+    clinical_intake = derma.clinical_intake
+    try:
+        for mode in modes:
+            derma.clinical_intake = "off" if mode == "team" else clinical_intake
+            derma.components.provide("team", await derma.create_teams(mode))
+            results: List[Usage] = []
+            for r in range(repeat):
+                for n, script in enumerate(scripts):
+                    session = ConversationSession(sender=f"bench-{mode}-{r}-{n}", epoch=int(time.time()))
+                    usage = Usage()
+                    start = time.perf_counter()
+                    for message in script:
+                        usage.add(await derma.consult(message, session, session.sender))
+                    usage.seconds = time.perf_counter() - start
+                    results.append(usage)
+            count = len(results)
+            report[mode] = {
+                "consultations": count,
+                "llm_calls": round(sum(u.calls for u in results) / count, 2),
+                "input_tokens": round(sum(u.input_tokens for u in results) / count, 1),
+                "output_tokens": round(sum(u.output_tokens for u in results) / count, 1),
+                "latency_mean_s": round(sum(u.seconds for u in results) / count, 2),
+                "latency_p95_s": round(percentile([u.seconds for u in results], 95), 2),
+            }
+            print(f"[INFO] {mode}: {report[mode]}")
+    finally:
+        derma.clinical_intake = clinical_intake
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare tokens and latency per consultation: Team coordinator vs pipeline")
+    parser.add_argument("--modes", default="team,pipeline", help="comma-separated create_teams() modes")
+    parser.add_argument("--repeat", type=int, default=1, help="times to run each scripted consultation")
+    parser.add_argument("--json", dest="json_path", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(bench([m.strip() for m in args.modes.split(",") if m.strip()], SCRIPTS, repeat=args.repeat))
+    columns = ["llm_calls", "input_tokens", "output_tokens", "latency_mean_s", "latency_p95_s"]
+    print(f"{'mode':<10}" + "".join(f"{c:>16}" for c in columns))
+    for mode, row in report.items():
+        print(f"{mode:<10}" + "".join(f"{row[c]:>16}" for c in columns))
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,8 +5,7 @@ from agno.models.groq import Groq
 #from agno.media import Image
 #from agno.playground import Playground, serve_playground_app
 from agno.storage.sqlite import SqliteStorage
-from agno.tools.duckduckgo import DuckDuckGoTools
-from agno.tools.pubmed import PubmedTools
+from tool_cache import CachedDuckDuckGoTools, CachedPubmedTools
 from skin.skin_kb import DermaKnowledgeBase
 #wozzap
 from agno.app.whatsapp.app import WhatsappAPI
@@ -23,7 +22,7 @@ load_dotenv()
 
 agent_storage: str = "tmp/agents.db"
 
-# Load derma knowledge base (async only for this step)
+# Open the derma knowledge base read-only; it is built by `python -m skin.ingest`
 def load_derma_kb():
     kb = DermaKnowledgeBase(
         table_name="derma_knowledge",
@@ -31,9 +30,7 @@ def load_derma_kb():
         pdf_paths=["resources"],
         urls = [""]
     )
-    import asyncio
-    asyncio.run(kb.aload(upsert=True, recreate=False))
-    return kb
+    return kb.open()
 
 # Main entry point (sync)
 def main():
@@ -42,7 +39,7 @@ def main():
     web_agent = Agent(
         name="Web Agent",
         model=Groq(id="meta-llama/llama-4-maverick-17b-128e-instruct"),
-        tools=[DuckDuckGoTools()],
+        tools=[CachedDuckDuckGoTools()],
         instructions=["""
         You are a Dermatology Diagnosis Assistant designed to help clinicians accurately diagnose dermatological conditions. 
         Given a clinical description, image, or set of features, analyze and summarize the key lesion characteristics, and then proceed with the following structure:
@@ -82,7 +79,7 @@ def main():
     med_agent = Agent(
         name="Medical Agent",
         model=Groq(id="llama-3.3-70b-versatile"),
-        tools=[DuckDuckGoTools(),PubmedTools()],
+        tools=[CachedDuckDuckGoTools(),CachedPubmedTools()],
         show_tool_calls=True,
         instructions=["Always include sources"],
         storage=SqliteStorage(table_name="med_agent", db_file=agent_storage),
@@ -95,7 +92,7 @@ def main():
     derma_agent = Agent(
         name="Derma Agent",
         model=Groq(id="meta-llama/llama-4-scout-17b-16e-instruct"), 
-        tools=[DuckDuckGoTools(), PubmedTools()],
+        tools=[CachedDuckDuckGoTools(), CachedPubmedTools()],
         knowledge=kb.get_knowledge_base(),
         show_tool_calls=True,
         instructions=[
@@ -0,0 +1,307 @@
+"""
+Retention for agent session and memory databases.
+
+    python -m retention                          # one incremental pass over every database
+    python -m retention --db-file tmp/agents.db
+    python -m retention --every 3600             # a pass every hour, until stopped
+
+agno writes the full run history of a session back into that session's row on
+every turn, along with every user memory and summary its Memory object holds. A
+returning patient's row therefore grows forever, and every turn pays to decode
+it. Each pass of this module:
+
+* archives and deletes sessions idle for longer than `session_ttl`;
+* keeps the newest `max_runs` runs of a session and archives the rest;
+* compacts each session's memory blob down to its own user's memories and
+  summaries and its own team context;
+* archives and deletes user-memory rows not updated within `memory_ttl`;
+* optionally drops archive rows older than `archive_ttl`.
+
+Archived data goes into a `retention_archive` table as zlib-compressed JSON.
+Rows are handled `batch_size` at a time: candidates are read from the WAL read
+pool, and each batch is written as one short transaction through the file's
+single writer (see sqlite_store). Each write only applies if the row has not
+changed since it was read, so a session that is written mid-pass is left for
+the next pass.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import zlib
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import text
+
+from sqlite_store import SqliteWriter, get_writer
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+ARCHIVE_TABLE = "retention_archive"
+DAY = 86400.0
+
+
+@dataclass
+class RetentionPolicy:
+    session_ttl: float = 90 * DAY  # 0 keeps sessions forever
+    max_runs: int = 20  # runs kept in a live session row
+    memory_ttl: float = 365 * DAY  # 0 keeps user memories forever
+    archive_ttl: float = 0.0  # 0 keeps archived data forever
+    min_idle: float = 600.0  # leave sessions written this recently alone
+    batch_size: int = 50
+    pause: float = 0.05  # seconds between batches
+
+    @classmethod
+    def from_env(cls) -> "RetentionPolicy":
+        """RETENTION_SESSION_DAYS, RETENTION_MAX_RUNS, RETENTION_MEMORY_DAYS, RETENTION_ARCHIVE_DAYS."""
+        policy = cls()
+        for name, attr, scale in (
+            ("RETENTION_SESSION_DAYS", "session_ttl", DAY),
+            ("RETENTION_MAX_RUNS", "max_runs", 1),
+            ("RETENTION_MEMORY_DAYS", "memory_ttl", DAY),
+            ("RETENTION_ARCHIVE_DAYS", "archive_ttl", DAY),
+        ):
+            value = os.getenv(name)
+            if value:
+                setattr(policy, attr, type(getattr(policy, attr))(float(value) * scale))
+        return policy
+
+
+def _columns(connection, table: str) -> set:
+    return {row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table}")')}
+
+
+def discover_tables(writer: SqliteWriter) -> Dict[str, List[str]]:
+    """agno session tables and user-memory tables in the writer's database."""
+    found: Dict[str, List[str]] = {"sessions": [], "memories": []}
+    with writer.engine.connect() as connection:
+        names = [row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for name in names:
+            if name == ARCHIVE_TABLE:
+                continue
+            columns = _columns(connection, name)
+            if {"session_id", "memory", "session_data", "updated_at"} <= columns:
+                found["sessions"].append(name)
+            elif {"id", "user_id", "memory", "updated_at"} <= columns:
+                found["memories"].append(name)
+    return found
+
+
+def _pack(payload: Any) -> bytes:
+    return zlib.compress(json.dumps(payload, default=str).encode("utf-8"), 6)
+
+
+def unpack(blob: bytes) -> Any:
+    """Decode one `retention_archive.payload`."""
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def compact_memory(memory: Dict[str, Any], session_id: str, user_id: Optional[str], max_runs: int):
+    """Return (compacted memory, archived runs) for one session row's memory blob."""
+    compacted = dict(memory)
+    runs = memory.get("runs")
+    archived: List[Any] = []
+    if isinstance(runs, list) and len(runs) > max_runs:
+        archived = runs[: len(runs) - max_runs]
+        compacted["runs"] = runs[len(runs) - max_runs:]
+    for key in ("memories", "summaries"):
+        value = memory.get(key)
+        if isinstance(value, dict):
+            compacted[key] = {user: data for user, data in value.items() if user == user_id}
+            if key == "summaries" and user_id in compacted[key] and isinstance(compacted[key][user_id], dict):
+                compacted[key][user_id] = {s: v for s, v in compacted[key][user_id].items() if s == session_id}
+    team_context = memory.get("team_context")
+    if isinstance(team_context, dict):
+        compacted["team_context"] = {s: v for s, v in team_context.items() if s == session_id}
+    return compacted, archived
+
+
+def _archive(source: str, key: str, user_id: Optional[str], kind: str, payload: Any, guard: str, params: Dict[str, Any]):
+    """INSERT into the archive only while the guard row is unchanged."""
+    return text(
+        f'INSERT INTO {ARCHIVE_TABLE} (source_table, key, user_id, kind, archived_at, payload) '
+        f'SELECT :source, :key, :user_id, :kind, :now, :payload WHERE EXISTS ({guard})'
+    ).bindparams(source=source, key=key, user_id=user_id, kind=kind, now=time.time(), payload=_pack(payload), **params)
+
+
+class RetentionEngine:
+    """Incremental retention passes over one SQLite file."""
+
+    def __init__(self, db_file: str, policy: Optional[RetentionPolicy] = None):
+        self.db_file = db_file
+        self.policy = policy or RetentionPolicy.from_env()
+        self.writer = get_writer(db_file)
+        self.writer.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {ARCHIVE_TABLE} ("
+            " id INTEGER PRIMARY KEY, source_table TEXT NOT NULL, key TEXT NOT NULL, user_id TEXT,"
+            " kind TEXT NOT NULL, archived_at REAL NOT NULL, payload BLOB NOT NULL)"
+        ))
+        self.writer.execute(text(
+            f"CREATE INDEX IF NOT EXISTS {ARCHIVE_TABLE}_key ON {ARCHIVE_TABLE} (source_table, key)"
+        ))
+
+    def _commit(self, statements: List[Any]) -> None:
+        if statements:
+            self.writer.execute(statements)
+            time.sleep(self.policy.pause)
+
+    def run_once(self) -> Dict[str, Any]:
+        tables = discover_tables(self.writer)
+        stats: Dict[str, Any] = {
+            "db_file": self.db_file,
+            "sessions_archived": 0,
+            "runs_archived": 0,
+            "sessions_compacted": 0,
+            "memories_archived": 0,
+            "archive_rows_dropped": 0,
+            "bytes_before": 0,
+            "bytes_after": 0,
+        }
+        started = time.perf_counter()
+        for table in tables["sessions"]:
+            self._sessions(table, stats)
+        for table in tables["memories"]:
+            self._memories(table, stats)
+        if self.policy.archive_ttl:
+            stats["archive_rows_dropped"] = self._drop_archive()
+        stats["seconds"] = round(time.perf_counter() - started, 3)
+        return stats
+
+    def _sessions(self, table: str, stats: Dict[str, Any]) -> None:
+        policy = self.policy
+        now = time.time()
+        expire_before = now - policy.session_ttl if policy.session_ttl else 0
+        idle_before = now - policy.min_idle
+        seen = 'COALESCE(updated_at, created_at)'
+        guard = f'SELECT 1 FROM "{table}" WHERE session_id = :session_id AND {seen} IS :seen'
+        cursor = ""
+        while True:
+            with self.writer.engine.connect() as connection:
+                rows = connection.execute(text(f"""
+                    SELECT session_id, user_id, memory, {seen} FROM "{table}"
+                    WHERE session_id > :cursor AND {seen} < :idle_before AND (
+                        {seen} < :expire_before
+                        OR json_array_length(memory, '$.runs') > :max_runs
+                        OR EXISTS (SELECT 1 FROM json_each(memory, '$.memories') WHERE key IS NOT user_id)
+                        OR EXISTS (SELECT 1 FROM json_each(memory, '$.summaries') WHERE key IS NOT user_id)
+                        OR (SELECT count(*) FROM json_each(memory, '$.team_context')) > 1
+                    ) ORDER BY session_id LIMIT :limit
+                """), {
+                    "cursor": cursor, "idle_before": idle_before, "expire_before": expire_before,
+                    "max_runs": policy.max_runs, "limit": policy.batch_size,
+                }).fetchall()
+            if not rows:
+                return
+            statements = []
+            for session_id, user_id, raw_memory, updated in rows:
+                params = {"session_id": session_id, "seen": updated}
+                stats["bytes_before"] += len(raw_memory or "")
+                memory = json.loads(raw_memory) if isinstance(raw_memory, str) else (raw_memory or {})
+                if expire_before and updated < expire_before:
+                    full = {"session_id": session_id, "user_id": user_id, "memory": memory}
+                    statements.append(_archive(table, session_id, user_id, "session", full, guard, params))
+                    statements.append(text(f'DELETE FROM "{table}" WHERE session_id = :session_id AND {seen} IS :seen').bindparams(**params))
+                    stats["sessions_archived"] += 1
+                    continue
+                compacted, archived = compact_memory(memory, session_id, user_id, policy.max_runs)
+                if archived:
+                    statements.append(_archive(table, session_id, user_id, "runs", archived, guard, params))
+                    stats["runs_archived"] += len(archived)
+                encoded = json.dumps(compacted)
+                stats["bytes_after"] += len(encoded)
+                statements.append(text(
+                    f'UPDATE "{table}" SET memory = :memory WHERE session_id = :session_id AND {seen} IS :seen'
+                ).bindparams(memory=encoded, **params))
+                stats["sessions_compacted"] += 1
+            self._commit(statements)
+            cursor = rows[-1][0]
+
+    def _memories(self, table: str, stats: Dict[str, Any]) -> None:
+        if not self.policy.memory_ttl:
+            return
+        cutoff = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - self.policy.memory_ttl))
+        seen = "COALESCE(updated_at, created_at)"
+        guard = f'SELECT 1 FROM "{table}" WHERE id = :id AND {seen} IS :seen'
+        while True:
+            with self.writer.engine.connect() as connection:
+                rows = connection.execute(text(
+                    f'SELECT id, user_id, memory, {seen} FROM "{table}" WHERE {seen} < :cutoff LIMIT :limit'
+                ), {"cutoff": cutoff, "limit": self.policy.batch_size}).fetchall()
+            if not rows:
+                return
+            statements = []
+            for memory_id, user_id, memory, updated in rows:
+                params = {"id": memory_id, "seen": updated}
+                statements.append(_archive(table, memory_id, user_id, "memory", {"id": memory_id, "memory": memory}, guard, params))
+                statements.append(text(f'DELETE FROM "{table}" WHERE id = :id AND {seen} IS :seen').bindparams(**params))
+            self._commit(statements)
+            stats["memories_archived"] += len(rows)
+
+    def _drop_archive(self) -> int:
+        cutoff = time.time() - self.policy.archive_ttl
+        dropped = 0
+        while True:
+            with self.writer.engine.connect() as connection:
+                ids = [row[0] for row in connection.execute(text(
+                    f"SELECT id FROM {ARCHIVE_TABLE} WHERE archived_at < :cutoff LIMIT :limit"
+                ), {"cutoff": cutoff, "limit": self.policy.batch_size * 10})]
+            if not ids:
+                return dropped
+            self._commit([text(f"DELETE FROM {ARCHIVE_TABLE} WHERE id IN ({','.join(map(str, ids))})")])
+            dropped += len(ids)
+
+
+def run_retention(db_files: List[str], policy: Optional[RetentionPolicy] = None) -> List[Dict[str, Any]]:
+    reports = []
+    for db_file in db_files:
+        if not os.path.exists(db_file):
+            continue
+        report = RetentionEngine(db_file, policy).run_once()
+        log.info(
+            f"Retention on {db_file}: {report['sessions_archived']} sessions and "
+            f"{report['runs_archived']} runs archived, {report['sessions_compacted']} sessions compacted "
+            f"({report['bytes_before'] / 1e3:.0f}->{report['bytes_after'] / 1e3:.0f} KB), "
+            f"{report['memories_archived']} memories archived in {report['seconds']}s"
+        )
+        reports.append(report)
+    return reports
+
+
+def db_files_from_env() -> List[str]:
+    return [path for path in os.getenv("RETENTION_DB_FILES", "./derma_agent.sqlite,tmp/agents.db").split(",") if path]
+
+
+async def retention_loop(interval: float, db_files: Optional[List[str]] = None, policy: Optional[RetentionPolicy] = None) -> None:
+    """Run a retention pass every `interval` seconds off the event loop, until cancelled."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(run_retention, db_files or db_files_from_env(), policy)
+        except Exception as e:
+            log.error(f"Session retention failed: {e}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m retention", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db-file", action="append", help="database to process (repeatable; default RETENTION_DB_FILES)")
+    parser.add_argument("--every", type=float, default=0.0, help="repeat every this many seconds; 0 runs once")
+    args = parser.parse_args(argv)
+    policy = RetentionPolicy.from_env()
+    log.info(f"Retention policy: {asdict(policy)}")
+    while True:
+        try:
+            run_retention(args.db_file or db_files_from_env(), policy)
+        except Exception as e:
+            if args.every <= 0:
+                raise
+            log.error(f"Session retention failed: {e}")
+        if args.every <= 0:
+            return 0
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,234 @@
+"""
+Multi-worker production serving.
+
+    python -m serve --app twilio_response:app --workers 4
+    python -m serve --app dermaAssistant:app --workers 8 --memory-interval 30
+
+Runs uvicorn with `--workers` processes behind one listening socket, plus one
+shared embedding server (skin.embed_server) that every worker reaches over a
+Unix socket. The FastEmbed ONNX model, the largest thing a worker would
+otherwise load, therefore exists once per host instead of once per worker.
+
+Nothing heavy is loaded before the workers start: LanceDB and ONNX Runtime
+both run background threads that do not survive fork(), so each worker opens
+its own read-only Lance handle, pinned to the published table version (see
+DermaKnowledgeBase.open), when it first needs it. Those handles are small, and
+pinned handles never write.
+
+Housekeeping runs once per host, not once per worker: the supervisor starts
+`python -m skin.maintenance --every` and `python -m retention --every` as
+sidecar processes and turns retention off in the workers.
+
+Per-sender state is shared through SQLite files under tmp/ unless the
+variable naming one is set already:
+
+* IDEMPOTENCY_DB: finished webhook replies, so a Twilio retry that lands on
+  another worker replays the stored reply;
+* SESSION_DB: conversation epochs, turn counts and clinical intake
+  (sessions.SessionRegistry), so a sender's turns continue one conversation
+  whichever worker takes them;
+* IMAGE_DEDUP_DB: images already seen per sender (image_prep.ImageDedup).
+
+Two things remain per worker: a retry attaches to a run still in progress
+only on the worker running it, and the lock that runs a sender's turns one at
+a time is held per process.
+
+Every `--memory-interval` seconds the resident memory of each process (RSS,
+proportional set size and private bytes, from /proc) is logged and written to
+`--stats-file` as JSON.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+# Per-sender state every worker must see: environment variable -> default SQLite file
+SHARED_STATE = {
+    "IDEMPOTENCY_DB": "tmp/idempotency.sqlite",
+    "SESSION_DB": "tmp/sessions.sqlite",
+    "IMAGE_DEDUP_DB": "tmp/image_dedup.sqlite",
+}
+
+
+def _proc_children() -> Dict[int, List[int]]:
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                # The command name may contain spaces; the parent pid follows its closing parenthesis
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    return children
+
+
+def descendants(pid: int) -> List[int]:
+    children = _proc_children()
+    found, pending = [], [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def process_memory(pid: int) -> Optional[Dict[str, float]]:
+    """RSS, PSS and private memory of `pid` in MB, or None if it is gone or /proc is unavailable."""
+    fields: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1])
+    except OSError:
+        return None
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        "rss_mb": round(fields.get("Rss", 0) / 1024, 1),
+        "pss_mb": round(fields.get("Pss", 0) / 1024, 1),
+        "private_mb": round(private / 1024, 1),
+    }
+
+
+def _role(pid: int, embed_pid: Optional[int]) -> str:
+    if pid == embed_pid:
+        return "embed-server"
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().replace(b"\0", b" ").decode(errors="replace")
+    except OSError:
+        return "gone"
+    if "resource_tracker" in cmdline:
+        return "resource-tracker"
+    return "worker" if "multiprocessing" in cmdline else "other"
+
+
+def memory_report(embed_pid: Optional[int] = None) -> Dict[str, Any]:
+    processes = []
+    for pid in [os.getpid(), *descendants(os.getpid())]:
+        memory = process_memory(pid)
+        if memory is None:
+            continue
+        role = "supervisor" if pid == os.getpid() else _role(pid, embed_pid)
+        processes.append({"pid": pid, "role": role, **memory})
+    workers = [p for p in processes if p["role"] == "worker"]
+    return {
+        "time": round(time.time(), 1),
+        "processes": processes,
+        "workers": len(workers),
+        "worker_rss_mb": round(sum(p["rss_mb"] for p in workers), 1),
+        # PSS splits shared pages between the processes sharing them, so this is what the host pays
+        "total_pss_mb": round(sum(p["pss_mb"] for p in processes), 1),
+    }
+
+
+def report_memory(interval: float, stats_file: str, embed_pid: Optional[int], stop: threading.Event) -> None:
+    while not stop.wait(interval):
+        report = memory_report(embed_pid)
+        for process in report["processes"]:
+            log.info(
+                f"{process['role']} {process['pid']}: rss {process['rss_mb']} MB, "
+                f"pss {process['pss_mb']} MB, private {process['private_mb']} MB"
+            )
+        log.info(f"{report['workers']} workers: {report['worker_rss_mb']} MB resident, host total {report['total_pss_mb']} MB PSS")
+        os.makedirs(os.path.dirname(stats_file) or ".", exist_ok=True)
+        with open(stats_file, "w") as f:
+            json.dump(report, f, indent=1)
+
+
+def start_embed_server(socket_path: str, timeout: float = 300.0) -> subprocess.Popen:
+    """Start skin.embed_server and wait until it accepts connections (the first start downloads the model)."""
+    process = subprocess.Popen([sys.executable, "-m", "skin.embed_server", "--socket", socket_path])
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"embedding server exited with status {process.returncode}")
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                probe.connect(socket_path)
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"embedding server did not listen on {socket_path} within {timeout:.0f}s")
+
+
+def start_sidecar(module: str, *args: str) -> subprocess.Popen:
+    """Run `python -m module args` next to the workers, for jobs that must run once per host."""
+    log.info(f"Starting {module} {' '.join(args)}")
+    return subprocess.Popen([sys.executable, "-m", module, *args])
+
+
+def main(argv=None) -> int:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(prog="python -m serve", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--app", default="twilio_response:app", help="ASGI app as module:attribute")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--embed-socket", default=os.getenv("EMBED_SOCKET", "tmp/embed.sock"), help="embedding server socket")
+    parser.add_argument("--no-embed-server", action="store_true", help="let every worker load its own embedding model")
+    parser.add_argument("--memory-interval", type=float, default=60.0, help="seconds between memory reports; 0 disables them")
+    parser.add_argument("--stats-file", default="tmp/serve_memory.json", help="where the latest memory report is written")
+    parser.add_argument("--maintenance-interval", type=float, default=float(os.getenv("KB_MAINTENANCE_INTERVAL", "21600")),
+                        help="seconds between knowledge table maintenance runs; 0 disables them")
+    parser.add_argument("--retention-interval", type=float, default=float(os.getenv("RETENTION_INTERVAL", "3600")),
+                        help="seconds between session retention passes; 0 disables them")
+    args = parser.parse_args(argv)
+
+    # Inherited by the workers: retention runs in a sidecar, and per-sender
+    # state is shared through SQLite rather than held per worker
+    os.environ["RETENTION_INTERVAL"] = "0"
+    for name, path in SHARED_STATE.items():
+        os.environ.setdefault(name, os.path.abspath(path))
+
+    embed_server = None
+    if not args.no_embed_server:
+        embed_server = start_embed_server(os.path.abspath(args.embed_socket))
+        # Inherited by the workers; DermaKnowledgeBase then embeds through the server
+        os.environ["EMBED_SOCKET"] = os.path.abspath(args.embed_socket)
+
+    sidecars: List[subprocess.Popen] = []
+    if args.maintenance_interval > 0:
+        sidecars.append(start_sidecar("skin.maintenance", "--every", str(args.maintenance_interval)))
+    if args.retention_interval > 0:
+        sidecars.append(start_sidecar("retention", "--every", str(args.retention_interval)))
+
+    stop = threading.Event()
+    if args.memory_interval > 0:
+        threading.Thread(
+            target=report_memory,
+            args=(args.memory_interval, args.stats_file, embed_server.pid if embed_server else None, stop),
+            name="memory-report",
+            daemon=True,
+        ).start()
+    try:
+        uvicorn.run(args.app, host=args.host, port=args.port, workers=args.workers)
+    finally:
+        stop.set()
+        if embed_server is not None:
+            sidecars.append(embed_server)
+        for process in sidecars:
+            process.terminate()
+        for process in sidecars:
+            process.wait(timeout=10)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,225 @@
+"""
+Per-sender conversation sessions for the WhatsApp webhooks.
+
+Each sender gets their own agno session id, `<From>#<epoch>`. The epoch is the
+time the conversation started, and a new one begins after an idle gap, after
+`max_turns` turns, or when the sender asks to start over. Every session row in
+SqliteStorage, and the history loaded on each turn, therefore stays small no
+matter how much total traffic there is. Long-term facts about the patient stay
+with the user id (the sender) in agent memory.
+
+With `db_path` set (SESSION_DB), epochs, turn counts and the clinical intake
+live in SQLite, so every worker process of `python -m serve` sees the same
+conversation. Turn locks stay per process.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RESET_COMMANDS = {"reset", "restart", "new", "start over", "new consultation"}
+
+
+@dataclass
+class ConversationSession:
+    sender: str
+    epoch: int
+    turns: int = 0
+    last_seen: float = field(default_factory=time.time)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    # Conversation-scoped state owned by the webhook, e.g. a ClinicalIntake
+    intake: Any = None
+
+    @property
+    def session_id(self) -> str:
+        return f"{self.sender}#{self.epoch}"
+
+
+class SessionRegistry:
+    """
+    Maps senders to their current ConversationSession in `sessions`.
+
+    Senders are kept in least-recently-seen order, and the oldest idle ones are
+    dropped beyond `max_senders`. `on_expire(session_id)` is called for every
+    session that ends, so callers can free any per-session state they cache.
+    """
+
+    def __init__(
+        self,
+        sessions: Optional[Dict[str, ConversationSession]] = None,
+        idle_timeout: float = 6 * 3600,
+        max_turns: int = 20,
+        max_senders: int = 10_000,
+        on_expire: Optional[Callable[[str], None]] = None,
+        db_path: Optional[str] = None,
+    ):
+        self.sessions = sessions if sessions is not None else {}
+        self.idle_timeout = idle_timeout
+        self.max_turns = max_turns
+        self.max_senders = max_senders
+        self.on_expire = on_expire
+        self.db_path = db_path
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _expire(self, session: ConversationSession) -> None:
+        if self.on_expire:
+            self.on_expire(session.session_id)
+
+    def _ended(self, last_seen: float, turns: int, message: str, now: float) -> bool:
+        return (
+            now - last_seen > self.idle_timeout
+            or turns >= self.max_turns
+            or message.strip().lower() in RESET_COMMANDS
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            # Autocommit, so turns can take the write lock up front with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_sessions ("
+                " sender TEXT PRIMARY KEY, epoch INTEGER NOT NULL, turns INTEGER NOT NULL,"
+                " last_seen REAL NOT NULL, intake TEXT)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _db_turn(self, sender: str, message: str, now: float) -> Tuple[int, int, Optional[int]]:
+        """Count a turn in SQLite; returns (epoch, turns, ended epoch or None)."""
+        with self._db_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT epoch, turns, last_seen FROM conversation_sessions WHERE sender = ?", (sender,)
+                ).fetchone()
+                ended = None
+                if row is None:
+                    epoch, turns = int(now), 1
+                elif self._ended(row[2], row[1], message, now):
+                    ended, epoch, turns = row[0], max(int(now), row[0] + 1), 1
+                else:
+                    epoch, turns = row[0], row[1] + 1
+                if row is None or ended is not None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO conversation_sessions (sender, epoch, turns, last_seen, intake)"
+                        " VALUES (?, ?, ?, ?, NULL)",
+                        (sender, epoch, turns, now),
+                    )
+                else:
+                    conn.execute(
+                        "UPDATE conversation_sessions SET turns = ?, last_seen = ? WHERE sender = ?",
+                        (turns, now, sender),
+                    )
+                self._writes += 1
+                if self._writes % 500 == 0:
+                    conn.execute("DELETE FROM conversation_sessions WHERE last_seen <= ?", (now - self.idle_timeout,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return epoch, turns, ended
+
+    def session_for(self, sender: str, message: str = "") -> ConversationSession:
+        """The sender's session for this turn, starting a new epoch when the last one is over."""
+        now = time.time()
+        session = self.sessions.pop(sender, None)
+        if self.db_path:
+            # The shared row decides; this process only keeps the lock and its cached runs
+            epoch, turns, ended = self._db_turn(sender, message, now)
+            if session is not None and session.epoch != epoch:
+                self._expire(session)
+            elif session is None and ended is not None:
+                self._expire(ConversationSession(sender=sender, epoch=ended))
+            if session is None or session.epoch != epoch:
+                session = ConversationSession(sender=sender, epoch=epoch, lock=session.lock if session else asyncio.Lock())
+            session.turns = turns - 1
+        elif session is not None and self._ended(session.last_seen, session.turns, message, now):
+            self._expire(session)
+            # Hand the lock over so a turn still running in the old epoch finishes first
+            session = ConversationSession(sender=sender, epoch=max(int(now), session.epoch + 1), lock=session.lock)
+        elif session is None:
+            session = ConversationSession(sender=sender, epoch=int(now))
+        session.turns += 1
+        session.last_seen = now
+        # Re-inserting keeps the dict in least-recently-seen order
+        self.sessions[sender] = session
+        self._evict()
+        return session
+
+    def intake(self, session: ConversationSession, restore: Callable[[Dict[str, Any]], Any]) -> Any:
+        """
+        The session's intake state, created with `restore({})` on its first turn.
+
+        With a shared store it is restored from SQLite with `restore(saved)` on
+        every turn, since the previous turn may have run in another worker. Call
+        this while holding `session.lock`, and `save_intake` when the turn ends.
+        """
+        if self.db_path:
+            with self._db_lock:
+                row = self._connection().execute(
+                    "SELECT intake FROM conversation_sessions WHERE sender = ? AND epoch = ?",
+                    (session.sender, session.epoch),
+                ).fetchone()
+            session.intake = restore(json.loads(row[0]) if row and row[0] else {})
+        elif session.intake is None:
+            session.intake = restore({})
+        return session.intake
+
+    def save_intake(self, session: ConversationSession) -> None:
+        """Write the session's intake back to the shared store (a no-op without one)."""
+        if not self.db_path or session.intake is None:
+            return
+        with self._db_lock:
+            self._connection().execute(
+                "UPDATE conversation_sessions SET intake = ? WHERE sender = ? AND epoch = ?",
+                (json.dumps(session.intake.to_dict()), session.sender, session.epoch),
+            )
+
+    def _evict(self) -> None:
+        excess = len(self.sessions) - self.max_senders
+        if excess <= 0:
+            return
+        stale: List[str] = []
+        for sender, session in self.sessions.items():
+            if len(stale) == excess:
+                break
+            if not session.lock.locked():
+                stale.append(sender)
+        for sender in stale:
+            self._expire(self.sessions.pop(sender))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "senders": len(self.sessions),
+            "active": sum(1 for session in self.sessions.values() if session.lock.locked()),
+        }
+
+
+def registry_from_env(sessions: Optional[Dict[str, ConversationSession]] = None, **kwargs) -> SessionRegistry:
+    """SESSION_IDLE_TIMEOUT (seconds), SESSION_MAX_TURNS, SESSION_MAX_SENDERS and, to share sessions between processes, SESSION_DB."""
+    return SessionRegistry(
+        sessions,
+        idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", str(6 * 3600))),
+        max_turns=int(os.getenv("SESSION_MAX_TURNS", "20")),
+        max_senders=int(os.getenv("SESSION_MAX_SENDERS", "10000")),
+        db_path=os.getenv("SESSION_DB") or None,
+        **kwargs,
+    )
+
+
+def forget_session_runs(owner, session_id: str) -> None:
+    """Drop a finished session's cached runs from an agno Agent or Team (and its members)."""
+    runs = getattr(getattr(owner, "memory", None), "runs", None)
+    if isinstance(runs, dict):
+        runs.pop(session_id, None)
+    for member in getattr(owner, "members", None) or []:
+        forget_session_runs(member, session_id)
@@ -0,0 +1,254 @@
+"""
+Token-budgeted packing of knowledge search hits into prompt context.
+
+agno dumps every hit into the prompt as indented JSON. Hybrid search often
+returns the same passage twice (once per retriever, or from two guidelines
+that quote each other), neighbouring chunks of one page as separate entries,
+and chunks much longer than the part that answers the question. `pack` turns
+the ranked hits into the context actually sent:
+
+1. near-duplicates (word 5-gram Jaccard >= `duplicate_similarity`) and chunks
+   mostly contained in another hit are dropped, keeping the best rank;
+2. consecutive chunks of the same PDF page are merged into one entry;
+3. entries are added in relevance order until `budget_tokens` is spent or
+   `max_documents` entries are in; an entry longer than `max_chunk_tokens`, or
+   than what is left of the budget, is cut down to its sentences that share
+   the most words with the query.
+
+Hits are overfetched so that dropped duplicates can be replaced, but the
+context never holds more entries than were asked for, and savings are measured
+against the first `max_documents` hits: what the prompt held without packing.
+
+Tokens are estimated from characters (`chars_per_token`), as no tokenizer for
+the served model is available locally.
+"""
+import json
+import math
+import os
+import re
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Set, Tuple
+
+from agno.document import Document
+
+_WORD = re.compile(r"\w+")
+_SENTENCE = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+# Too common to say whether a sentence answers the query
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in", "is",
+    "it", "my", "of", "on", "or", "that", "the", "this", "to", "what", "when", "which", "with", "you",
+}
+
+
+@dataclass
+class PackConfig:
+    budget_tokens: int = 2000  # 0 disables packing
+    max_chunk_tokens: int = 800
+    min_chunk_tokens: int = 48  # smaller leftovers are not worth a cut-down entry
+    duplicate_similarity: float = 0.8
+    chars_per_token: float = 4.0
+    # Hits fetched per requested document, so dropped duplicates can be replaced
+    overfetch: int = 2
+
+    @classmethod
+    def from_env(cls) -> "PackConfig":
+        """KB_CONTEXT_TOKENS, KB_CHUNK_TOKENS, KB_DUPLICATE_SIMILARITY, KB_OVERFETCH."""
+        config = cls()
+        overrides = {
+            "budget_tokens": os.getenv("KB_CONTEXT_TOKENS"),
+            "max_chunk_tokens": os.getenv("KB_CHUNK_TOKENS"),
+            "duplicate_similarity": os.getenv("KB_DUPLICATE_SIMILARITY"),
+            "overfetch": os.getenv("KB_OVERFETCH"),
+        }
+        return replace(config, **{k: type(getattr(config, k))(v) for k, v in overrides.items() if v})
+
+
+@dataclass
+class PackStats:
+    hits: int = 0
+    duplicates: int = 0
+    merged: int = 0
+    trimmed: int = 0
+    dropped: int = 0
+    kept: int = 0
+    tokens_in: int = 0
+    tokens_out: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_in - self.tokens_out
+
+    def as_dict(self) -> Dict[str, int]:
+        return {**self.__dict__, "tokens_saved": self.tokens_saved}
+
+
+@dataclass
+class _Entry:
+    rank: int
+    document: Document
+    shingles: Set[Tuple[str, ...]] = field(default_factory=set)
+
+
+def estimate_tokens(document: Document, chars_per_token: float = 4.0) -> int:
+    """Tokens the document takes in the prompt, as agno serialises it."""
+    return math.ceil(len(json.dumps(document.to_dict(), indent=2, ensure_ascii=False)) / chars_per_token)
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.lower())
+
+
+def _shingles(text: str, size: int = 5) -> Set[Tuple[str, ...]]:
+    words = _words(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _position(document: Document) -> Optional[Tuple[str, int, int]]:
+    meta = document.meta_data or {}
+    if document.name is None or "page" not in meta or "chunk" not in meta:
+        return None
+    return document.name, meta["page"], meta["chunk"]
+
+
+def _dedupe(entries: List[_Entry], threshold: float, stats: PackStats) -> List[_Entry]:
+    kept: List[_Entry] = []
+    for entry in entries:
+        duplicate_of = None
+        for other in kept:
+            if not entry.shingles or not other.shingles:
+                continue
+            common = len(entry.shingles & other.shingles)
+            jaccard = common / len(entry.shingles | other.shingles)
+            if jaccard >= threshold or common / len(entry.shingles) >= 0.9:
+                duplicate_of = other
+                break
+            if common / len(other.shingles) >= 0.9:
+                # The better-ranked hit is a fragment of this one: keep the fuller text at the better rank
+                other.document, other.shingles = entry.document, entry.shingles
+                duplicate_of = other
+                break
+        if duplicate_of is None:
+            kept.append(entry)
+        else:
+            stats.duplicates += 1
+    return kept
+
+
+def _merge_adjacent(entries: List[_Entry], stats: PackStats) -> List[_Entry]:
+    by_position = {}
+    for entry in entries:
+        position = _position(entry.document)
+        if position is not None:
+            by_position[position] = entry
+    merged: List[_Entry] = []
+    absorbed = set()
+    for entry in entries:
+        if id(entry) in absorbed:
+            continue
+        position = _position(entry.document)
+        if position is None:
+            merged.append(entry)
+            continue
+        name, page, chunk = position
+        # Walk back to the first chunk of this run of consecutive hits, then forward to its end
+        while (name, page, chunk - 1) in by_position and id(by_position[(name, page, chunk - 1)]) not in absorbed:
+            chunk -= 1
+        run = []
+        while (name, page, chunk) in by_position and id(by_position[(name, page, chunk)]) not in absorbed:
+            run.append(by_position[(name, page, chunk)])
+            chunk += 1
+        absorbed.update(id(part) for part in run)
+        if len(run) == 1:
+            merged.append(entry)
+            continue
+        stats.merged += len(run) - 1
+        first = run[0].document
+        content = " ".join(part.document.content.strip() for part in run)
+        meta = {**first.meta_data, "chunk": [part.document.meta_data["chunk"] for part in run]}
+        meta.pop("chunk_size", None)
+        merged.append(_Entry(min(part.rank for part in run), replace(first, content=content, meta_data=meta, embedding=None)))
+    return sorted(merged, key=lambda e: e.rank)
+
+
+def _trim(document: Document, query: str, max_tokens: int, chars_per_token: float) -> Document:
+    """Cut `document` to its sentences that best match `query`, in their original order."""
+    overhead = estimate_tokens(replace(document, content=""), chars_per_token)
+    max_chars = int((max_tokens - overhead) * chars_per_token)
+    sentences = [s.strip() for s in _SENTENCE.split(document.content) if s.strip()]
+    terms = set(_words(query)) - _STOPWORDS
+    scored = sorted(
+        range(len(sentences)),
+        key=lambda i: (-len(terms & set(_words(sentences[i]))), i),
+    )
+    chosen, used = [], 0
+    for i in scored:
+        length = len(sentences[i]) + len(" ... ")
+        if used + length > max_chars:
+            continue
+        chosen.append(i)
+        used += length
+    if chosen:
+        content = " ... ".join(sentences[i] for i in sorted(chosen))
+    else:
+        content = document.content[:max(max_chars, 0)].rsplit(" ", 1)[0] + " ..."
+    trimmed = replace(document, content=content, embedding=None)
+    # JSON escaping can still push it over; shorten until it fits
+    while trimmed.content and estimate_tokens(trimmed, chars_per_token) > max_tokens:
+        excess = (estimate_tokens(trimmed, chars_per_token) - max_tokens) * chars_per_token
+        trimmed.content = trimmed.content[:-int(excess) - 1]
+    return trimmed
+
+
+def pack(
+    documents: List[Document],
+    query: str,
+    config: Optional[PackConfig] = None,
+    max_documents: Optional[int] = None,
+) -> Tuple[List[Document], PackStats]:
+    """
+    Dedupe, merge and budget ranked search hits; returns the documents to send and what it saved.
+
+    At most `max_documents` entries are sent (default: all hits). Entries past
+    that count as dropped.
+    """
+    config = config or PackConfig()
+    max_documents = len(documents) if max_documents is None else max_documents
+    stats = PackStats(hits=len(documents))
+    stats.tokens_in = sum(estimate_tokens(document, config.chars_per_token) for document in documents[:max_documents])
+    if config.budget_tokens <= 0:
+        stats.kept, stats.tokens_out = min(len(documents), max_documents), stats.tokens_in
+        stats.dropped = len(documents) - stats.kept
+        return list(documents[:max_documents]), stats
+
+    ranked = sorted(
+        range(len(documents)),
+        # Hits carry a reranker score when a reranker ran; otherwise search order is relevance order
+        key=lambda i: (-(documents[i].reranking_score or 0.0), i),
+    )
+    entries = [_Entry(rank, documents[i], _shingles(documents[i].content)) for rank, i in enumerate(ranked)]
+    entries = _dedupe(entries, config.duplicate_similarity, stats)
+    entries = _merge_adjacent(entries, stats)
+
+    packed: List[Document] = []
+    remaining = config.budget_tokens
+    for entry in entries:
+        if len(packed) >= max_documents:
+            stats.dropped += 1
+            continue
+        document = entry.document
+        tokens = estimate_tokens(document, config.chars_per_token)
+        limit = min(config.max_chunk_tokens, remaining)
+        if tokens > limit:
+            if limit < config.min_chunk_tokens:
+                stats.dropped += 1
+                continue
+            document = _trim(document, query, limit, config.chars_per_token)
+            tokens = estimate_tokens(document, config.chars_per_token)
+            stats.trimmed += 1
+        packed.append(document)
+        remaining -= tokens
+        stats.tokens_out += tokens
+    stats.kept = len(packed)
+    return packed, stats
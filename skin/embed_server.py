@@ -0,0 +1,161 @@
+"""
+Shared embedding server for multi-worker serving.
+
+    python -m skin.embed_server --socket tmp/embed.sock
+
+Loads the FastEmbed ONNX model once and answers RemoteEmbedder requests (see
+skin.embedding) from every web worker over a Unix socket. Requests that
+arrive within `--max-wait-ms` of each other are embedded as one batch of up
+to `--max-batch` texts, so concurrent queries from different workers share a
+model call. `python -m serve` starts it before the workers.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import time
+from typing import Any, Dict, List, Tuple
+
+from agno.embedder.fastembed import FastEmbedEmbedder
+from skin.embedding import FRAME, _fastembed_model, pack_frame
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+class EmbedServer:
+    def __init__(self, model_id: str, max_batch: int = 256, max_wait: float = 0.005):
+        self.model_id = model_id
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue: "asyncio.Queue[Tuple[List[str], asyncio.Future]]" = asyncio.Queue()
+        self.counts = {"requests": 0, "texts": 0, "batches": 0, "errors": 0, "embed_seconds": 0.0}
+
+    def load(self) -> None:
+        """Load the model and run it once, so the first request does not pay for either."""
+        list(_fastembed_model(self.model_id).embed(["warm up"]))
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        return [list(map(float, vector)) for vector in _fastembed_model(self.model_id).embed(texts, batch_size=self.max_batch)]
+
+    async def batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            texts = [text for item_texts, _ in batch for text in item_texts]
+            start = time.perf_counter()
+            try:
+                vectors = await asyncio.to_thread(self._embed, texts)
+            except Exception as e:
+                self.counts["errors"] += 1
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.counts["batches"] += 1
+            self.counts["embed_seconds"] += time.perf_counter() - start
+            offset = 0
+            for item_texts, future in batch:
+                if not future.done():
+                    future.set_result(vectors[offset:offset + len(item_texts)])
+                offset += len(item_texts)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((texts, future))
+        return await future
+
+    async def _answer(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if request.get("op") == "stats":
+            return self.stats()
+        if request.get("model") != self.model_id:
+            return {"error": f"this server embeds with {self.model_id}, not {request.get('model')}"}
+        texts = request.get("texts") or []
+        self.counts["requests"] += 1
+        self.counts["texts"] += len(texts)
+        try:
+            return {"vectors": await self.embed(texts)}
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    (size,) = FRAME.unpack(await reader.readexactly(FRAME.size))
+                    request = json.loads(await reader.readexactly(size))
+                except asyncio.IncompleteReadError:
+                    return
+                writer.write(pack_frame(await self._answer(request)))
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            log.warning(f"Dropping embedding client: {e}")
+        finally:
+            writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self.counts["batches"]
+        return {
+            "model": self.model_id,
+            **self.counts,
+            "embed_seconds": round(self.counts["embed_seconds"], 3),
+            "texts_per_batch": round(self.counts["texts"] / batches, 2) if batches else 0.0,
+        }
+
+
+async def serve(socket_path: str, model_id: str, max_batch: int, max_wait: float) -> None:
+    server = EmbedServer(model_id, max_batch=max_batch, max_wait=max_wait)
+    start = time.perf_counter()
+    await asyncio.to_thread(server.load)
+    log.info(f"Embedding model {model_id} loaded in {time.perf_counter() - start:.1f}s")
+
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    batcher = asyncio.create_task(server.batcher())
+    unix_server = await asyncio.start_unix_server(server.handle, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    log.info(f"Embedding server listening on {socket_path}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        unix_server.close()
+        batcher.cancel()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        log.info(f"Embedding server stopped: {server.stats()}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m skin.embed_server", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--socket", default=os.getenv("EMBED_SOCKET", "tmp/embed.sock"), help="Unix socket path")
+    parser.add_argument("--model", default=FastEmbedEmbedder().id, help="FastEmbed model id")
+    parser.add_argument("--max-batch", type=int, default=256, help="texts per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="how long a request waits for others to batch with")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.socket, args.model, args.max_batch, args.max_wait_ms / 1000))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
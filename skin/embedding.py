@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import struct
+import threading
+import unicodedata
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from agno.embedder.base import Embedder
+from agno.embedder.fastembed import FastEmbedEmbedder
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# FastEmbedEmbedder.get_embedding loads the ONNX model on every call; keep one per model id
+_fastembed_models: Dict[str, object] = {}
+
+
+def _fastembed_model(model_id: str):
+    model = _fastembed_models.get(model_id)
+    if model is None:
+        from fastembed import TextEmbedding
+        model = _fastembed_models[model_id] = TextEmbedding(model_name=model_id)
+    return model
+
+
+def embed_texts(embedder: Embedder, texts: List[str], batch_size: int = 256) -> List[List[float]]:
+    """
+    Embed many texts at once.
+
+    A CachingEmbedder only embeds its misses; FastEmbed models are run over the
+    whole list in `batch_size` batches; any other embedder falls back to one
+    `get_embedding` call per text.
+    """
+    if not texts:
+        return []
+    if isinstance(embedder, (CachingEmbedder, RemoteEmbedder)):
+        return embedder.get_embeddings(texts, batch_size=batch_size)
+    if isinstance(embedder, FastEmbedEmbedder):
+        model = _fastembed_model(embedder.id)
+        return [list(map(float, vector)) for vector in model.embed(texts, batch_size=batch_size)]
+    return [embedder.get_embedding(text) for text in texts]
+
+
+def text_key(text: str) -> str:
+    """Hash of the text after Unicode and whitespace normalisation."""
+    normalized = " ".join(unicodedata.normalize("NFC", text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CachingEmbedder(Embedder):
+    """
+    Embedder that keeps every vector it computes in a local SQLite file.
+
+    Vectors are keyed by (model id, normalised text hash), so identical chunks in
+    different PDFs, in a rebuilt table, or after a chunk-size change are only
+    embedded once. Misses are embedded together in `batch_size` batches.
+    """
+
+    embedder: Embedder = field(default_factory=FastEmbedEmbedder)
+    cache_path: str = "./my_local_lancedb/embedding_cache.sqlite"
+    batch_size: int = 256
+    hits: int = 0
+    misses: int = 0
+
+    def __post_init__(self):
+        self.dimensions = self.embedder.dimensions
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def id(self) -> str:
+        return getattr(self.embedder, "id", type(self.embedder).__name__)
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.cache_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+                " PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+            )
+            self._conn = conn
+        return self._conn
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(batch))})",
+                    [self.id, *batch],
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, items: List[Tuple[str, List[float]]]) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                    [(self.id, key, array("f", vector).tobytes()) for key, vector in items],
+                )
+
+    def get_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        keys = [text_key(text) for text in texts]
+        cached = self._lookup(list(dict.fromkeys(keys)))
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = embed_texts(self.embedder, list(missing.values()), batch_size=batch_size or self.batch_size)
+            fresh = list(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings([text])[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+# Embedding server protocol: 4-byte big-endian length, then a JSON object
+FRAME = struct.Struct(">I")
+
+
+def pack_frame(message: Dict[str, Any]) -> bytes:
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    return FRAME.pack(len(body)) + body
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("embedding server closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+
+@dataclass
+class RemoteEmbedder(Embedder):
+    """
+    Embedder that asks the shared embedding server (`python -m skin.embed_server`)
+    over a Unix socket, so web workers do not each load their own ONNX model.
+
+    Each thread keeps one connection. If the server cannot be reached the texts
+    are embedded locally with `fallback`, which loads the model in this process.
+    """
+
+    socket_path: str = "tmp/embed.sock"
+    fallback: Embedder = field(default_factory=FastEmbedEmbedder)
+    timeout: float = 30.0
+    remote_calls: int = 0
+    local_calls: int = 0
+
+    def __post_init__(self):
+        self.dimensions = self.fallback.dimensions
+        self._local = threading.local()
+        self._warned = False
+
+    @property
+    def id(self) -> str:
+        return getattr(self.fallback, "id", type(self.fallback).__name__)
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        sock = getattr(self._local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                raise
+            self._local.sock = sock
+        try:
+            sock.sendall(pack_frame({"model": self.id, "texts": texts}))
+            (size,) = FRAME.unpack(_recv_exactly(sock, FRAME.size))
+            reply = json.loads(_recv_exactly(sock, size))
+        except (OSError, ValueError):
+            # The next call reconnects
+            sock.close()
+            self._local.sock = None
+            raise
+        if "error" in reply:
+            raise RuntimeError(f"embedding server: {reply['error']}")
+        return reply["vectors"]
+
+    def get_embeddings(self, texts: List[str], batch_size: Optional[int] = None) -> List[List[float]]:
+        try:
+            vectors = self._request(texts)
+            self.remote_calls += 1
+            return vectors
+        except (OSError, ValueError, RuntimeError) as e:
+            # Unreachable, garbled or an error reply: the local model still answers
+            if not self._warned:
+                self._warned = True
+                log.warning(f"Embedding server at {self.socket_path} failed ({e}); embedding in this process")
+        self.local_calls += 1
+        return embed_texts(self.fallback, texts, batch_size=batch_size or 256)
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings([text])[0]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+
+def embedder_from_env() -> Embedder:
+    """A RemoteEmbedder when EMBED_SOCKET names an embedding server, else a local FastEmbed model."""
+    socket_path = os.getenv("EMBED_SOCKET")
+    return RemoteEmbedder(socket_path=socket_path) if socket_path else FastEmbedEmbedder()
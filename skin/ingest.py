@@ -0,0 +1,65 @@
+"""
+Build or refresh the derma knowledge table outside the web process.
+
+    python -m skin.ingest                 # incremental refresh of the published table
+    python -m skin.ingest --rebuild       # build a new table and switch readers over to it
+    python -m skin.ingest --maintain      # refresh, then compact and prune (see skin.maintenance)
+
+The web app only opens the version this job publishes (see DermaKnowledgeBase.open).
+The job holds the table lock while it writes, waiting for a running
+maintenance pass (skin.maintenance) to finish first.
+"""
+import argparse
+import os
+import time
+from skin.lance import table_lock
+from skin.maintenance import run_maintenance
+from skin.skin_kb import DermaKnowledgeBase
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m skin.ingest", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--table", default="derma_knowledge", help="logical table name")
+    parser.add_argument("--db-path", default="./my_local_lancedb", help="LanceDB folder")
+    parser.add_argument("--pdf-path", action="append", dest="pdf_paths", help="PDF file or folder (repeatable)")
+    parser.add_argument("--url", action="append", dest="urls", default=[], help="PDF URL (repeatable)")
+    parser.add_argument("--rebuild", action="store_true", help="build a fresh table instead of refreshing in place")
+    parser.add_argument("--keep", type=int, default=1, help="old builds to keep after --rebuild")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="PDF parser processes")
+    parser.add_argument("--pages-per-task", type=int, default=16, help="PDF pages parsed per worker task")
+    parser.add_argument("--batch-size", type=int, default=256, help="texts per embedding batch")
+    parser.add_argument("--maintain", action="store_true", help="compact and prune the table afterwards")
+    parser.add_argument("--chunk-size", type=int, default=None, help="override the reader chunk size")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    os.makedirs(args.db_path, exist_ok=True)
+    with table_lock(args.db_path, args.table, wait=True):
+        # Read the pointer only once the lock is held: maintenance may have moved it
+        kb = DermaKnowledgeBase(
+            table_name=args.table,
+            db_path=args.db_path,
+            pdf_paths=args.pdf_paths or ["resources"],
+            urls=args.urls,
+        )
+        if args.chunk_size:
+            kb.reader.chunk_size = args.chunk_size
+        started = time.perf_counter()
+        if args.rebuild:
+            stats = kb.rebuild(workers=args.workers, batch_size=args.batch_size, keep=args.keep,
+                               pages_per_task=args.pages_per_task)
+        else:
+            stats = kb.sync(workers=args.workers, batch_size=args.batch_size, pages_per_task=args.pages_per_task)
+    log.info(f"Ingest finished in {time.perf_counter() - started:.1f}s: {stats}")
+    if args.maintain:
+        run_maintenance(db_path=args.db_path, table_name=args.table)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,178 @@
+import asyncio
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from agno.document import Document
+from agno.vectordb.lancedb import LanceDb
+from agno.vectordb.search import SearchType
+from skin.manifest import MANIFEST_SUFFIX, PUBLISHED_MANIFEST_SUFFIX
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+POINTER_SUFFIX = ".current.json"
+
+
+def pointer_path(db_path: str, table_name: str) -> str:
+    return os.path.join(db_path, table_name + POINTER_SUFFIX)
+
+
+def read_pointer(db_path: str, table_name: str) -> Optional[Dict[str, Any]]:
+    """The physical table and version currently published for `table_name`, if any."""
+    try:
+        with open(pointer_path(db_path, table_name), "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning(f"Ignoring unreadable table pointer for {table_name}: {e}")
+        return None
+
+
+def publish_pointer(db_path: str, table_name: str, physical_table: str, version: int) -> None:
+    """Switch readers of `table_name` to `physical_table@version` with one atomic rename."""
+    path = pointer_path(db_path, table_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump({"table": physical_table, "version": version, "published_at": time.time()}, fh)
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def table_lock(db_path: str, table_name: str, wait: bool = False) -> Iterator[bool]:
+    """
+    Cross-process lock held by every job that writes `table_name` or moves its pointer.
+
+    Yields False at once when another process holds it, unless `wait` is set.
+    """
+    with open(os.path.join(db_path, f"{table_name}.lock"), "w") as fh:
+        try:
+            fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not wait:
+                yield False
+                return
+            log.info(f"Waiting for another job writing '{table_name}'")
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield True
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def build_table_name(table_name: str) -> str:
+    """A new physical table name for `table_name`; build names sort by creation time."""
+    return f"{table_name}_{time.strftime('%Y%m%d%H%M%S')}"
+
+
+def drop_old_builds(connection, db_path: str, table_name: str, current: str, keep: int) -> List[str]:
+    """Drop all but the newest `keep` physical tables of `table_name` other than `current`."""
+    builds = sorted(
+        name for name in connection.table_names()
+        if name != current and (name == table_name or name.startswith(table_name + "_"))
+    )
+    # Build names sort by timestamp; the bare logical name is the oldest
+    dropped = builds[:max(len(builds) - keep, 0)]
+    for name in dropped:
+        log.info(f"Dropping old knowledge table '{name}'")
+        connection.drop_table(name)
+        for suffix in (MANIFEST_SUFFIX, PUBLISHED_MANIFEST_SUFFIX):
+            manifest_path = os.path.join(db_path, name + suffix)
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+    return dropped
+
+
+class DermaLanceDb(LanceDb):
+    """
+    LanceDb that can be pinned read-only to one table version.
+
+    agno's LanceDb re-opens the table before every search (so it always sees the
+    latest version) and rebuilds the full-text index on the first hybrid query of
+    every process. A pinned instance does neither: it serves the version the
+    ingest job published, and relies on the index that job built.
+    """
+
+    def __init__(self, *args, refine_factor: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_only = False
+        self.pinned_version: Optional[int] = None
+        # Re-rank `limit * refine_factor` ANN candidates on exact distance
+        self.refine_factor = refine_factor
+
+    def pin(self, version: Optional[int] = None) -> None:
+        if self.table is None:
+            return
+        if version is not None:
+            self.table.checkout(version)
+        self.pinned_version = self.table.version
+        self.read_only = True
+        # Never rebuild the FTS index from a serving process
+        self.fts_index_exists = True
+
+    def has_fts_index(self) -> bool:
+        return os.path.isdir(os.path.join(str(self.uri), f"{self.table_name}.lance", "_indices", "fts"))
+
+    def build_fts_index(self) -> None:
+        if self.table is not None and self.search_type in (SearchType.keyword, SearchType.hybrid):
+            self.table.create_fts_index("payload", use_tantivy=self.use_tantivy, replace=True)
+            self.fts_index_exists = True
+
+    def _tune(self, builder):
+        # nprobes and refine_factor only matter once a vector index exists
+        if self.nprobes:
+            builder = builder.nprobes(self.nprobes)
+        if self.refine_factor:
+            builder = builder.refine_factor(self.refine_factor)
+        return builder
+
+    def vector_search(self, query: str, limit: int = 5):
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None or self.table is None:
+            return None
+        builder = self.table.search(query=query_embedding, vector_column_name=self._vector_col).limit(limit)
+        return self._tune(builder).to_pandas()
+
+    def hybrid_search(self, query: str, limit: int = 5):
+        query_embedding = self.embedder.get_embedding(query)
+        if query_embedding is None or self.table is None:
+            return None
+        if not self.fts_index_exists:
+            self.build_fts_index()
+        builder = (
+            self.table.search(vector_column_name=self._vector_col, query_type="hybrid")
+            .vector(query_embedding)
+            .text(query)
+            .limit(limit)
+        )
+        return self._tune(builder).to_pandas()
+
+    def search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        if not self.read_only:
+            return super().search(query=query, limit=limit, filters=filters)
+
+        if self.search_type == SearchType.vector:
+            results = self.vector_search(query, limit)
+        elif self.search_type == SearchType.keyword:
+            results = self.keyword_search(query, limit)
+        else:
+            results = self.hybrid_search(query, limit)
+        if results is None:
+            return []
+
+        search_results = self._build_search_results(results)
+        if filters:
+            search_results = [
+                doc for doc in search_results
+                if doc.meta_data and all(doc.meta_data.get(k) == v for k, v in filters.items())
+            ]
+        if self.reranker and search_results:
+            search_results = self.reranker.rerank(query=query, documents=search_results)
+        return search_results
+
+    async def async_search(self, query: str, limit: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        # LanceDB search is synchronous; keep it off the event loop
+        return await asyncio.to_thread(self.search, query, limit, filters)
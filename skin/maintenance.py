@@ -0,0 +1,212 @@
+"""
+Housekeeping for the derma knowledge table.
+
+    python -m skin.maintenance              # compact, fix up indices, prune old versions
+    python -m skin.maintenance --every 21600
+
+Every ingest run leaves new fragments and versions behind, and each FTS rebuild
+can leave another tantivy segment. Serving processes hold the published table
+open, and a tantivy index is one unversioned directory that refers to row
+addresses, so the live table's FTS index is never touched: when the table is
+fragmented or has no FTS index, its published version is copied into a new
+physical table with one fresh index, that table is published and old builds
+are dropped, as `python -m skin.ingest --rebuild` does. The new build starts
+from the manifest published with the copied version, never from the working
+manifest, which an unfinished ingest may have run ahead. An ANN vector index is
+built once the table is large enough (sizes from the deployment's
+VectorIndexConfig, see skin.vector_index), and versions nobody serves any more
+are pruned.
+
+This runs as its own process (`make maintain-kb`, or `--every` for a schedule),
+never inside a web worker. It holds the table lock that ingest jobs hold too
+(see skin.lance.table_lock), and skips a run while an ingest is writing.
+"""
+import argparse
+import os
+import time
+from datetime import timedelta
+from typing import Any, Dict, Optional
+import lancedb
+from skin.lance import build_table_name, drop_old_builds, publish_pointer, read_pointer, table_lock
+from skin.manifest import IngestManifest
+from skin.vector_index import VectorIndexConfig, build_vector_index, has_vector_index
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _fts_dir(db_path: str, physical_table: str) -> str:
+    return os.path.join(db_path, f"{physical_table}.lance", "_indices", "fts")
+
+
+def _fts_segments(db_path: str, physical_table: str) -> int:
+    fts_dir = _fts_dir(db_path, physical_table)
+    if not os.path.isdir(fts_dir):
+        return 0
+    return len({name.split(".")[0] for name in os.listdir(fts_dir) if name.endswith(".idx")})
+
+
+def has_fts_index(db_path: str, physical_table: str, table, use_tantivy: bool = True) -> bool:
+    if use_tantivy:
+        return os.path.isdir(_fts_dir(db_path, physical_table))
+    return any(getattr(index, "index_type", "") in ("FTS", "INVERTED") for index in table.list_indices())
+
+
+def copy_to_new_build(connection, db_path: str, table_name: str, table, manifest: Optional[IngestManifest]):
+    """
+    Copy the checked-out version of `table` into a new physical table.
+
+    `manifest` must describe that version; it becomes the new build's manifest.
+    Without one the next ingest re-hashes and re-parses every PDF, but finds
+    their rows already present.
+    """
+    physical_table = build_table_name(table_name)
+    # One write of the whole table: the copy starts out compacted
+    copy = connection.create_table(physical_table, data=table.to_lance().to_batches(), schema=table.schema)
+    build_manifest = IngestManifest.for_table(db_path, physical_table)
+    if manifest is not None:
+        build_manifest.entries = dict(manifest.entries)
+    else:
+        log.warning(f"No manifest was published with '{table.name}' version {table.version}; "
+                    f"the next ingest re-checks every PDF")
+    build_manifest.save()
+    return copy
+
+
+def table_snapshot(db_path: str, physical_table: str, table) -> Dict[str, Any]:
+    return {
+        "version": table.version,
+        "rows": table.count_rows(),
+        "fragments": len(table.to_lance().get_fragments()),
+        "versions": len(table.list_versions()),
+        "fts_segments": _fts_segments(db_path, physical_table),
+        "vector_index": has_vector_index(table),
+        "bytes": _dir_size(os.path.join(db_path, f"{physical_table}.lance")),
+    }
+
+
+def run_maintenance(
+    db_path: str = "./my_local_lancedb",
+    table_name: str = "derma_knowledge",
+    index_config: Optional[VectorIndexConfig] = None,
+    prune_older_than: timedelta = timedelta(hours=1),
+    use_tantivy: bool = True,
+    keep: int = 1,
+) -> Optional[Dict[str, Any]]:
+    """
+    Maintain the published table and return a before/after report.
+
+    Returns None when another process holds the table lock. The ANN index
+    is built with `index_config` (default: VectorIndexConfig.from_env()). When
+    the table is copied into a new build, `keep` older builds are kept for
+    readers that have not followed the pointer yet.
+    """
+    index_config = index_config or VectorIndexConfig.from_env()
+    with table_lock(db_path, table_name) as acquired:
+        if not acquired:
+            log.info(f"'{table_name}' is being ingested or maintained elsewhere; skipping")
+            return None
+
+        pointer = read_pointer(db_path, table_name)
+        physical_table = pointer["table"] if pointer else table_name
+        connection = lancedb.connect(db_path)
+        if physical_table not in connection.table_names():
+            log.warning(f"Nothing to maintain: table '{physical_table}' does not exist")
+            return None
+        table = connection.open_table(physical_table)
+        # Versions past the published one belong to an unfinished ingest
+        unpublished = pointer is not None and table.version != pointer["version"]
+        if unpublished:
+            table.checkout(pointer["version"])
+        if pointer is not None:
+            manifest = IngestManifest.published(db_path, physical_table, table.version)
+        else:
+            # Never published: the working manifest is the only one there is
+            manifest = IngestManifest.for_table(db_path, physical_table)
+
+        report: Dict[str, Any] = {"table": physical_table, "before": table_snapshot(db_path, physical_table, table), "timings": {}}
+        timings = report["timings"]
+
+        # Compaction rewrites row addresses, which a tantivy index refers to, so a
+        # fragmented table gets compacted and indexed as a new build instead. So does
+        # a table with unpublished versions, which cannot be written in place
+        rebuilt = False
+        if unpublished or report["before"]["fragments"] > 1 or not has_fts_index(db_path, physical_table, table, use_tantivy):
+            started = time.perf_counter()
+            table = copy_to_new_build(connection, db_path, table_name, table, manifest)
+            manifest = IngestManifest.for_table(db_path, table.name)
+            timings["copy"] = round(time.perf_counter() - started, 3)
+            started = time.perf_counter()
+            table.create_fts_index("payload", use_tantivy=use_tantivy, replace=True)
+            timings["fts_index"] = round(time.perf_counter() - started, 3)
+            rebuilt = True
+
+        # Vector indices are versioned, so building one in place leaves pinned readers alone
+        if report["before"]["rows"] >= index_config.min_rows and not has_vector_index(table):
+            started = time.perf_counter()
+            build_vector_index(table, index_config)
+            timings["vector_index"] = round(time.perf_counter() - started, 3)
+
+        if pointer is None or (table.name, table.version) != (pointer["table"], pointer["version"]):
+            if manifest is not None:
+                manifest.publish(table.version)
+            publish_pointer(db_path, table_name, table.name, table.version)
+
+        started = time.perf_counter()
+        if rebuilt:
+            drop_old_builds(connection, db_path, table_name, table.name, keep)
+        else:
+            # Serving processes re-read the pointer within seconds; keep older versions
+            # around long enough for in-flight queries on them to finish
+            table.cleanup_old_versions(older_than=prune_older_than)
+        timings["prune"] = round(time.perf_counter() - started, 3)
+
+        report["published"] = table.name
+        report["after"] = table_snapshot(db_path, table.name, table)
+        before, after = report["before"], report["after"]
+        log.info(
+            f"Maintained '{physical_table}' -> '{table.name}': {before['fragments']}->{after['fragments']} fragments, "
+            f"{before['versions']}->{after['versions']} versions, {before['fts_segments']}->{after['fts_segments']} FTS segments, "
+            f"{before['bytes'] / 1e6:.1f}->{after['bytes'] / 1e6:.1f} MB, timings {timings}"
+        )
+        return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m skin.maintenance", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--table", default="derma_knowledge", help="logical table name")
+    parser.add_argument("--db-path", default="./my_local_lancedb", help="LanceDB folder")
+    parser.add_argument("--prune-hours", type=float, default=1.0, help="delete versions older than this")
+    parser.add_argument("--keep", type=int, default=1, help="old builds to keep after copying into a new one")
+    parser.add_argument("--every", type=float, default=0.0, help="repeat every this many seconds; 0 runs once")
+    args = parser.parse_args(argv)
+    while True:
+        try:
+            run_maintenance(
+                db_path=args.db_path,
+                table_name=args.table,
+                prune_older_than=timedelta(hours=args.prune_hours),
+                keep=args.keep,
+            )
+        except Exception as e:
+            if args.every <= 0:
+                raise
+            log.error(f"Knowledge table maintenance failed: {e}")
+        if args.every <= 0:
+            return 0
+        time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
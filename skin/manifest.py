@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Set
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+MANIFEST_SUFFIX = ".manifest.json"
+# The manifest as of the table version last published, see IngestManifest.publish
+PUBLISHED_MANIFEST_SUFFIX = ".manifest.published.json"
+
+
+@dataclass
+class ManifestEntry:
+    """What we know about one ingested source file."""
+    path: str
+    size: int
+    mtime: float
+    sha256: str
+    ingest_version: str
+    doc_name: str
+    chunk_ids: List[str] = field(default_factory=list)
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """Hash a file in fixed-size blocks so large PDFs are never read whole."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    JSON manifest stored next to a LanceDB table, keyed by source file path.
+
+    An entry records the size, mtime and content hash of a file together with
+    the chunker/embedder version it was ingested with and the row ids it produced,
+    so `DermaKnowledgeBase.aload` can skip unchanged files and delete the rows of
+    changed or removed ones.
+
+    The working file is saved after every write and can run ahead of the
+    published table version; `publish` keeps a copy tagged with the version
+    whose rows it describes, for jobs that copy that version into a new build.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, ManifestEntry] = {}
+
+    @classmethod
+    def for_table(cls, db_path: str, table_name: str) -> "IngestManifest":
+        manifest = cls(os.path.join(db_path, table_name + MANIFEST_SUFFIX))
+        manifest.load()
+        return manifest
+
+    @classmethod
+    def published(cls, db_path: str, table_name: str, version: int) -> Optional["IngestManifest"]:
+        """The manifest published with `table_name@version`, or None if none was."""
+        manifest = cls(os.path.join(db_path, table_name + MANIFEST_SUFFIX))
+        raw = _read_json(manifest.published_path)
+        if raw is None or raw.get("version") != version:
+            return None
+        manifest.entries = _entries(raw)
+        return manifest
+
+    @property
+    def published_path(self) -> str:
+        return self.path[: -len(MANIFEST_SUFFIX)] + PUBLISHED_MANIFEST_SUFFIX
+
+    def load(self) -> None:
+        raw = _read_json(self.path)
+        self.entries = _entries(raw) if raw else {}
+
+    def save(self) -> None:
+        _write_json(self.path, {"files": [asdict(e) for e in self.entries.values()]})
+
+    def publish(self, version: int) -> None:
+        """Record these entries as the ones that match table version `version`."""
+        _write_json(self.published_path, {"version": version, "files": [asdict(e) for e in self.entries.values()]})
+
+    def clear(self) -> None:
+        self.entries = {}
+        self.save()
+
+    def get(self, path: str) -> Optional[ManifestEntry]:
+        return self.entries.get(path)
+
+    def put(self, entry: ManifestEntry) -> None:
+        self.entries[entry.path] = entry
+
+    def remove(self, path: str) -> Optional[ManifestEntry]:
+        return self.entries.pop(path, None)
+
+    def paths(self) -> List[str]:
+        return list(self.entries)
+
+    def is_unchanged(self, path: str, stat: os.stat_result, ingest_version: str) -> bool:
+        """Cheap check that avoids hashing: same size, mtime and ingest version."""
+        entry = self.entries.get(path)
+        return (
+            entry is not None
+            and entry.size == stat.st_size
+            and entry.mtime == stat.st_mtime
+            and entry.ingest_version == ingest_version
+        )
+
+    def referenced_ids(self, exclude: Iterable[str] = ()) -> Set[str]:
+        """Row ids still owned by some file; identical chunks in two PDFs share an id."""
+        excluded = set(exclude)
+        ids: Set[str] = set()
+        for path, entry in self.entries.items():
+            if path not in excluded:
+                ids.update(entry.chunk_ids)
+        return ids
+
+
+def _read_json(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (OSError, ValueError) as e:
+        # A corrupt manifest only costs us a full re-ingest, never a crash
+        log.warning(f"Ignoring unreadable ingest manifest {path}: {e}")
+        return None
+
+
+def _write_json(path: str, data: dict) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fh:
+        json.dump(data, fh, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _entries(raw: dict) -> Dict[str, ManifestEntry]:
+    entries = (ManifestEntry(**item) for item in raw.get("files", []))
+    return {entry.path: entry for entry in entries}
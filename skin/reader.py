@@ -0,0 +1,131 @@
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Deque, Iterator, List, Optional, Tuple
+from uuid import uuid4
+from agno.document import Document
+from agno.document.chunking.fixed import FixedSizeChunking
+from pypdf import PdfReader
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+@dataclass
+class ParsedRange:
+    """Chunks for pages [start, end) of one PDF; `last` marks the file's final range."""
+    path: str
+    start: int
+    end: int
+    last: bool
+    chunks: List[Document] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def doc_name_for(path: str) -> str:
+    # Same naming as agno's PDFReader, so chunk ids and payloads match a PDFKnowledgeBase load
+    return path.split("/")[-1].split(".")[0].replace(" ", "_")
+
+
+def page_count(path: str) -> int:
+    return len(PdfReader(path).pages)
+
+
+def parse_page_range(path: str, start: int, end: int, chunk_size: int) -> List[Document]:
+    """
+    Extract and chunk pages [start, end) of one PDF.
+
+    Runs inside a worker process, so it must stay top-level. pypdf reads page
+    objects lazily from the file, so only this range is ever materialised.
+    """
+    reader = PdfReader(path)
+    chunking = FixedSizeChunking(chunk_size=chunk_size)
+    doc_name = doc_name_for(path)
+    chunks: List[Document] = []
+    for page_number in range(start + 1, end + 1):
+        page = Document(
+            name=doc_name,
+            id=str(uuid4()),
+            meta_data={"page": page_number},
+            content=reader.pages[page_number - 1].extract_text(),
+        )
+        chunks.extend(chunking.chunk(page))
+    return chunks
+
+
+def _page_ranges(paths: List[str], pages_per_task: int) -> Iterator[Tuple[str, int, int, bool, Optional[str]]]:
+    for path in paths:
+        try:
+            total = page_count(path)
+        except Exception as e:
+            yield path, 0, 0, True, f"could not open PDF: {e}"
+            continue
+        if total == 0:
+            yield path, 0, 0, True, None
+        for start in range(0, total, pages_per_task):
+            end = min(start + pages_per_task, total)
+            yield path, start, end, end == total, None
+
+
+def iter_parsed_ranges(
+    paths: List[str],
+    chunk_size: int,
+    workers: Optional[int] = None,
+    pages_per_task: int = 16,
+    max_in_flight: Optional[int] = None,
+) -> Iterator[ParsedRange]:
+    """
+    Parse PDFs page range by page range in a process pool, yielding results in input order.
+
+    At most `max_in_flight` ranges (default: twice the worker count) are queued or
+    finished-but-unconsumed at any time, so memory stays bounded by a few page
+    ranges no matter how large the corpus or any single document is.
+
+    Args:
+        paths (List[str]): PDF files to parse.
+        chunk_size (int): Chunk size for fixed-size chunking, as in agno's PDFReader.
+        workers (int): Worker processes; defaults to the CPU count. 1 parses inline.
+        pages_per_task (int): Pages handed to a worker per task.
+        max_in_flight (int): Upper bound on outstanding ranges.
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = _page_ranges(paths, pages_per_task)
+
+    if workers <= 1:
+        for path, start, end, last, error in ranges:
+            yield _collect(path, start, end, last, error, lambda: parse_page_range(path, start, end, chunk_size))
+        return
+
+    max_in_flight = max_in_flight or workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight: Deque[Tuple[Tuple[str, int, int, bool, Optional[str]], Optional[Future]]] = deque()
+
+        def submit_next() -> bool:
+            task = next(ranges, None)
+            if task is None:
+                return False
+            path, start, end, _, error = task
+            future = pool.submit(parse_page_range, path, start, end, chunk_size) if end > start and not error else None
+            in_flight.append((task, future))
+            return True
+
+        while len(in_flight) < max_in_flight and submit_next():
+            pass
+        while in_flight:
+            (path, start, end, last, error), future = in_flight.popleft()
+            submit_next()
+            yield _collect(path, start, end, last, error, future.result if future else list)
+
+
+def _collect(path: str, start: int, end: int, last: bool, error: Optional[str], parse) -> ParsedRange:
+    if error:
+        log.error(f"Skipping {path}: {error}")
+        return ParsedRange(path=path, start=start, end=end, last=last, error=error)
+    if end <= start:
+        return ParsedRange(path=path, start=start, end=end, last=last)
+    try:
+        return ParsedRange(path=path, start=start, end=end, last=last, chunks=parse())
+    except Exception as e:
+        log.error(f"Failed to parse pages {start + 1}-{end} of {path}: {e}")
+        return ParsedRange(path=path, start=start, end=end, last=last, error=str(e))
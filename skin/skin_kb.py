@@ -1,45 +1,417 @@
 import asyncio
+import json
 import os
-from typing import List
+import threading
+import time
+from hashlib import md5
+from typing import Any, Dict, Iterable, List, Optional, Set
+from agno.document import Document
+from agno.document.reader.pdf_reader import PDFReader
 from agno.knowledge.pdf import PDFKnowledgeBase
-from agno.vectordb.lancedb import LanceDb
 from agno.vectordb.search import SearchType
 from agno.knowledge.pdf_url import PDFUrlKnowledgeBase
-from agno.embedder.fastembed import FastEmbedEmbedder
+from skin.context_pack import PackConfig, pack
+from skin.embedding import CachingEmbedder, embed_texts, embedder_from_env
+from skin.lance import DermaLanceDb, build_table_name, drop_old_builds, publish_pointer, read_pointer
+from skin.manifest import IngestManifest, ManifestEntry, file_sha256
+from skin.query_cache import QueryCache, normalize_query
+from skin.vector_index import VectorIndexConfig
+from skin.reader import doc_name_for, iter_parsed_ranges
+from telemetry import REGISTRY, get_logger, span
 #from agno.vectordb.pgvector import PgVector
 
+log = get_logger(__name__)
+
+CONTEXT_TOKENS = REGISTRY.counter(
+    "derma_kb_context_tokens_total", "Knowledge context tokens retrieved and sent after packing", ["kind"]
+)
+SEARCH_ERRORS = REGISTRY.counter("derma_kb_search_errors_total", "Failed knowledge searches by error type", ["error"])
+
+# What a search can hit on a healthy deployment: Lance reports I/O failures,
+# such as a build dropped under an old handle, as OSError. The agent then
+# answers without knowledge context; any other error is a bug and propagates.
+RECOVERABLE_SEARCH_ERRORS = (OSError,)
+
+# Bump when the way PDFs are split into chunks changes, so every file is re-ingested
+CHUNKER_VERSION = "pdf-fixed-v1"
+
+
+def document_id(document: Document) -> str:
+    """Row id LanceDb assigns to a document (md5 of its cleaned content)."""
+    cleaned_content = document.content.replace("\x00", "\ufffd")
+    return md5(cleaned_content.encode()).hexdigest()
+
+
+def document_row(document: Document, vector: List[float]) -> Dict:
+    """A row in the same layout agno's LanceDb.insert writes."""
+    cleaned_content = document.content.replace("\x00", "\ufffd")
+    payload = {
+        "name": document.name,
+        "meta_data": document.meta_data,
+        "content": cleaned_content,
+        "usage": document.usage,
+    }
+    return {"id": document_id(document), "vector": vector, "payload": json.dumps(payload)}
+
+
+class DermaKnowledge(PDFKnowledgeBase):
+    """Agent-facing knowledge interface: cached search, packed into the context token budget."""
+
+    derma_kb: Any = None
+
+    def search(self, query: str, num_documents: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return self.derma_kb.context(query, num_documents or self.num_documents, filters)
+
+    async def async_search(self, query: str, num_documents: Optional[int] = None, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        return await asyncio.to_thread(self.search, query, num_documents, filters)
 
 
 class DermaKnowledgeBase:
-    def __init__(self, table_name: str, db_path: str, pdf_paths: List[str], urls: List[str]):
-        full_path = os.path.join(db_path, table_name)  # LanceDB expects the path to the collection
+    def __init__(
+        self,
+        table_name: str,
+        db_path: str,
+        pdf_paths: List[str],
+        urls: List[str],
+        physical_table: Optional[str] = None,
+        query_cache_size: int = 512,
+        query_cache_ttl: float = 900.0,
+        index_config: Optional[VectorIndexConfig] = None,
+        pack_config: Optional[PackConfig] = None,
+    ):
+        # `table_name` is the logical name; the pointer file says which physical
+        # table (and version) currently serves it
+        pointer = read_pointer(db_path, table_name)
+        self.physical_table = physical_table or (pointer["table"] if pointer else table_name)
 
-        self.vector_db = LanceDb(
-            table_name=table_name,
-            uri=db_path,  # pass just the folder root to `uri`
-            search_type=SearchType.hybrid,
-            embedder=FastEmbedEmbedder()
+        # Vectors are cached on disk next to the tables, so rebuilds only embed new
+        # text; under `python -m serve` the model itself lives in the embedding server
+        self.embedder = CachingEmbedder(
+            embedder=embedder_from_env(),
+            cache_path=os.path.join(db_path, "embedding_cache.sqlite"),
         )
+        self.reader = PDFReader(chunk=True)
         self.pdf_paths = pdf_paths
-        self.urls = urls
+        self.urls = [url for url in urls if url]
         self.table_name = table_name
+        self.db_path = db_path
+        # ANN search settings are chosen per deployment (see skin.vector_index)
+        self.index_config = index_config or VectorIndexConfig.from_env()
+        self.vector_db = self._vector_db(self.physical_table)
+        self.manifest = IngestManifest.for_table(db_path, self.physical_table)
+        self.query_cache = QueryCache(max_entries=query_cache_size, ttl=query_cache_ttl)
+        # How retrieved chunks are deduplicated, merged and budgeted for the prompt (see skin.context_pack)
+        self.pack_config = pack_config or PackConfig.from_env()
+        self.context_totals = {"requests": 0, "hits": 0, "duplicates": 0, "merged": 0, "trimmed": 0, "dropped": 0,
+                               "kept": 0, "tokens_in": 0, "tokens_out": 0, "tokens_saved": 0}
+        self._context_lock = threading.Lock()
+        self._pointer_checked_at = 0.0
+        self._refresh_lock = threading.Lock()
+
+    def _vector_db(self, physical_table: str) -> DermaLanceDb:
+        return DermaLanceDb(
+            table_name=physical_table,
+            uri=self.db_path,  # pass just the folder root to `uri`
+            search_type=SearchType.hybrid,
+            embedder=self.embedder,
+            nprobes=self.index_config.nprobes,
+            refine_factor=self.index_config.refine_factor,
+        )
+
+    @property
+    def ingest_version(self) -> str:
+        """Everything that changes the rows produced for an unchanged file."""
+        return f"{CHUNKER_VERSION}:{self.reader.chunk_size}|{self.embedder.id}:{self.embedder.dimensions}"
+
+    def pdf_files(self) -> List[str]:
+        """Absolute paths of every PDF under `pdf_paths` (files or directories)."""
+        found = set()
+        for pdf_path in self.pdf_paths:
+            if os.path.isdir(pdf_path):
+                for root, _, files in os.walk(pdf_path):
+                    found.update(os.path.abspath(os.path.join(root, f)) for f in files if f.lower().endswith(".pdf"))
+            elif os.path.isfile(pdf_path) and pdf_path.lower().endswith(".pdf"):
+                found.add(os.path.abspath(pdf_path))
+        return sorted(found)
+
+    def open(self) -> "DermaKnowledgeBase":
+        """Open the published table version read-only. Never parses or embeds anything."""
+        pointer = read_pointer(self.db_path, self.table_name)
+        version = pointer["version"] if pointer and pointer["table"] == self.physical_table else None
+        self.vector_db.pin(version)
+        if self.vector_db.get_count() == 0:
+            log.warning(f"Knowledge table '{self.physical_table}' is empty; build it with `python -m skin.ingest`")
+        else:
+            log.info(f"Opened knowledge table '{self.physical_table}' at version {self.vector_db.pinned_version}")
+        return self
+
+    def refresh(self, min_interval: float = 5.0) -> bool:
+        """
+        Follow the published pointer if the ingest job has moved it.
+
+        Checked at most every `min_interval` seconds, by one thread at a time.
+        The new version is opened and pinned on a fresh handle that then replaces
+        `vector_db` in one assignment; a handle is never re-pinned, so searches
+        already running on the old one finish on the version they started on.
+        Switching versions clears the query cache, so cached results never
+        outlive the table they came from.
+        """
+        now = time.monotonic()
+        if not self.vector_db.read_only or now - self._pointer_checked_at < min_interval:
+            return False
+        if not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            self._pointer_checked_at = now
+            pointer = read_pointer(self.db_path, self.table_name)
+            current = self.vector_db
+            if not pointer or (pointer["table"], pointer["version"]) == (current.table_name, current.pinned_version):
+                return False
+            vector_db = self._vector_db(pointer["table"])
+            vector_db.pin(pointer["version"])
+            self.vector_db = vector_db
+            self.physical_table = pointer["table"]
+            self.query_cache.clear()
+        finally:
+            self._refresh_lock.release()
+        log.info(f"Knowledge base switched to '{vector_db.table_name}' version {vector_db.pinned_version}")
+        return True
+
+    def table_version(self, vector_db: Optional[DermaLanceDb] = None) -> Optional[int]:
+        vector_db = vector_db or self.vector_db
+        if vector_db.pinned_version is not None:
+            return vector_db.pinned_version
+        return vector_db.table.version if vector_db.table is not None else None
+
+    def search(self, query: str, num_documents: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Search the table, answering repeated queries from the LRU/TTL cache."""
+        self.refresh()
+        # One handle for the whole search, even if a refresh swaps it meanwhile
+        vector_db = self.vector_db
+        key = (
+            vector_db.table_name,
+            self.table_version(vector_db),
+            vector_db.search_type.value,
+            normalize_query(query),
+            num_documents,
+            json.dumps(filters, sort_keys=True, default=str) if filters else None,
+        )
+        with span("kb.search", cache="hit") as fields:
+            documents = self.query_cache.get(key)
+            if documents is None:
+                fields["cache"] = "miss"
+                try:
+                    documents = vector_db.search(query=query, limit=num_documents, filters=filters)
+                except Exception as e:
+                    SEARCH_ERRORS.inc(error=type(e).__name__)
+                    log.error(f"Knowledge search on '{vector_db.table_name}' failed: {e!r}")
+                    if not isinstance(e, RECOVERABLE_SEARCH_ERRORS):
+                        raise
+                    fields["error"] = type(e).__name__
+                    return []
+                self.query_cache.put(key, documents)
+            fields["documents"] = len(documents)
+        return list(documents)
+
+    def context(self, query: str, num_documents: int = 5, filters: Optional[Dict[str, Any]] = None) -> List[Document]:
+        """Search hits as they go into the prompt: deduplicated, merged and packed into the token budget."""
+        config = self.pack_config
+        limit = num_documents * max(config.overfetch, 1) if config.budget_tokens > 0 else num_documents
+        hits = self.search(query, limit, filters)
+        with span("kb.pack") as fields:
+            documents, stats = pack(hits, query, config, max_documents=num_documents)
+            fields.update(stats.as_dict())
+        CONTEXT_TOKENS.inc(stats.tokens_in, kind="retrieved")
+        CONTEXT_TOKENS.inc(stats.tokens_out, kind="sent")
+        with self._context_lock:
+            self.context_totals["requests"] += 1
+            for key, value in stats.as_dict().items():
+                self.context_totals[key] += value
+        return documents
+
+    def stats(self) -> Dict[str, Any]:
+        with self._context_lock:
+            context = dict(self.context_totals)
+        vector_db = self.vector_db
+        return {
+            "table": vector_db.table_name,
+            "version": self.table_version(vector_db),
+            "query_cache": self.query_cache.stats(),
+            "embedding_cache": self.embedder.stats(),
+            "context": context,
+        }
 
     async def aload(self, upsert=True, recreate=False):
+        # Kept for callers that still build the table in-process; prefer `python -m skin.ingest`
+        if recreate:
+            await asyncio.to_thread(self.rebuild)
+        else:
+            await asyncio.to_thread(self.sync)
+
+    def rebuild(self, workers: Optional[int] = None, batch_size: int = 256, keep: int = 1, pages_per_task: int = 16) -> Dict[str, int]:
+        """
+        Build a fresh physical table from scratch, publish it, then drop old builds.
+
+        Readers keep serving the previous table until the pointer is switched.
+        """
+        physical_table = build_table_name(self.table_name)
+        staging = DermaKnowledgeBase(self.table_name, self.db_path, self.pdf_paths, self.urls,
+                                     physical_table=physical_table, index_config=self.index_config)
+        staging.reader.chunk_size = self.reader.chunk_size
+        staging.manifest.clear()
+        stats = staging.sync(workers=workers, batch_size=batch_size, pages_per_task=pages_per_task)
+
+        self.physical_table = staging.physical_table
+        self.vector_db = staging.vector_db
+        self.manifest = staging.manifest
+        self.query_cache.clear()
+        drop_old_builds(self.vector_db.connection, self.db_path, self.table_name, self.physical_table, keep)
+        return stats
+
+    def sync(
+        self,
+        workers: Optional[int] = None,
+        batch_size: int = 256,
+        write_batch_rows: int = 4096,
+        pages_per_task: int = 16,
+    ) -> Dict[str, int]:
+        """
+        Bring the table in line with the PDFs on disk, then publish the new version.
 
-    # Update PDF paths to point to the resources folder
-        if self.pdf_paths:
-            self.pdf_paths = [
-                f"/home/wambui_nicole/VisionModel/skin/resources/{os.path.basename(pdf)}"
-                for pdf in self.pdf_paths
-            ]
-            local_kb = PDFKnowledgeBase(path="./resources", vector_db=self.vector_db)        #this is what I changed
-            await local_kb.aload(upsert=upsert, recreate=recreate)
+        Changed PDFs are split into page ranges that a process pool parses and
+        streams back in order; only a bounded number of ranges is held at once.
+        New chunks are buffered until `write_batch_rows` of them are pending, then
+        embedded through the caching embedder in `batch_size` batches and appended
+        in bulk, so each flush writes one large Lance fragment instead of one per page.
+        """
+        self.vector_db.create()
+        current = self.pdf_files()
+        stats = {"ingested": 0, "unchanged": 0, "removed": 0, "failed": 0, "written": 0}
+
+        changed = []
+        for path in current:
+            stat = os.stat(path)
+            if self.manifest.is_unchanged(path, stat, self.ingest_version):
+                stats["unchanged"] += 1
+                continue
+            sha256 = file_sha256(path)
+            entry = self.manifest.get(path)
+            if entry and entry.sha256 == sha256 and entry.ingest_version == self.ingest_version:
+                # Touched but not modified: refresh the stat fields only
+                entry.size, entry.mtime = stat.st_size, stat.st_mtime
+                stats["unchanged"] += 1
+                continue
+            changed.append((path, stat, sha256))
+        self.manifest.save()
+
+        existing_ids = self._existing_ids() if changed else set()
+        pending_documents: Dict[str, Document] = {}
+        pending_entries: List[ManifestEntry] = []
+        stale_ids: Set[str] = set()
+
+        def flush():
+            if pending_documents:
+                # One embedding call per flush: misses are coalesced across pages and files
+                documents = list(pending_documents.values())
+                vectors = embed_texts(self.embedder, [doc.content for doc in documents], batch_size=batch_size)
+                self.vector_db.table.add([document_row(doc, vector) for doc, vector in zip(documents, vectors)])
+                stats["written"] += len(documents)
+            for new_entry in pending_entries:
+                self.manifest.put(new_entry)
+            deleted = self._delete_rows(stale_ids)
+            existing_ids.difference_update(deleted)
+            # Save after every flush so an interrupted build resumes where it stopped
+            self.manifest.save()
+            pending_documents.clear()
+            pending_entries.clear()
+            stale_ids.clear()
+
+        stat_by_path = {path: (stat, sha256) for path, stat, sha256 in changed}
+        file_chunk_ids: List[str] = []
+        # Rows this file added that were not in the table before
+        file_new_ids: Set[str] = set()
+        failed = False
+        for parsed in iter_parsed_ranges(list(stat_by_path), self.reader.chunk_size, workers, pages_per_task=pages_per_task):
+            failed = failed or parsed.error is not None
+            for doc in parsed.chunks:
+                doc_id = document_id(doc)
+                file_chunk_ids.append(doc_id)
+                if doc_id not in existing_ids:
+                    pending_documents.setdefault(doc_id, doc)
+                    file_new_ids.add(doc_id)
+            existing_ids.update(pending_documents)
+
+            if parsed.last:
+                if failed:
+                    # Leave the manifest alone so the file is retried on the next run, and
+                    # take back the rows its good ranges added: no manifest entry owns them
+                    for doc_id in file_new_ids:
+                        existing_ids.discard(doc_id)
+                        if pending_documents.pop(doc_id, None) is None:
+                            stale_ids.add(doc_id)
+                    stats["failed"] += 1
+                else:
+                    stat, sha256 = stat_by_path[parsed.path]
+                    chunk_ids = list(dict.fromkeys(file_chunk_ids))
+                    old_entry = self.manifest.get(parsed.path)
+                    if old_entry:
+                        stale_ids.update(set(old_entry.chunk_ids) - set(chunk_ids))
+                    pending_entries.append(ManifestEntry(
+                        path=parsed.path,
+                        size=stat.st_size,
+                        mtime=stat.st_mtime,
+                        sha256=sha256,
+                        ingest_version=self.ingest_version,
+                        doc_name=doc_name_for(parsed.path),
+                        chunk_ids=chunk_ids,
+                    ))
+                    stats["ingested"] += 1
+                file_chunk_ids = []
+                file_new_ids = set()
+                failed = False
+            if len(pending_documents) >= write_batch_rows:
+                flush()
+        flush()
+
+        # Only prune files under a configured path that still exists, so a missing
+        # resources mount never wipes the table
+        roots = [os.path.abspath(p) for p in self.pdf_paths if os.path.exists(p)]
+        for path in set(self.manifest.paths()) - set(current):
+            if not any(path == root or path.startswith(root + os.sep) for root in roots):
+                continue
+            stale_ids.update(self.manifest.remove(path).chunk_ids)
+            stats["removed"] += 1
+        flush()
 
         # Load from URLs
         if self.urls:
-            url_kb = PDFUrlKnowledgeBase(urls=self.urls, vector_db=self.vector_db)
-            await url_kb.aload(upsert=upsert, recreate=recreate)
+            PDFUrlKnowledgeBase(urls=self.urls, vector_db=self.vector_db).load(upsert=True)
+
+        if stats["ingested"] or stats["removed"] or self.urls or not self.vector_db.has_fts_index():
+            self.vector_db.build_fts_index()
+        version = self.vector_db.table.version
+        # The manifest that matches the published rows, for jobs that copy this version
+        self.manifest.publish(version)
+        publish_pointer(self.db_path, self.table_name, self.physical_table, version)
+
+        log.info(f"Knowledge base '{self.physical_table}': {stats['ingested']} ingested, "
+                 f"{stats['unchanged']} unchanged, {stats['removed']} removed, {stats['written']} chunks written, embedding cache {self.embedder.stats()}")
+        return stats
+
+    def _existing_ids(self) -> Set[str]:
+        if self.vector_db.table is None or self.vector_db.table.count_rows() == 0:
+            return set()
+        return set(self.vector_db.table.to_lance().to_table(columns=["id"]).column("id").to_pylist())
+
+    def _delete_rows(self, ids: Iterable[str], batch_size: int = 500) -> Set[str]:
+        """Delete rows by id, keeping any that a file in the manifest still references."""
+        stale = sorted(set(ids) - self.manifest.referenced_ids())
+        if stale and self.vector_db.table is not None:
+            for i in range(0, len(stale), batch_size):
+                id_list = ", ".join(f"'{doc_id}'" for doc_id in stale[i:i + batch_size])
+                self.vector_db.table.delete(f"id IN ({id_list})")
+        return set(stale)
 
     def get_knowledge_base(self):
-        # Just return one interface (same DB)
-        return PDFKnowledgeBase(files=[], vector_db=self.vector_db)
+        # Just return one interface (same DB); searches go through the query cache
+        return DermaKnowledge(vector_db=self.vector_db, derma_kb=self)
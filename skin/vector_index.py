@@ -0,0 +1,189 @@
+"""
+ANN vector index settings for the derma knowledge table.
+
+    python -m skin.vector_index --build              # (re)build the index with the deployment's settings
+    python -m skin.vector_index --report             # recall@k and latency vs exact search
+
+Settings come from a named profile (KB_ANN_PROFILE=fast|balanced|accurate) with
+optional per-setting overrides (KB_ANN_INDEX_TYPE, KB_ANN_PARTITIONS,
+KB_ANN_SUB_VECTORS, KB_ANN_NPROBES, KB_ANN_REFINE_FACTOR, KB_ANN_MIN_ROWS), so
+each deployment can pick its own point on the recall/latency curve.
+
+IVF_PQ is the default. IVF_HNSW_SQ builds an HNSW graph inside each partition,
+which usually reaches a given recall with fewer probes at the cost of a larger
+index and a slower build; compare them with --report after --build.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import Any, Dict, List, Optional, Tuple
+import lancedb
+from skin.lance import publish_pointer, read_pointer, table_lock
+from skin.manifest import IngestManifest
+from telemetry import get_logger, percentile
+
+log = get_logger(__name__)
+
+# Tables below this size are fastest with a flat scan
+ANN_MIN_ROWS = 50_000
+INDEX_TYPES = ("IVF_PQ", "IVF_HNSW_SQ", "IVF_HNSW_PQ", "IVF_FLAT")
+
+
+@dataclass
+class VectorIndexConfig:
+    index_type: str = "IVF_PQ"
+    metric: str = "cosine"
+    num_partitions: Optional[int] = None  # None: ~sqrt(rows)
+    num_sub_vectors: Optional[int] = None  # None: dimensions / 16
+    nprobes: int = 20
+    refine_factor: Optional[int] = None
+    min_rows: int = ANN_MIN_ROWS
+
+    def partitions_for(self, rows: int) -> int:
+        return self.num_partitions or max(1, int(math.sqrt(rows)))
+
+    def sub_vectors_for(self, dimensions: int) -> int:
+        return self.num_sub_vectors or max(1, dimensions // 16)
+
+    @classmethod
+    def from_env(cls) -> "VectorIndexConfig":
+        config = PROFILES.get(os.getenv("KB_ANN_PROFILE", "balanced"), PROFILES["balanced"])
+        overrides = {
+            "num_partitions": os.getenv("KB_ANN_PARTITIONS"),
+            "num_sub_vectors": os.getenv("KB_ANN_SUB_VECTORS"),
+            "nprobes": os.getenv("KB_ANN_NPROBES"),
+            "refine_factor": os.getenv("KB_ANN_REFINE_FACTOR"),
+            "min_rows": os.getenv("KB_ANN_MIN_ROWS"),
+        }
+        config = replace(config, **{k: int(v) for k, v in overrides.items() if v})
+        index_type = os.getenv("KB_ANN_INDEX_TYPE")
+        if index_type:
+            if index_type.upper() not in INDEX_TYPES:
+                raise ValueError(f"KB_ANN_INDEX_TYPE must be one of {', '.join(INDEX_TYPES)}, not {index_type!r}")
+            config = replace(config, index_type=index_type.upper())
+        return config
+
+
+PROFILES: Dict[str, VectorIndexConfig] = {
+    "fast": VectorIndexConfig(nprobes=8),
+    "balanced": VectorIndexConfig(nprobes=20, refine_factor=5),
+    "accurate": VectorIndexConfig(nprobes=50, refine_factor=20),
+}
+
+
+def has_vector_index(table) -> bool:
+    return any("vector" in getattr(index, "columns", []) for index in table.list_indices())
+
+
+def build_vector_index(table, config: VectorIndexConfig) -> None:
+    """(Re)build the vector index on `table` with the sizes from `config`."""
+    dimensions = table.schema.field("vector").type.list_size
+    options = {}
+    if config.index_type.endswith("_PQ"):
+        options["num_sub_vectors"] = config.sub_vectors_for(dimensions)
+    table.create_index(
+        metric=config.metric,
+        vector_column_name="vector",
+        index_type=config.index_type,
+        num_partitions=config.partitions_for(table.count_rows()),
+        replace=True,
+        **options,
+    )
+
+
+def recall_report(
+    table,
+    settings: List[Tuple[int, Optional[int]]],
+    sample_size: int = 100,
+    k: int = 10,
+) -> List[Dict[str, Any]]:
+    """
+    Compare ANN search against exact search for each (nprobes, refine_factor) pair.
+
+    Query vectors are a random sample of stored chunk vectors. Returns one row per
+    setting with recall@k and p50/p95 latency, preceded by the exact-search row.
+    """
+    sample = table.to_lance().sample(min(sample_size, table.count_rows()), columns=["vector"])
+    queries = [list(vector) for vector in sample.column("vector").to_pylist()]
+
+    def run(configure) -> Tuple[List[List[str]], List[float]]:
+        ids, latencies = [], []
+        for vector in queries:
+            builder = configure(table.search(vector, vector_column_name="vector").limit(k).select(["id"]))
+            started = time.perf_counter()
+            ids.append(builder.to_arrow().column("id").to_pylist())
+            latencies.append((time.perf_counter() - started) * 1000)
+        return ids, latencies
+
+    exact_ids, exact_latencies = run(lambda builder: builder.bypass_vector_index())
+    rows = [{
+        "nprobes": None,
+        "refine_factor": None,
+        "recall_at_k": 1.0,
+        "p50_ms": round(statistics.median(exact_latencies), 3),
+        "p95_ms": round(percentile(exact_latencies, 95), 3),
+    }]
+    for nprobes, refine_factor in settings:
+        def configure(builder, nprobes=nprobes, refine_factor=refine_factor):
+            builder = builder.nprobes(nprobes)
+            return builder.refine_factor(refine_factor) if refine_factor else builder
+        ann_ids, latencies = run(configure)
+        hits = sum(len(set(a) & set(e)) for a, e in zip(ann_ids, exact_ids))
+        total = sum(len(e) for e in exact_ids)
+        rows.append({
+            "nprobes": nprobes,
+            "refine_factor": refine_factor,
+            "recall_at_k": round(hits / total, 4) if total else 0.0,
+            "p50_ms": round(statistics.median(latencies), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+        })
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m skin.vector_index", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--table", default="derma_knowledge", help="logical table name")
+    parser.add_argument("--db-path", default="./my_local_lancedb", help="LanceDB folder")
+    parser.add_argument("--build", action="store_true", help="(re)build the vector index")
+    parser.add_argument("--report", action="store_true", help="print recall/latency against exact search")
+    parser.add_argument("--sample", type=int, default=100, help="query vectors to sample for --report")
+    parser.add_argument("-k", type=int, default=10, help="top-k compared for recall")
+    args = parser.parse_args(argv)
+
+    config = VectorIndexConfig.from_env()
+    pointer = read_pointer(args.db_path, args.table)
+    table = lancedb.connect(args.db_path).open_table(pointer["table"] if pointer else args.table)
+    log.info(f"Vector index settings: {asdict(config)}")
+
+    if args.build:
+        with table_lock(args.db_path, args.table, wait=True):
+            pointer = read_pointer(args.db_path, args.table)
+            table = lancedb.connect(args.db_path).open_table(pointer["table"] if pointer else args.table)
+            if pointer is not None and table.version != pointer["version"]:
+                log.error(f"'{table.name}' has versions past the published one (an unfinished ingest); "
+                          f"run `python -m skin.maintenance` or finish the ingest first")
+                return 1
+            manifest = IngestManifest.published(args.db_path, table.name, table.version) if pointer else None
+            started = time.perf_counter()
+            build_vector_index(table, config)
+            log.info(f"Built {config.index_type} index on {table.count_rows()} rows in {time.perf_counter() - started:.1f}s")
+            # Index builds add a table version; point readers at it, with the same manifest
+            if manifest is not None:
+                manifest.publish(table.version)
+            publish_pointer(args.db_path, args.table, table.name, table.version)
+
+    if args.report:
+        if not has_vector_index(table):
+            log.warning("No vector index yet; every setting below is an exact scan")
+        settings = sorted({(p.nprobes, p.refine_factor) for p in PROFILES.values()} | {(config.nprobes, config.refine_factor)},
+                          key=lambda s: (s[0], s[1] or 0))
+        print(json.dumps(recall_report(table, settings, sample_size=args.sample, k=args.k), indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
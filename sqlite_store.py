@@ -0,0 +1,388 @@
+"""
+SQLite agent storage and memory for many concurrent WhatsApp sessions.
+
+    python -m sqlite_store --sessions 64 --turns 20     # write-latency benchmark
+
+agno's SqliteStorage and SqliteMemoryDb open the database in rollback-journal
+mode and commit every write on their own. Under concurrent webhooks the writers
+queue on SQLite's file lock and stall with `database is locked`. Here every
+store shares one engine per file, set up like this:
+
+* WAL mode, so readers never block the writer or each other, served from a
+  pooled set of read connections;
+* one writer thread that owns all writes and commits whatever has queued up
+  in a single transaction (group commit);
+* session upserts are write-behind: the caller gets the session back at once,
+  and reads of a session with a pending write are served from that write.
+
+agno's storage API is synchronous and is called from inside Agent/Team runs, so
+the writer is a thread rather than an asyncio task.
+"""
+import argparse
+import atexit
+import json
+import os
+import queue
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import Engine, create_engine, delete, event, inspect, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from agno.memory.v2.db.schema import MemoryRow
+from agno.memory.v2.db.sqlite import SqliteMemoryDb
+from agno.storage.session import Session
+from agno.storage.sqlite import SqliteStorage
+
+from telemetry import get_logger, percentile, span
+
+log = get_logger(__name__)
+
+_writers: Dict[str, "SqliteWriter"] = {}
+_writers_lock = threading.Lock()
+
+
+def create_wal_engine(db_file: str, read_pool_size: int = 8) -> Engine:
+    """Engine with WAL journaling and a pool of `read_pool_size` connections."""
+    db_path = Path(db_file).resolve()
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    engine = create_engine(
+        f"sqlite:///{db_path}",
+        pool_size=read_pool_size,
+        max_overflow=read_pool_size,
+        connect_args={"timeout": 30, "check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _configure(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints; a power cut can lose the last commits but never corrupts
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.close()
+
+    return engine
+
+
+class SqliteWriter:
+    """
+    The only thread that writes to one SQLite file.
+
+    `submit` queues a statement (or a list of statements that must commit
+    together) and returns a Future resolved once it is committed. The thread takes everything queued (up to `max_batch`) and commits
+    it in one transaction. If that transaction fails, the batch is replayed one
+    statement at a time so only the bad statement's Future fails. Once closed,
+    `submit` raises instead of queueing work nobody will commit.
+    """
+
+    def __init__(self, engine: Engine, max_batch: int = 256):
+        self.engine = engine
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Optional[Tuple[Any, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.closed = False
+        self.batches = 0
+        self.statements = 0
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, statement) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self.closed:
+                raise RuntimeError("SQLite writer is closed")
+            self._queue.put((statement, future))
+        return future
+
+    def execute(self, statement) -> None:
+        """Write and wait for the commit."""
+        self.submit(statement).result()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._commit(batch)
+                    return
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: List[Tuple[Any, Future]]) -> None:
+        try:
+            with span("storage.commit", statements=len(batch)), self.engine.begin() as connection:
+                for statement, _ in batch:
+                    for part in statement if isinstance(statement, list) else [statement]:
+                        connection.execute(part)
+        except Exception as e:
+            if len(batch) > 1:
+                for item in batch:
+                    self._commit([item])
+                return
+            batch[0][1].set_exception(e)
+            return
+        self.batches += 1
+        self.statements += len(batch)
+        for _, future in batch:
+            future.set_result(None)
+
+    def close(self) -> None:
+        """Commit everything queued, then stop the thread."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "queued": self._queue.qsize(),
+            "batches": self.batches,
+            "statements": self.statements,
+            "avg_batch": round(self.statements / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+def get_writer(db_file: str, read_pool_size: int = 8) -> SqliteWriter:
+    """The process-wide writer (and engine) for `db_file`; a closed writer is replaced on the same engine."""
+    key = str(Path(db_file).resolve())
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None or writer.closed:
+            engine = writer.engine if writer is not None else create_wal_engine(key, read_pool_size)
+            writer = _writers[key] = SqliteWriter(engine)
+        return writer
+
+
+def close_writers() -> None:
+    with _writers_lock:
+        for writer in _writers.values():
+            writer.close()
+
+
+atexit.register(close_writers)
+
+
+class _SharedWriter:
+    """The current writer of `_writer_file`, so stores keep working after close_writers()."""
+
+    _writer_file: str
+    _writer: SqliteWriter
+
+    @property
+    def writer(self) -> SqliteWriter:
+        if self._writer.closed:
+            self._writer = get_writer(self._writer_file)
+        return self._writer
+
+    @writer.setter
+    def writer(self, writer: SqliteWriter) -> None:
+        self._writer = writer
+
+
+class WalSqliteStorage(_SharedWriter, SqliteStorage):
+    """
+    SqliteStorage on the shared WAL engine, with write-behind upserts through the writer thread.
+
+    A write that still fails after `write_retries` attempts stays pending, so
+    reads keep seeing it, until a later write of the same session commits.
+    """
+
+    write_retries = 3
+
+    def __init__(self, table_name: str, db_file: str, mode: Optional[str] = "agent", **kwargs):
+        self._writer_file = db_file
+        self.writer = get_writer(db_file)
+        self.failed_writes = 0
+        self._pending: Dict[str, Session] = {}
+        self._pending_lock = threading.Lock()
+        super().__init__(table_name=table_name, db_engine=self.writer.engine, mode=mode, **kwargs)
+        # agno 1.5 falls through to an in-memory engine when given only db_engine
+        self.db_engine = self.writer.engine
+        self.inspector = inspect(self.db_engine)
+        self.SqlSession = sessionmaker(bind=self.db_engine)
+        # Create up front so upserts never need agno's create-and-retry path
+        self.create()
+
+    def _upsert_statement(self, session: Session):
+        values = {
+            column.name: getattr(session, column.name)
+            for column in self.table.columns
+            if column.name not in ("created_at", "updated_at") and hasattr(session, column.name)
+        }
+        updates = {name: value for name, value in values.items() if name != "session_id"}
+        updates["updated_at"] = int(time.time())
+        return sqlite.insert(self.table).values(**values).on_conflict_do_update(index_elements=["session_id"], set_=updates)
+
+    def upsert(self, session: Session, create_and_retry: bool = True) -> Optional[Session]:
+        if self.auto_upgrade_schema and not self._schema_up_to_date:
+            self.upgrade_schema()
+        with self._pending_lock:
+            self._pending[session.session_id] = session
+        self._submit(session, attempt=1)
+        return session
+
+    def _submit(self, session: Session, attempt: int) -> None:
+        future = self.writer.submit(self._upsert_statement(session))
+        future.add_done_callback(lambda f, session=session, attempt=attempt: self._written(session, f, attempt))
+
+    def _written(self, session: Session, future: Future, attempt: int) -> None:
+        error = future.exception()
+        if error is not None:
+            with self._pending_lock:
+                superseded = self._pending.get(session.session_id) is not session
+            if superseded:
+                return
+            if attempt < self.write_retries:
+                try:
+                    self._submit(session, attempt + 1)
+                    return
+                except RuntimeError as e:
+                    error = e
+            self.failed_writes += 1
+            log.error(f"Failed to store session {session.session_id} after {attempt} attempts: {error}")
+            # Kept pending: reads stay consistent and the next upsert of the session retries it
+            return
+        with self._pending_lock:
+            # A newer write of the same session may have been queued meanwhile
+            if self._pending.get(session.session_id) is session:
+                del self._pending[session.session_id]
+
+    def read(self, session_id: str, user_id: Optional[str] = None) -> Optional[Session]:
+        with self._pending_lock:
+            pending = self._pending.get(session_id)
+        if pending is not None and (user_id is None or pending.user_id == user_id):
+            return pending
+        with span("storage.read"):
+            return super().read(session_id, user_id)
+
+    def delete_session(self, session_id: Optional[str] = None):
+        if session_id is None:
+            return
+        with self._pending_lock:
+            self._pending.pop(session_id, None)
+        self.writer.execute(delete(self.table).where(self.table.c.session_id == session_id))
+
+
+class WalSqliteMemoryDb(_SharedWriter, SqliteMemoryDb):
+    """SqliteMemoryDb on the shared WAL engine; writes are group-committed by the writer thread."""
+
+    def __init__(self, table_name: str, db_file: str):
+        self._writer_file = db_file
+        self.writer = get_writer(db_file)
+        super().__init__(table_name=table_name, db_engine=self.writer.engine)
+        # agno 1.5 falls through to an in-memory engine when given only db_engine
+        self.db_engine = self.writer.engine
+        self.inspector = inspect(self.db_engine)
+        self.Session = scoped_session(sessionmaker(bind=self.db_engine))
+        self.db_file = db_file
+        self.create()
+
+    def upsert_memory(self, memory: MemoryRow, create_and_retry: bool = True) -> None:
+        statement = sqlite.insert(self.table).values(
+            id=memory.id, user_id=memory.user_id, memory=str(memory.memory)
+        ).on_conflict_do_update(
+            index_elements=["id"],
+            set_={"user_id": memory.user_id, "memory": str(memory.memory), "updated_at": text("CURRENT_TIMESTAMP")},
+        )
+        self.writer.execute(statement)
+
+    def delete_memory(self, memory_id: str) -> None:
+        self.writer.execute(delete(self.table).where(self.table.c.id == memory_id))
+
+
+def _latency_summary(values: List[float]) -> Dict[str, float]:
+    ms = [v * 1000 for v in values]
+    return {
+        "p50_ms": round(statistics.median(ms), 3),
+        "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3),
+        "max_ms": round(max(ms), 3),
+    }
+
+
+def benchmark(sessions: int = 64, turns: int = 20, payload_kb: int = 16) -> Dict[str, Any]:
+    """
+    Concurrent session upserts, one thread per session, each on a fresh file.
+
+    * stock: agno's SqliteStorage, one rollback-journal commit per write;
+    * group_commit: WalSqliteStorage's statement through the writer, waiting for
+      the commit (what every memory write sees);
+    * write_behind: WalSqliteStorage.upsert as agents call it.
+    """
+    from agno.storage.session.agent import AgentSession
+
+    history = [{"role": "user", "content": "x" * 1024} for _ in range(payload_kb)]
+
+    def run(write: Callable[[Session], Any]) -> Tuple[List[float], float]:
+        latencies: List[float] = []
+        lock = threading.Lock()
+
+        def session_worker(n: int) -> None:
+            for turn in range(turns):
+                session = AgentSession(
+                    session_id=f"whatsapp:+{n}#0", user_id=f"whatsapp:+{n}", agent_id="bench",
+                    memory={"runs": history[: turn * payload_kb // turns + 1]}, session_data={"turn": turn},
+                )
+                started = time.perf_counter()
+                write(session)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=sessions) as pool:
+            list(pool.map(session_worker, range(sessions)))
+        return latencies, time.perf_counter() - started
+
+    def summary(latencies: List[float], wall: float) -> Dict[str, Any]:
+        return {**_latency_summary(latencies), "writes_per_s": round(len(latencies) / wall, 1)}
+
+    report: Dict[str, Any] = {"sessions": sessions, "turns": turns, "payload_kb": payload_kb}
+    with tempfile.TemporaryDirectory() as tmp:
+        stock = SqliteStorage(table_name="bench", db_file=os.path.join(tmp, "stock.sqlite"))
+        stock.create()
+        failures = []
+        report["stock"] = summary(*run(lambda session: stock.upsert(session) or failures.append(session)))
+        report["stock"]["failed"] = len(failures)
+
+        wal = WalSqliteStorage(table_name="bench", db_file=os.path.join(tmp, "group.sqlite"))
+        report["group_commit"] = summary(*run(lambda session: wal.writer.execute(wal._upsert_statement(session))))
+        report["group_commit"]["writer"] = wal.writer.stats()
+
+        behind = WalSqliteStorage(table_name="bench", db_file=os.path.join(tmp, "behind.sqlite"))
+        latencies, wall = run(behind.upsert)
+        started = time.perf_counter()
+        behind.writer.close()
+        report["write_behind"] = {**summary(latencies, wall), "drain_ms": round((time.perf_counter() - started) * 1000, 1)}
+        wal.writer.close()
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sqlite_store", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=64, help="concurrent sessions")
+    parser.add_argument("--turns", type=int, default=20, help="upserts per session")
+    parser.add_argument("--payload-kb", type=int, default=16, help="largest session history, in KB")
+    args = parser.parse_args(argv)
+    print(json.dumps(benchmark(args.sessions, args.turns, args.payload_kb), indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
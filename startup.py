@@ -0,0 +1,235 @@
+"""
+Lazy startup for the web apps: a component registry, health routes and an
+import-time budget check.
+
+Importing an app module should cost little more than FastAPI itself. The
+agents, the knowledge base, the Twilio client and the toolkits behind them are
+registered as components instead and built on first use, with their heavy
+imports done inside the factories and off the event loop:
+
+    components = Components()
+    components.register("kb", load_derma_kb)
+    team = await components.get("team")
+
+Concurrent callers of `get` share one build; a failed build is retried by the
+next caller. `warm()` builds the required components ahead of traffic.
+
+`health_router(components)` adds GET /healthz (liveness: the process is up and
+serving) and GET /readyz (readiness: every required component is built; 503
+until then), so an orchestrator can restart hung workers without also
+restarting ones that are still warming up.
+
+    python -m startup                      # import cost of both apps vs the budget
+    python -m startup --budget 0.8 dermaAssistant
+
+runs each import in a fresh interpreter and fails when it exceeds the budget
+or pulls in one of the modules that must stay lazy (`HEAVY_MODULES`).
+tests/test_import_budget.py runs the same check under `make test`.
+"""
+import argparse
+import asyncio
+import importlib
+import inspect
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+# Modules only the components need; importing an app must not load them
+HEAVY_MODULES = (
+    "agno.agent",
+    "agno.team",
+    "agno.models.groq",
+    "agno.models.google",
+    "duckduckgo_search",
+    "fastembed",
+    "google.genai",
+    "lancedb",
+    "pyarrow",
+    "pandas",
+    "sqlalchemy",
+    "twilio.rest",
+)
+
+
+async def import_module(name: str) -> Any:
+    """Import `name` in a worker thread, so a cold import never stalls the event loop."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return await asyncio.to_thread(importlib.import_module, name)
+
+
+@dataclass
+class Component:
+    name: str
+    factory: Callable[[], Any]
+    # Readiness waits for required components only
+    required: bool = True
+    state: str = "idle"  # idle, loading, ready or failed
+    value: Any = None
+    error: Optional[str] = None
+    seconds: Optional[float] = None
+    _task: Optional[asyncio.Task] = field(default=None, repr=False)
+
+
+class Components:
+    """Named, lazily built singletons. Sync factories run in a worker thread."""
+
+    def __init__(self):
+        self._components: Dict[str, Component] = {}
+        self.started = time.time()
+
+    def register(self, name: str, factory: Callable[[], Any], required: bool = True) -> None:
+        self._components[name] = Component(name, factory, required)
+
+    def provide(self, name: str, value: Any) -> None:
+        """Use `value` as the built component, e.g. a stub in benchmarks and load tests."""
+        component = self._components.setdefault(name, Component(name, lambda: value))
+        component.value, component.state, component.error, component._task = value, "ready", None, None
+
+    def peek(self, name: str) -> Any:
+        """The component if it is built, else None; never triggers a build."""
+        component = self._components[name]
+        return component.value if component.state == "ready" else None
+
+    async def get(self, name: str) -> Any:
+        component = self._components[name]
+        if component.state == "ready":
+            return component.value
+        if component._task is None or component._task.done():
+            component._task = asyncio.ensure_future(self._build(component))
+        # Shielded, so one caller timing out or disconnecting does not cancel the build for the rest
+        return await asyncio.shield(component._task)
+
+    async def _build(self, component: Component) -> Any:
+        component.state = "loading"
+        start = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(component.factory):
+                value = await component.factory()
+            else:
+                value = await asyncio.to_thread(component.factory)
+        except Exception as e:
+            component.state, component.error = "failed", str(e)
+            log.error(f"Could not build component {component.name}: {e}")
+            raise
+        component.value, component.state, component.error = value, "ready", None
+        component.seconds = round(time.perf_counter() - start, 3)
+        log.info(f"Component {component.name} ready in {component.seconds}s")
+        return value
+
+    async def warm(self, names: Optional[Iterable[str]] = None) -> None:
+        """Build `names` (default: the required components); failures are logged and left for first use."""
+        names = list(names) if names is not None else [c.name for c in self._components.values() if c.required]
+        await asyncio.gather(*(self.get(name) for name in names), return_exceptions=True)
+
+    def ready(self) -> bool:
+        return all(c.state == "ready" for c in self._components.values() if c.required)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "uptime": round(time.time() - self.started, 1),
+            "components": {
+                c.name: {"state": c.state, "required": c.required, "seconds": c.seconds, "error": c.error}
+                for c in self._components.values()
+            },
+        }
+
+
+def health_router(components: Components) -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/healthz")
+    async def healthz():
+        """Liveness: the worker is up and its event loop answers."""
+        return {"status": "ok", "uptime": round(time.time() - components.started, 1)}
+
+    @router.get("/readyz")
+    async def readyz():
+        """Readiness: every required component is built (503 while warming up or after a failed build)."""
+        status = components.status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    return router
+
+
+def startup_mode() -> str:
+    """
+    STARTUP_WARMUP: "background" (default) builds the required components
+    after the app starts serving; "lazy" waits for the first request that needs
+    them; "blocking" builds them before the app accepts requests.
+    """
+    mode = os.getenv("STARTUP_WARMUP", "background")
+    if mode not in ("background", "lazy", "blocking"):
+        raise ValueError(f"unknown STARTUP_WARMUP {mode!r}")
+    return mode
+
+
+# Import-time budget
+
+def measure_import(module: str, python: str = sys.executable) -> Tuple[float, List[str], List[Tuple[int, str]]]:
+    """
+    Import `module` in a fresh interpreter. Returns the seconds it took, the
+    HEAVY_MODULES it loaded and the (cumulative microseconds, name) of its
+    costliest imports.
+    """
+    code = (
+        "import sys, time\n"
+        "t = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - t)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))\n"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")]))}
+    result = subprocess.run([python, "-X", "importtime", "-c", code], capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    seconds, heavy = result.stdout.splitlines()[-2:]
+    costly = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and not line.endswith("| imported package"):
+            parts = [part.strip() for part in line[len("import time:"):].split("|")]
+            if len(parts) == 3 and parts[1].isdigit():
+                costly.append((int(parts[1]), parts[2]))
+    costly.sort(reverse=True)
+    return float(seconds), [m for m in heavy.split(",") if m], costly
+
+
+def check_budget(modules: Sequence[str], budget: float, repeat: int = 3, top: int = 8) -> bool:
+    ok = True
+    for module in modules:
+        runs = [measure_import(module) for _ in range(repeat)]
+        seconds = min(run[0] for run in runs)
+        _, heavy, costly = min(runs, key=lambda run: run[0])
+        over = seconds > budget
+        print(f"[{'FAIL' if over or heavy else 'OK'}] import {module}: {seconds:.3f}s (budget {budget:.3f}s)")
+        for micros, name in costly[1:top + 1]:
+            print(f"    {micros / 1e6:.3f}s  {name}")
+        if heavy:
+            print(f"    loads modules that must stay lazy: {', '.join(heavy)}")
+        ok = ok and not over and not heavy
+    return ok
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m startup", description="Check the import cost of the web apps.")
+    parser.add_argument("modules", nargs="*", default=["dermaAssistant", "twilio_response"], help="modules to import")
+    parser.add_argument("--budget", type=float, default=float(os.getenv("IMPORT_BUDGET", "1.0")), help="seconds per module")
+    parser.add_argument("--repeat", type=int, default=3, help="imports per module; the fastest counts")
+    args = parser.parse_args(argv)
+    return 0 if check_budget(args.modules, args.budget, args.repeat) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,294 @@
+"""
+Coalesced, progressive delivery of streamed replies.
+
+    python -m streaming         # replay a fake token stream and count outbound messages
+
+Sending every streamed fragment as its own WhatsApp message costs one API call
+per token or two. deliver_stream buffers the stream instead and sends it in
+message-sized segments:
+
+* a segment ends at a section break, a line break or the end of a sentence,
+  preferring the strongest boundary once the buffer passes the target size;
+* the first segment has a smaller target, so the patient sees the opening
+  paragraph early;
+* nothing waits in the buffer longer than `max_latency` seconds: the text up to
+  the last boundary is flushed when the timer expires;
+* segments are delivered in order by a separate task, so a slow API call never
+  stalls the stream, and segments that pile up behind one are merged (up to the
+  WhatsApp size limit) into a single message;
+* every API call goes through the process-wide SendPool, which caps the number
+  in flight across all recipients.
+"""
+import asyncio
+import os
+import re
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from jobs import WHATSAPP_MAX_CHARS, split_message
+
+# Strongest first: section break, line break, end of sentence, any space
+_BOUNDARIES = (
+    re.compile(r"\n\s*\n"),
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?:;])[\"')\]]*\s"),
+    re.compile(r"\s"),
+)
+
+
+def chunk_text(chunk: Any) -> str:
+    """Text of one stream item: a str, or an agno run event with `content`."""
+    if isinstance(chunk, str):
+        return chunk
+    content = getattr(chunk, "content", None)
+    return content if isinstance(content, str) else ""
+
+
+def cut_point(text: str, min_chars: int, max_chars: int, weakest: int = 2) -> int:
+    """
+    Where to end a segment of `text`, or 0 when there is no boundary yet.
+
+    Looks for the strongest boundary (up to `weakest` in _BOUNDARIES) that
+    ends between `min_chars` and `max_chars`, using the last one of its kind.
+    """
+    window = text[:max_chars]
+    for pattern in _BOUNDARIES[: weakest + 1]:
+        ends = [m.end() for m in pattern.finditer(window) if m.end() >= min_chars]
+        if ends:
+            return ends[-1]
+    return 0
+
+
+class SendPool:
+    """Caps concurrent outbound message API calls across all recipients."""
+
+    def __init__(self, size: int = 8):
+        self.size = size
+        self._semaphore = asyncio.Semaphore(size)
+        self.counts = {"messages": 0, "chars": 0, "errors": 0}
+
+    async def send(self, deliver: Callable[[str], Awaitable[Any]], text: str) -> None:
+        async with self._semaphore:
+            try:
+                await deliver(text)
+            except Exception:
+                self.counts["errors"] += 1
+                raise
+        self.counts["messages"] += 1
+        self.counts["chars"] += len(text)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "in_flight": self.size - self._semaphore._value, **self.counts}
+
+
+send_pool = SendPool(int(os.getenv("REPLY_SEND_CONCURRENCY", "8")))
+
+
+@dataclass
+class StreamStats:
+    chunks: int = 0
+    chars: int = 0
+    segments: int = 0
+    messages: int = 0
+    first_message_s: Optional[float] = None
+    total_s: float = 0.0
+
+
+class StreamCoalescer:
+    """Buffers streamed text for one recipient and hands ordered segments to `deliver`."""
+
+    def __init__(
+        self,
+        deliver: Callable[[str], Awaitable[Any]],
+        target_chars: int = 700,
+        first_target_chars: int = 240,
+        max_chars: int = WHATSAPP_MAX_CHARS,
+        max_latency: float = 3.0,
+        pool: Optional[SendPool] = None,
+    ):
+        self.deliver = deliver
+        self.target_chars = target_chars
+        self.first_target_chars = first_target_chars
+        self.max_chars = max_chars
+        self.max_latency = max_latency
+        self.pool = pool or send_pool
+        self.stats = StreamStats()
+        self._buffer = ""
+        self._buffered_at: Optional[float] = None
+        self._started = time.perf_counter()
+        self._outbox: List[str] = []
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._sender: Optional[asyncio.Task] = None
+
+    def _target(self) -> int:
+        return self.first_target_chars if self.stats.segments == 0 else self.target_chars
+
+    def feed(self, text: str) -> None:
+        if not text:
+            return
+        self.stats.chunks += 1
+        self.stats.chars += len(text)
+        if not self._buffer:
+            self._buffered_at = time.perf_counter()
+        self._buffer += text
+        while True:
+            target = self._target()
+            if len(self._buffer) < target:
+                break
+            cut = cut_point(self._buffer, target, self.max_chars)
+            if not cut:
+                if len(self._buffer) < self.max_chars:
+                    break
+                # No sentence boundary within a whole message: settle for a space
+                cut = cut_point(self._buffer, 1, self.max_chars, weakest=3) or self.max_chars
+            self._emit(cut)
+
+    def flush_due(self) -> Optional[float]:
+        """Flush on the latency timer if it has expired; otherwise the seconds left on it."""
+        if not self._buffer:
+            return None
+        left = self._buffered_at + self.max_latency - time.perf_counter()
+        if left > 0:
+            return left
+        cut = cut_point(self._buffer, 1, self.max_chars) or cut_point(self._buffer, 1, self.max_chars, weakest=3)
+        if cut:
+            self._emit(cut)
+        else:
+            # One unbroken word so far; give it another period
+            self._buffered_at = time.perf_counter()
+        return None
+
+    def _emit(self, cut: int) -> None:
+        segment, self._buffer = self._buffer[:cut].strip(), self._buffer[cut:].lstrip()
+        self._buffered_at = time.perf_counter() if self._buffer else None
+        if not segment:
+            return
+        self.stats.segments += 1
+        self._outbox.append(segment)
+        self._ready.set()
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_loop())
+
+    async def _send_loop(self) -> None:
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            while self._outbox:
+                # Merge whatever queued up behind the previous call
+                message = self._outbox.pop(0)
+                while self._outbox and len(message) + 2 + len(self._outbox[0]) <= self.max_chars:
+                    message += "\n\n" + self._outbox.pop(0)
+                for part in split_message(message, self.max_chars):
+                    await self.pool.send(self.deliver, part)
+                    self.stats.messages += 1
+                    if self.stats.first_message_s is None:
+                        self.stats.first_message_s = time.perf_counter() - self._started
+            if self._closed:
+                return
+
+    @property
+    def failed(self) -> bool:
+        """Delivery has stopped on an error; close() raises it."""
+        return self._sender is not None and self._sender.done() and not self._closed
+
+    async def close(self) -> StreamStats:
+        """Send whatever is buffered and wait for every segment to go out."""
+        if self._buffer:
+            self._emit(len(self._buffer))
+        self._closed = True
+        self._ready.set()
+        if self._sender is not None:
+            await self._sender
+        self.stats.total_s = time.perf_counter() - self._started
+        return self.stats
+
+
+async def deliver_stream(stream: AsyncIterator[Any], deliver: Callable[[str], Awaitable[Any]], **kwargs) -> StreamStats:
+    """Consume `stream` and send its text through `deliver` in coalesced segments."""
+    coalescer = StreamCoalescer(deliver, **kwargs)
+    chunks: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def pump() -> None:
+        # Reading in a separate task lets the flush timer fire between chunks
+        # without cancelling the stream's own __anext__
+        try:
+            async for chunk in stream:
+                await chunks.put(chunk)
+        finally:
+            await chunks.put(done)
+
+    reader = asyncio.create_task(pump())
+    try:
+        timeout = None
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.get(), timeout)
+            except asyncio.TimeoutError:
+                timeout = coalescer.flush_due()
+                continue
+            if chunk is done or coalescer.failed:
+                break
+            coalescer.feed(chunk_text(chunk))
+            timeout = coalescer.flush_due()
+    finally:
+        # Stop the pump first: close() raises if delivery failed
+        if not reader.done():
+            reader.cancel()
+            await asyncio.gather(reader, return_exceptions=True)
+        stats = await coalescer.close()
+    # Surface errors from the stream itself
+    if reader.done() and not reader.cancelled() and reader.exception():
+        raise reader.exception()
+    return stats
+
+
+async def _fake_stream(text: str, delay: float) -> AsyncIterator[str]:
+    for token in re.findall(r"\S+\s*|\s+", text):
+        await asyncio.sleep(delay)
+        yield token
+
+
+def main() -> int:
+    answer = (
+        "**Clinical Features Analysis**\n\nA red, scaly, itchy patch on the forearm present for two weeks. "
+        "The ring shape with a clearer centre is typical of a fungal infection.\n\n"
+        "**Potential Diagnoses**\n\n1. Tinea corporis (ringworm).\n2. Nummular eczema.\n3. Psoriasis.\n\n"
+        "**Recommended Actions**\n\nApply an over-the-counter antifungal cream such as clotrimazole twice a day "
+        "for two to four weeks. Keep the area clean and dry. See a doctor if it spreads or does not improve.\n\n"
+        "*This is not a diagnosis. Please consult a dermatologist.*\n\n"
+    ) * 2
+    latency = 0.05
+
+    async def run() -> None:
+        sent: List[str] = []
+
+        async def deliver(text: str) -> None:
+            await asyncio.sleep(latency)
+            sent.append(text)
+
+        start = time.perf_counter()
+        per_chunk = 0
+        async for token in _fake_stream(answer, 0.005):
+            await deliver(token)
+            per_chunk += 1
+        naive_s = time.perf_counter() - start
+        print(f"[INFO] One message per chunk: {per_chunk} API calls, {naive_s:.2f}s")
+
+        sent.clear()
+        stats = await deliver_stream(_fake_stream(answer, 0.005), deliver)
+        print(
+            f"[INFO] Coalesced: {stats.messages} API calls for {stats.chunks} chunks, "
+            f"first message after {stats.first_message_s:.2f}s, done in {stats.total_s:.2f}s"
+        )
+        for n, message in enumerate(sent, 1):
+            print(f"--- message {n} ({len(message)} chars) ---\n{message}")
+
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,316 @@
+"""
+Spans, metrics and logging for the request path.
+
+* `span(stage)` times a block and records it in the `derma_stage_seconds`
+  histogram, labelled by stage; at DEBUG it also logs the span with the
+  current trace id (the webhook's MessageSid, see `start_trace`).
+* `observe_run(response)` turns an agno run response into per-call model and
+  tool timings and token counts, including those of team members.
+* `metrics_router()` serves every histogram and counter at GET /metrics in the
+  Prometheus text format.
+* `get_logger(name)` returns a logger whose records go through a bounded
+  queue to a listener thread, so the request path never blocks on stdout.
+  DEBUG records are kept at the LOG_DEBUG_SAMPLE rate, long messages are cut
+  to LOG_MAX_CHARS, and records that find the queue full are dropped and
+  counted rather than waited on.
+
+LOG_LEVEL (default INFO) and LOG_FORMAT ("text", the usual "[LEVEL] message",
+or "json") pick what is written.
+"""
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def percentile(values: Sequence[float], pct: float) -> float:
+    """The `pct`th percentile (0-100) of `values` by nearest rank, 0.0 when there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _labels(labels: List[str], le: Any) -> str:
+    return ",".join(labels + [f'le="{le}"'])
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> (per-bucket counts, sum, count)
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                labels = [f'{n}="{v}"' for n, v in zip(self.labelnames, key)]
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{{{_labels(labels, bound)}}} {cumulative}")
+                lines.append(f"{self.name}_bucket{{{_labels(labels, '+Inf')}}} {count}")
+                suffix = f"{{{','.join(labels)}}}" if labels else ""
+                lines.append(f"{self.name}_sum{suffix} {total}")
+                lines.append(f"{self.name}_count{suffix} {count}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                labels = ",".join(f'{n}="{v}"' for n, v in zip(self.labelnames, key))
+                lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labelnames, buckets))
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labelnames))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics.values() for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram("derma_stage_seconds", "Time spent in each request stage", ["stage", "status"])
+MODEL_TOKENS = REGISTRY.counter("derma_model_tokens_total", "Model tokens by model and direction", ["model", "direction"])
+MODEL_CALLS = REGISTRY.counter("derma_model_calls_total", "Model calls by model", ["model"])
+TOOL_CALLS = REGISTRY.counter("derma_tool_calls_total", "Tool calls by tool and status", ["tool", "status"])
+LOG_DROPPED = REGISTRY.counter("derma_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+# Logging
+
+_trace_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every INFO-and-above record and a `rate` share of DEBUG ones."""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.INFO and self.rate < 1.0 and random.random() >= self.rate:
+            return False
+        if not hasattr(record, "trace"):
+            record.trace = _trace_id.get()
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+class Formatter(logging.Formatter):
+    """"[LEVEL] message key=value ..." or one JSON object per line."""
+
+    def __init__(self, style: str = "text", max_chars: int = 500):
+        super().__init__()
+        self.style = style
+        self.max_chars = max_chars
+
+    def _cut(self, text: str) -> str:
+        return text if len(text) <= self.max_chars else f"{text[: self.max_chars]}... ({len(text)} chars)"
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = dict(getattr(record, "fields", None) or {})
+        if getattr(record, "trace", None):
+            fields.setdefault("trace", record.trace)
+        message = self._cut(record.getMessage())
+        if self.style == "json":
+            return json.dumps({"ts": round(record.created, 3), "level": record.levelname, "logger": record.name,
+                               "message": message, **fields}, default=str)
+        extra = " ".join(f"{k}={self._cut(str(v))}" for k, v in fields.items())
+        return f"[{record.levelname}] {message}" + (f" {extra}" if extra else "")
+
+
+_root = logging.getLogger("derma")
+_listener: Optional[logging.handlers.QueueListener] = None
+_setup_lock = threading.Lock()
+
+
+def _setup() -> None:
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(Formatter(os.getenv("LOG_FORMAT", "text"), int(os.getenv("LOG_MAX_CHARS", "500"))))
+        records: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+        handler = DroppingQueueHandler(records)
+        handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE", "1.0"))))
+        _root.addHandler(handler)
+        _root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        _root.propagate = False
+        _listener = logging.handlers.QueueListener(records, output)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    _setup()
+    return _root.getChild(name)
+
+
+log = get_logger("telemetry")
+
+
+# Spans
+
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """Tag every span and log record in the current context with `trace_id`."""
+    trace_id = trace_id or os.urandom(8).hex()
+    _trace_id.set(trace_id)
+    return trace_id
+
+
+@contextmanager
+def span(stage: str, **fields: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Time the block as `stage`. The yielded dict is logged with the span, so
+    callers can add what they learn inside it (sizes, hit/miss, ...).
+    """
+    start = time.perf_counter()
+    parent = _current_span.get()
+    token = _current_span.set(stage)
+    status = "ok"
+    try:
+        yield fields
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_span.reset(token)
+        STAGE_SECONDS.observe(elapsed, stage=stage, status=status)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("span", extra={"fields": {"span": stage, "parent": parent, "ms": round(elapsed * 1000, 1), "status": status, **fields}})
+
+
+def timed(stage: str) -> Callable[[Callable], Callable]:
+    """Decorator form of `span` for sync and async functions."""
+    def decorate(fn: Callable) -> Callable:
+        import asyncio
+        import functools
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def observe_run(response: Any) -> Dict[str, int]:
+    """
+    Record the model calls, tool calls and tokens of an agno run response.
+
+    agno keeps per-call timings and token counts in `metrics` and per-tool
+    timings in `tools`; team responses also carry their members' responses.
+    Returns the totals for logging.
+    """
+    totals = {"model_calls": 0, "tool_calls": 0, "input_tokens": 0, "output_tokens": 0}
+    if response is None or isinstance(response, str):
+        return totals
+    model = getattr(response, "model", None) or "unknown"
+    metrics = getattr(response, "metrics", None) or {}
+    for seconds in metrics.get("time", []):
+        STAGE_SECONDS.observe(seconds, stage="model.call", status="ok")
+    calls = len(metrics.get("input_tokens", []) or metrics.get("time", []))
+    input_tokens, output_tokens = sum(metrics.get("input_tokens", [])), sum(metrics.get("output_tokens", []))
+    if calls:
+        MODEL_CALLS.inc(calls, model=model)
+        MODEL_TOKENS.inc(input_tokens, model=model, direction="input")
+        MODEL_TOKENS.inc(output_tokens, model=model, direction="output")
+    totals["model_calls"] += calls
+    totals["input_tokens"] += input_tokens
+    totals["output_tokens"] += output_tokens
+    for tool in getattr(response, "tools", None) or []:
+        status = "error" if tool.tool_call_error else "ok"
+        TOOL_CALLS.inc(tool=tool.tool_name, status=status)
+        if tool.metrics is not None and tool.metrics.time is not None:
+            STAGE_SECONDS.observe(tool.metrics.time, stage=f"tool.{tool.tool_name}", status=status)
+        totals["tool_calls"] += 1
+    for member in getattr(response, "member_responses", None) or []:
+        for key, value in observe_run(member).items():
+            totals[key] += value
+    return totals
+
+
+def metrics_router() -> APIRouter:
+    router = APIRouter()
+
+    @router.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        """Stage latency histograms and model, tool and log counters (Prometheus text format)."""
+        return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+    return router
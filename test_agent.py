@@ -11,13 +11,14 @@
 #from fastapi import FastAPI, Request, Form
 from fastapi import FastAPI, Request
 from fastapi.responses import PlainTextResponse
-from dermaAssistant import derma_agent  # Import the agent from your module
+from dermaAssistant import components  # The team is built on first use
 
 app= FastAPI()
 
 @app.get("/test-agent")
-def test_agent():
+async def check_agent():
     test_input = "What causes acne?"
-    response = derma_agent.run(test_input)
+    derma_agent = await components.get("team")
+    response = await derma_agent.arun(test_input)
     return {"input": test_input, "response": response}
 
@@ -0,0 +1,62 @@
+from clinical_extractor import ClinicalIntake, extract_fields
+
+
+def test_extracts_every_field_from_one_message():
+    fields = extract_fields("I have had a red scaly rash on my left forearm for 2 weeks and it is very itchy")
+    assert fields["location"] == "left forearm"
+    assert "2 weeks" in fields["duration"]
+    assert "red" in fields["appearance"] and "scaly" in fields["appearance"]
+    assert fields["symptoms"] == "itchy"
+
+
+def test_ambiguous_sites_need_anatomical_context():
+    assert "location" not in extract_fields("It came back again")
+    assert "location" not in extract_fields("I face this every winter")
+    assert "location" not in extract_fields("It is at the bottom of the list")
+    assert extract_fields("a rash on my back")["location"] == "back"
+    assert extract_fields("itchy patch on my lower back")["location"] == "lower back"
+    assert extract_fields("pimples on my face")["location"] == "face"
+    assert extract_fields("spots on the back of my hand")["location"] == "back of my hand"
+    # A short answer to the location question needs no context
+    assert extract_fields("back", asked=["location"])["location"] == "back"
+
+
+def test_relative_durations():
+    assert extract_fields("It started last week and is spreading")["duration"] == "last week"
+    assert extract_fields("I've had it since Monday")["duration"] == "since monday"
+    assert extract_fields("it appeared the other day")["duration"] == "the other day"
+    assert extract_fields("a few days back")["duration"] == "a few days back"
+
+
+def test_negative_symptoms():
+    assert extract_fields("it doesn't itch")["symptoms"] == "none reported"
+    assert "symptoms" not in extract_fields("no")
+    assert extract_fields("no", asked=["symptoms"])["symptoms"] == "none reported"
+
+
+def test_intake_asks_for_missing_fields_then_hands_over():
+    intake = ClinicalIntake()
+    step = intake.step("I have a rash on my neck")
+    assert step.prompt is None
+    # A bare "rash" says something is there, not what it looks like
+    assert intake.asked == ["duration", "appearance", "symptoms"]
+    assert "How long have you had it?" in step.reply
+
+    step = intake.step("about 3 days, it is red and raised")
+    assert intake.asked == ["symptoms"]
+
+    step = intake.step("no")
+    assert step.reply is None
+    assert intake.complete
+    assert "- Location: neck" in step.prompt
+    assert "- Symptoms: none reported" in step.prompt
+    assert "> I have a rash on my neck" in step.prompt
+
+    # Once complete, messages go straight to the team
+    assert intake.step("what should I do?").prompt == "what should I do?"
+
+
+def test_greetings_are_answered_locally_and_questions_go_to_the_team():
+    intake = ClinicalIntake()
+    assert intake.step("Hello!").reply.startswith("Hello! I can help")
+    assert ClinicalIntake().step("What causes acne?").prompt == "What causes acne?"
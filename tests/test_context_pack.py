@@ -0,0 +1,61 @@
+from agno.document import Document
+
+from skin.context_pack import PackConfig, estimate_tokens, pack
+
+GUIDANCE = (
+    "Tinea corporis presents as an annular scaly plaque with central clearing. "
+    "Topical azoles such as clotrimazole are applied twice daily for two to four weeks. "
+    "Extensive disease may need oral terbinafine. "
+)
+
+
+def doc(content: str, name: str = "guide.pdf", page: int = 1, chunk: int = 1, score=None) -> Document:
+    return Document(content=content, name=name, meta_data={"page": page, "chunk": chunk}, reranking_score=score)
+
+
+def test_near_duplicates_are_dropped():
+    hits = [doc(GUIDANCE, page=1), doc(GUIDANCE + "See also.", name="other.pdf", page=9), doc("Psoriasis plaques are silvery.", page=4)]
+    packed, stats = pack(hits, "ringworm treatment")
+    assert [d.content for d in packed] == [GUIDANCE, "Psoriasis plaques are silvery."]
+    assert stats.duplicates == 1
+    assert stats.kept == 2
+
+
+def test_adjacent_chunks_of_a_page_are_merged():
+    hits = [doc("First part of the page.", chunk=1), doc("Second part of the page.", chunk=2), doc("Unrelated text here.", page=7)]
+    packed, stats = pack(hits, "page")
+    assert packed[0].content == "First part of the page. Second part of the page."
+    assert packed[0].meta_data["chunk"] == [1, 2]
+    assert stats.merged == 1
+
+
+def test_budget_trims_to_matching_sentences():
+    long_text = " ".join(f"Filler sentence number {i} about nothing." for i in range(200)) + " Clotrimazole treats ringworm."
+    config = PackConfig(budget_tokens=300, max_chunk_tokens=300)
+    packed, stats = pack([doc(long_text)], "clotrimazole ringworm", config)
+    assert stats.trimmed == 1
+    assert estimate_tokens(packed[0]) <= 300
+    assert "Clotrimazole treats ringworm." in packed[0].content
+    assert stats.tokens_saved > 0
+
+
+def test_reranker_score_orders_entries():
+    hits = [doc("Low relevance text.", page=1, score=0.1), doc("High relevance text.", page=5, score=0.9)]
+    packed, _ = pack(hits, "text")
+    assert packed[0].content == "High relevance text."
+
+
+def test_packing_never_sends_more_than_requested():
+    hits = [doc(f"Distinct passage {word} about skin.", page=i * 2) for i, word in enumerate(["alpha", "beta", "gamma", "delta"])]
+    packed, stats = pack(hits, "skin", max_documents=2)
+    assert len(packed) == 2
+    assert stats.dropped == 2
+    # Savings are measured against the hits the prompt held without packing
+    assert stats.tokens_in == sum(estimate_tokens(d) for d in hits[:2])
+
+
+def test_disabled_packing_passes_hits_through():
+    hits = [doc(GUIDANCE), doc(GUIDANCE, page=3)]
+    packed, stats = pack(hits, "x", PackConfig(budget_tokens=0))
+    assert packed == hits
+    assert stats.tokens_saved == 0
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyStore
+
+
+def test_first_delivery_runs_and_retries_replay():
+    store = IdempotencyStore()
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return "<Response>one</Response>"
+
+    async def scenario():
+        first = await store.run("SM1", handler)
+        second = await store.run("SM1", handler)
+        return first, second
+
+    assert asyncio.run(scenario()) == ("<Response>one</Response>", "<Response>one</Response>")
+    assert len(calls) == 1
+    assert store.counts == {"runs": 1, "attached": 0, "replayed": 1}
+
+
+def test_retry_during_a_run_attaches_to_it():
+    store = IdempotencyStore()
+    calls = []
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler():
+            calls.append(1)
+            await release.wait()
+            return "done"
+
+        first = asyncio.create_task(store.run("SM1", handler))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(store.run("SM1", handler))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == ["done", "done"]
+    assert len(calls) == 1
+    assert store.counts["attached"] == 1
+
+
+def test_failed_runs_are_not_stored():
+    store = IdempotencyStore()
+    attempts = []
+
+    async def handler():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("model down")
+        return "ok"
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await store.run("SM1", handler)
+        return await store.run("SM1", handler)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert len(attempts) == 2
+
+
+def test_missing_key_always_runs():
+    store = IdempotencyStore()
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return "ok"
+
+    async def scenario():
+        await store.run(None, handler)
+        await store.run(None, handler)
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
+
+
+def test_lru_is_bounded():
+    store = IdempotencyStore(max_entries=2)
+
+    async def scenario():
+        for key in ("a", "b", "c"):
+            await store.run(key, lambda key=key: asyncio.sleep(0, result=key))
+
+    asyncio.run(scenario())
+    assert list(store._entries) == ["b", "c"]
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    db_path = str(tmp_path / "idempotency.sqlite")
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        return "stored"
+
+    asyncio.run(IdempotencyStore(db_path=db_path).run("SM1", handler))
+    # Another worker (or a restart) replays from SQLite
+    other = IdempotencyStore(db_path=db_path)
+    assert asyncio.run(other.run("SM1", handler)) == "stored"
+    assert len(calls) == 1
+    assert other.counts["replayed"] == 1
@@ -0,0 +1,28 @@
+from image_prep import ImageDedup
+
+
+def test_dedup_store_is_shared_between_workers(tmp_path):
+    db_path = str(tmp_path / "dedup.sqlite")
+    first_worker, second_worker = ImageDedup(db_path=db_path), ImageDedup(db_path=db_path)
+    image_hash = 0xF0F0_F0F0_F0F0_F0F0
+
+    seen = first_worker.remember("whatsapp:+1", image_hash, "https://media/one.jpg")
+    seen.caption, seen.reply = "my arm", "Looks like eczema."
+    first_worker.update(seen)
+
+    # A resend with two bits flipped, received by another worker
+    match = second_worker.lookup("whatsapp:+1", image_hash ^ 0b101)
+    assert (match.url, match.caption, match.reply) == ("https://media/one.jpg", "my arm", "Looks like eczema.")
+    assert second_worker.lookup("whatsapp:+2", image_hash) is None
+    assert second_worker.lookup("whatsapp:+1", ~image_hash & (1 << 64) - 1) is None
+
+
+def test_dedup_keeps_the_newest_images_per_sender(tmp_path):
+    dedup = ImageDedup(per_sender=2, db_path=str(tmp_path / "dedup.sqlite"))
+    # At least 16 bits apart from each other
+    hashes = [0, 0xFFFF, 0xFFFF_0000]
+    for n, image_hash in enumerate(hashes):
+        dedup.remember("whatsapp:+1", image_hash, f"https://media/{n}.jpg")
+    assert dedup.lookup("whatsapp:+1", hashes[0]) is None
+    assert dedup.lookup("whatsapp:+1", hashes[2]).url == "https://media/2.jpg"
+    assert dedup.stats()["images"] == 2
@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from startup import HEAVY_MODULES, measure_import
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET = float(os.getenv("IMPORT_BUDGET", "1.0"))
+
+
+@pytest.mark.parametrize("module", ["dermaAssistant", "twilio_response"])
+def test_app_import_stays_within_budget_and_lazy(module, monkeypatch):
+    # measure_import puts the working directory on the child's path
+    monkeypatch.chdir(REPO_DIR)
+    # The fastest of three runs, as `python -m startup` counts it
+    runs = [measure_import(module) for _ in range(3)]
+    seconds, heavy, _ = min(runs, key=lambda run: run[0])
+    assert heavy == [], f"import {module} loads modules that must stay lazy: {heavy}"
+    assert seconds <= BUDGET, f"import {module} took {seconds:.3f}s (budget {BUDGET:.3f}s)"
+
+
+def test_heavy_modules_cover_the_component_dependencies():
+    for name in ("agno.agent", "agno.team", "lancedb", "fastembed", "twilio.rest"):
+        assert name in HEAVY_MODULES
@@ -0,0 +1,213 @@
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+from agno.document import Document
+from agno.embedder.base import Embedder
+
+import skin.skin_kb as skin_kb
+from skin.lance import read_pointer, table_lock
+from skin.maintenance import run_maintenance
+from skin.manifest import IngestManifest
+from skin.reader import ParsedRange
+from skin.vector_index import VectorIndexConfig
+from telemetry import REGISTRY
+
+
+@dataclass
+class FakeEmbedder(Embedder):
+    id: str = "fake"
+    dimensions: int = 4
+
+    def get_embedding(self, text: str) -> List[float]:
+        digest = hashlib.sha256(text.encode()).digest()
+        return [b / 255 for b in digest[:self.dimensions]]
+
+    def get_embedding_and_usage(self, text: str) -> Tuple[List[float], Optional[Dict]]:
+        return self.get_embedding(text), None
+
+
+def chunks(name: str, *texts: str) -> List[Document]:
+    return [Document(content=text, name=name, meta_data={"page": 1, "chunk": n}) for n, text in enumerate(texts, 1)]
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    monkeypatch.setattr(skin_kb, "embedder_from_env", FakeEmbedder)
+    resources = tmp_path / "resources"
+    resources.mkdir()
+    for name in ("a.pdf", "b.pdf"):
+        (resources / name).write_bytes(name.encode())
+    return skin_kb.DermaKnowledgeBase("derma", str(tmp_path / "db"), [str(resources)], [])
+
+
+def table_ids(kb) -> set:
+    return set(kb.vector_db.table.to_lance().to_table(columns=["id"]).column("id").to_pylist())
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """Parse every PDF into one chunk holding its bytes; records the paths parsed."""
+    seen: List[str] = []
+
+    def parsed_ranges(paths, *args, **kwargs):
+        for path in paths:
+            seen.append(path)
+            with open(path) as f:
+                yield ParsedRange(path, 0, 16, last=True, chunks=chunks(path[-5], f"Contents: {f.read()}"))
+
+    monkeypatch.setattr(skin_kb, "iter_parsed_ranges", parsed_ranges)
+    return seen
+
+
+def test_unchanged_pdfs_are_skipped_by_the_manifest(kb, parsed):
+    kb.sync(workers=1)
+    assert sorted(parsed) == kb.pdf_files()
+    parsed.clear()
+
+    stats = kb.sync(workers=1)
+    assert (stats["unchanged"], stats["ingested"]) == (2, 0)
+    # A touched file is hashed, found unchanged and not parsed again
+    a, _ = kb.pdf_files()
+    os.utime(a, (1, 1))
+    stats = kb.sync(workers=1)
+    assert (stats["unchanged"], stats["ingested"]) == (2, 0)
+    assert parsed == []
+    assert kb.manifest.get(a).mtime == 1
+
+
+def test_a_changed_pdf_is_ingested_again(kb, parsed):
+    kb.sync(workers=1)
+    a, b = kb.pdf_files()
+    old_ids = set(kb.manifest.get(a).chunk_ids)
+    old_sha256 = kb.manifest.get(a).sha256
+    parsed.clear()
+
+    with open(a, "ab") as f:
+        f.write(b" edited")
+    stats = kb.sync(workers=1)
+
+    assert (stats["ingested"], stats["unchanged"]) == (1, 1)
+    assert parsed == [a]
+    assert kb.manifest.get(a).sha256 != old_sha256
+    assert table_ids(kb) == set(kb.manifest.get(a).chunk_ids) | set(kb.manifest.get(b).chunk_ids)
+    assert not old_ids & table_ids(kb)
+
+
+def test_a_deleted_pdf_loses_its_rows(kb, parsed):
+    kb.sync(workers=1)
+    a, b = kb.pdf_files()
+
+    os.remove(b)
+    stats = kb.sync(workers=1)
+
+    assert stats["removed"] == 1
+    assert kb.manifest.paths() == [a]
+    assert table_ids(kb) == set(kb.manifest.get(a).chunk_ids)
+
+
+@pytest.mark.parametrize("write_batch_rows", [4096, 1])
+def test_rows_of_a_partly_failed_file_are_removed(kb, monkeypatch, write_batch_rows):
+    a, b = kb.pdf_files()
+
+    def parsed_ranges(paths, *args, **kwargs):
+        yield ParsedRange(a, 0, 16, last=False, chunks=chunks("a", "First range of a."))
+        yield ParsedRange(a, 16, 32, last=True, error="broken page")
+        yield ParsedRange(b, 0, 16, last=True, chunks=chunks("b", "All of b."))
+
+    monkeypatch.setattr(skin_kb, "iter_parsed_ranges", parsed_ranges)
+    stats = kb.sync(workers=1, write_batch_rows=write_batch_rows)
+
+    assert stats["failed"] == 1 and stats["ingested"] == 1
+    assert list(kb.manifest.paths()) == [b]
+    # Only rows some manifest entry owns are left, so removing files later cleans up everything
+    assert table_ids(kb) == set(kb.manifest.get(b).chunk_ids)
+
+
+def test_refresh_swaps_in_a_new_handle_and_leaves_the_old_one_pinned(kb, monkeypatch):
+    a, b = kb.pdf_files()
+    texts = {a: "Version one of a.", b: "Version one of b."}
+
+    def parsed_ranges(paths, *args, **kwargs):
+        for path in paths:
+            yield ParsedRange(path, 0, 16, last=True, chunks=chunks(path[-5], texts[path]))
+
+    monkeypatch.setattr(skin_kb, "iter_parsed_ranges", parsed_ranges)
+    kb.sync(workers=1)
+    reader = skin_kb.DermaKnowledgeBase("derma", kb.db_path, kb.pdf_paths, []).open()
+    old_handle, old_version = reader.vector_db, reader.vector_db.pinned_version
+
+    with open(a, "ab") as f:
+        f.write(b"changed")
+    texts[a] = "Version two of a."
+    kb.sync(workers=1)
+
+    assert reader.refresh(min_interval=0)
+    assert reader.vector_db is not old_handle
+    assert reader.vector_db.pinned_version > old_version
+    # Searches still running on the old handle stay on their version
+    assert old_handle.pinned_version == old_version
+    assert old_handle.table.version == old_version
+    assert not reader.refresh(min_interval=0)
+
+
+def test_maintenance_copies_the_manifest_published_with_the_rows(kb, monkeypatch):
+    a, b = kb.pdf_files()
+    c = os.path.join(os.path.dirname(a), "c.pdf")
+
+    def parsed_ranges(paths, *args, **kwargs):
+        for path in paths:
+            yield ParsedRange(path, 0, 16, last=True, chunks=chunks(path[-5], f"All of {path[-5]}."))
+            if path == c:
+                raise KeyboardInterrupt
+
+    monkeypatch.setattr(skin_kb, "iter_parsed_ranges", parsed_ranges)
+    kb.sync(workers=1)
+    # An ingest that stops after writing c: the working manifest lists c, the pointer does not
+    with open(c, "wb") as f:
+        f.write(b"c.pdf")
+    with pytest.raises(KeyboardInterrupt):
+        kb.sync(workers=1, write_batch_rows=1)
+    assert c in IngestManifest.for_table(kb.db_path, kb.physical_table).paths()
+
+    report = run_maintenance(kb.db_path, "derma", index_config=VectorIndexConfig())
+    build = report["published"]
+    assert build != kb.physical_table
+    assert read_pointer(kb.db_path, "derma")["table"] == build
+    assert sorted(IngestManifest.for_table(kb.db_path, build).paths()) == [a, b]
+
+    # So the next ingest still picks c up
+    monkeypatch.setattr(skin_kb, "iter_parsed_ranges", lambda paths, *args, **kwargs: (
+        ParsedRange(path, 0, 16, last=True, chunks=chunks(path[-5], f"All of {path[-5]}.")) for path in paths
+    ))
+    stats = skin_kb.DermaKnowledgeBase("derma", kb.db_path, kb.pdf_paths, []).sync(workers=1)
+    assert (stats["ingested"], stats["unchanged"]) == (1, 2)
+
+
+def test_maintenance_skips_while_an_ingest_holds_the_table(kb):
+    kb.sync(workers=1)
+    with table_lock(kb.db_path, "derma") as acquired:
+        assert acquired
+        assert run_maintenance(kb.db_path, "derma", index_config=VectorIndexConfig()) is None
+
+
+def test_search_falls_back_to_no_context_only_for_io_errors(kb, parsed, monkeypatch):
+    kb.sync(workers=1)
+    reader = skin_kb.DermaKnowledgeBase("derma", kb.db_path, kb.pdf_paths, []).open()
+
+    def fail(error):
+        def search(*args, **kwargs):
+            raise error
+        monkeypatch.setattr(reader.vector_db, "search", search)
+
+    fail(FileNotFoundError("data file of a dropped build"))
+    assert reader.search("rash") == []
+    assert 'derma_kb_search_errors_total{error="FileNotFoundError"} 1' in REGISTRY.render()
+
+    # A bug is not an empty result
+    fail(TypeError("unexpected keyword"))
+    with pytest.raises(TypeError):
+        reader.search("eczema")
+    assert 'derma_kb_search_errors_total{error="TypeError"} 1' in REGISTRY.render()
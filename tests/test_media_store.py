@@ -0,0 +1,80 @@
+import asyncio
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from media_store import LocalMediaStore, MediaStore, media_router
+from telemetry import REGISTRY
+
+
+def store(tmp_path, **kwargs) -> LocalMediaStore:
+    return LocalMediaStore(str(tmp_path / "media"), "https://derma.example", b"secret", **kwargs)
+
+
+def signature(url: str):
+    parts = urlsplit(url)
+    query = parse_qs(parts.query)
+    return parts.path.rsplit("/", 1)[-1], int(query["exp"][0]), query["sig"][0]
+
+
+def test_signed_urls_verify_until_they_expire(tmp_path):
+    media = store(tmp_path, url_ttl=60)
+    key = "a" * 64
+    url = media.sign(key)
+    assert url.startswith(f"https://derma.example/media/{key}?")
+
+    assert media.verify(*signature(url))
+    key, expires, sig = signature(url)
+    assert not media.verify("b" * 64, expires, sig)
+    assert not media.verify(key, expires + 1, sig)
+    # Every worker needs the same secret
+    assert not LocalMediaStore(str(tmp_path / "media"), "https://derma.example", b"other").verify(key, expires, sig)
+    assert not media.verify(*signature(media.sign(key, expires=int(time.time()) - 1)))
+
+
+def test_identical_images_are_stored_once(tmp_path):
+    media = store(tmp_path)
+    first = asyncio.run(media.put(b"image bytes", "image/jpeg"))
+    second = asyncio.run(media.put(b"image bytes", "image/jpeg"))
+
+    assert signature(first)[0] == signature(second)[0]
+    assert media.stats()["files"] == 1
+    assert (media.counts["stored"], media.counts["deduplicated"]) == (1, 1)
+    assert 'derma_media_images_total{backend="local",outcome="deduplicated"}' in REGISTRY.render()
+    # Another worker sharing the directory finds it too
+    assert store(tmp_path).path_for(signature(first)[0]) is not None
+
+
+def test_the_least_recently_used_files_are_evicted_past_the_cap(tmp_path):
+    media = store(tmp_path, max_bytes=250)
+    a = asyncio.run(media.put(b"a" * 100, "image/png"))
+    b = asyncio.run(media.put(b"b" * 100, "image/png"))
+    os.utime(media.path_for(signature(a)[0]), (1, 1))
+    os.utime(media.path_for(signature(b)[0]), (2, 2))
+    # Reusing a marks it recently used, so b is now the oldest
+    assert asyncio.run(media.reuse(a))
+
+    asyncio.run(media.put(b"c" * 100, "image/png"))
+
+    assert media.path_for(signature(a)[0]) is not None
+    assert media.path_for(signature(b)[0]) is None
+    assert asyncio.run(media.reuse(b)) is None
+    assert media.stats()["bytes"] == 200 and media.counts["evicted"] == 1
+
+
+def test_router_serves_signed_urls_only(tmp_path):
+    media = store(tmp_path)
+    app = FastAPI()
+    app.include_router(media_router(MediaStore(media)))
+    client = TestClient(app)
+    url = asyncio.run(media.put(b"image bytes", "image/jpeg"))
+    key, expires, sig = signature(url)
+
+    response = client.get(f"/media/{key}", params={"exp": expires, "sig": sig})
+    assert response.status_code == 200 and response.content == b"image bytes"
+    assert client.get(f"/media/{key}", params={"exp": expires, "sig": "0" * 64}).status_code == 404
+    # Store statistics are on /metrics, not on the public media routes
+    assert client.get("/media/stats").status_code != 200
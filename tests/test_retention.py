@@ -0,0 +1,113 @@
+import json
+import sqlite3
+import time
+
+import pytest
+
+from retention import ARCHIVE_TABLE, DAY, RetentionEngine, RetentionPolicy, run_retention, unpack
+from sqlite_store import WalSqliteMemoryDb, WalSqliteStorage
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    db_file = str(tmp_path / "agent.sqlite")
+    # agno's own schemas, so discovery sees the tables the app writes
+    WalSqliteStorage(table_name="derma_agent", db_file=db_file).create()
+    WalSqliteMemoryDb(table_name="derma_user_memory", db_file=db_file).create()
+    return db_file
+
+
+def add_session(db_file: str, session_id: str, user_id: str, memory: dict, age: float) -> None:
+    updated = int(time.time() - age)
+    with sqlite3.connect(db_file) as conn:
+        conn.execute(
+            "INSERT INTO derma_agent (session_id, user_id, memory, session_data, created_at, updated_at) VALUES (?, ?, ?, '{}', ?, ?)",
+            (session_id, user_id, json.dumps(memory), updated, updated),
+        )
+
+
+def add_memory(db_file: str, memory_id: str, user_id: str, age: float) -> None:
+    updated = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - age))
+    with sqlite3.connect(db_file) as conn:
+        conn.execute(
+            "INSERT INTO derma_user_memory (id, user_id, memory, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (memory_id, user_id, json.dumps({"memory": f"fact {memory_id}"}), updated, updated),
+        )
+
+
+def rows(db_file: str, sql: str) -> list:
+    with sqlite3.connect(db_file) as conn:
+        return conn.execute(sql).fetchall()
+
+
+def archived(db_file: str, kind: str) -> dict:
+    return {key: unpack(payload) for key, payload in rows(db_file, f"SELECT key, payload FROM {ARCHIVE_TABLE} WHERE kind = '{kind}'")}
+
+
+POLICY = RetentionPolicy(session_ttl=30 * DAY, max_runs=2, memory_ttl=30 * DAY, min_idle=600, pause=0)
+
+
+def test_expired_sessions_are_archived_and_restorable(db_file):
+    memory = {"runs": [{"content": "old answer"}], "memories": {"whatsapp:+1": [{"memory": "eczema"}]}}
+    add_session(db_file, "whatsapp:+1#1", "whatsapp:+1", memory, age=40 * DAY)
+
+    stats = RetentionEngine(db_file, POLICY).run_once()
+
+    assert stats["sessions_archived"] == 1
+    assert rows(db_file, "SELECT session_id FROM derma_agent") == []
+    # The compressed archive holds the row exactly as it was
+    assert archived(db_file, "session")["whatsapp:+1#1"] == {
+        "session_id": "whatsapp:+1#1", "user_id": "whatsapp:+1", "memory": memory,
+    }
+
+
+def test_idle_sessions_keep_their_newest_runs_and_own_memories(db_file):
+    runs = [{"content": f"answer {n}"} for n in range(5)]
+    memory = {
+        "runs": runs,
+        "memories": {"whatsapp:+1": ["mine"], "whatsapp:+2": ["someone else's"]},
+        "team_context": {"whatsapp:+1#1": "this one", "whatsapp:+1#0": "an older one"},
+    }
+    add_session(db_file, "whatsapp:+1#1", "whatsapp:+1", memory, age=DAY)
+
+    stats = RetentionEngine(db_file, POLICY).run_once()
+
+    assert (stats["sessions_compacted"], stats["runs_archived"]) == (1, 3)
+    compacted = json.loads(rows(db_file, "SELECT memory FROM derma_agent")[0][0])
+    assert compacted["runs"] == runs[-2:]
+    assert compacted["memories"] == {"whatsapp:+1": ["mine"]}
+    assert compacted["team_context"] == {"whatsapp:+1#1": "this one"}
+    assert archived(db_file, "runs")["whatsapp:+1#1"] == runs[:3]
+
+
+def test_current_sessions_are_left_alone(db_file):
+    memory = {"runs": [{"content": f"answer {n}"} for n in range(5)]}
+    add_session(db_file, "whatsapp:+1#1", "whatsapp:+1", memory, age=60)
+
+    stats = RetentionEngine(db_file, POLICY).run_once()
+
+    assert stats["sessions_compacted"] == stats["sessions_archived"] == 0
+    assert json.loads(rows(db_file, "SELECT memory FROM derma_agent")[0][0]) == memory
+    assert rows(db_file, f"SELECT COUNT(*) FROM {ARCHIVE_TABLE}") == [(0,)]
+
+
+def test_stale_user_memories_are_archived(db_file):
+    add_memory(db_file, "old", "whatsapp:+1", age=40 * DAY)
+    add_memory(db_file, "new", "whatsapp:+1", age=DAY)
+
+    stats = RetentionEngine(db_file, POLICY).run_once()
+
+    assert stats["memories_archived"] == 1
+    assert rows(db_file, "SELECT id FROM derma_user_memory") == [("new",)]
+    assert json.loads(archived(db_file, "memory")["old"]["memory"]) == {"memory": "fact old"}
+
+
+def test_zero_ttls_keep_everything(db_file):
+    add_session(db_file, "whatsapp:+1#1", "whatsapp:+1", {"runs": []}, age=400 * DAY)
+    add_memory(db_file, "old", "whatsapp:+1", age=400 * DAY)
+
+    policy = RetentionPolicy(session_ttl=0, memory_ttl=0, min_idle=600, pause=0)
+    run_retention([db_file], policy)
+
+    assert rows(db_file, "SELECT session_id FROM derma_agent") == [("whatsapp:+1#1",)]
+    assert rows(db_file, "SELECT id FROM derma_user_memory") == [("old",)]
@@ -0,0 +1,90 @@
+import asyncio
+
+from clinical_extractor import ClinicalIntake
+from sessions import SessionRegistry
+
+
+def test_sender_keeps_one_session_per_conversation():
+    registry = SessionRegistry()
+    first = registry.session_for("whatsapp:+1", "I have a rash")
+    second = registry.session_for("whatsapp:+1", "on my arm")
+    assert first is second
+    assert second.turns == 2
+    assert second.session_id == f"whatsapp:+1#{first.epoch}"
+
+
+def test_senders_get_separate_sessions():
+    registry = SessionRegistry()
+    assert registry.session_for("whatsapp:+1").session_id != registry.session_for("whatsapp:+2").session_id
+
+
+def test_reset_command_starts_a_new_epoch():
+    expired = []
+    registry = SessionRegistry(on_expire=expired.append)
+    old = registry.session_for("whatsapp:+1", "hello")
+    new = registry.session_for("whatsapp:+1", "  Start over ")
+    assert new.epoch > old.epoch
+    assert new.turns == 1
+    assert expired == [old.session_id]
+    # A turn still running in the old epoch finishes before the new one starts
+    assert new.lock is old.lock
+
+
+def test_max_turns_and_idle_timeout_end_a_session():
+    registry = SessionRegistry(max_turns=2)
+    first = registry.session_for("whatsapp:+1")
+    registry.session_for("whatsapp:+1")
+    assert registry.session_for("whatsapp:+1").epoch > first.epoch
+
+    registry = SessionRegistry(idle_timeout=60)
+    first = registry.session_for("whatsapp:+1")
+    first.last_seen -= 120
+    assert registry.session_for("whatsapp:+1").epoch > first.epoch
+
+
+def test_least_recently_seen_idle_senders_are_evicted():
+    expired = []
+    registry = SessionRegistry(max_senders=2, on_expire=expired.append)
+    a = registry.session_for("a")
+    registry.session_for("b")
+    registry.session_for("a")
+    registry.session_for("c")
+    assert set(registry.sessions) == {"a", "c"}
+    assert len(expired) == 1 and expired[0].startswith("b#")
+    assert registry.sessions["a"] is a
+
+
+def test_busy_senders_are_not_evicted():
+    registry = SessionRegistry(max_senders=2)
+
+    async def scenario():
+        busy = registry.session_for("a")
+        async with busy.lock:
+            registry.session_for("b")
+            registry.session_for("c")
+            # "a" is the least recently seen, but a turn is running on it
+            assert set(registry.sessions) == {"a", "c"}
+            assert registry.stats() == {"senders": 2, "active": 1}
+
+    asyncio.run(scenario())
+
+
+def test_workers_sharing_a_store_continue_one_conversation(tmp_path):
+    db_path = str(tmp_path / "sessions.sqlite")
+    first_worker, second_worker = SessionRegistry(db_path=db_path), SessionRegistry(db_path=db_path)
+
+    first = first_worker.session_for("whatsapp:+1", "I have a rash")
+    intake = first_worker.intake(first, ClinicalIntake.from_dict)
+    intake.step("I have a rash on my neck")
+    first_worker.save_intake(first)
+
+    second = second_worker.session_for("whatsapp:+1", "about 3 days")
+    assert (second.session_id, second.turns) == (first.session_id, 2)
+    restored = second_worker.intake(second, ClinicalIntake.from_dict)
+    assert restored.location == "neck" and restored.asked == intake.asked
+
+    # A reset on either worker starts the next epoch for both
+    assert first_worker.session_for("whatsapp:+1", "start over").epoch > first.epoch
+    third = second_worker.session_for("whatsapp:+1", "hello")
+    assert (third.epoch, third.turns) == (first_worker.sessions["whatsapp:+1"].epoch, 2)
+    assert second_worker.intake(third, ClinicalIntake.from_dict) == ClinicalIntake()
@@ -0,0 +1,54 @@
+import threading
+
+from agno.storage.session.agent import AgentSession
+
+from sqlite_store import WalSqliteStorage
+
+
+def session(turn: int) -> AgentSession:
+    return AgentSession(
+        session_id="whatsapp:+1#1", user_id="whatsapp:+1", agent_id="derma",
+        memory={"runs": [{"content": f"turn {n}"} for n in range(turn)]}, session_data={"turn": turn},
+    )
+
+
+def test_pending_writes_are_flushed_and_read_back(tmp_path):
+    db_file = str(tmp_path / "agent.sqlite")
+    storage = WalSqliteStorage(table_name="derma_agent", db_file=db_file)
+    for n in range(5):
+        storage.upsert(AgentSession(session_id=f"whatsapp:+{n}#1", user_id=f"whatsapp:+{n}", memory={"n": n}))
+
+    # Closing the writer commits everything queued
+    storage.writer.close()
+    assert storage._pending == {}
+
+    # A new store has nothing pending, so these reads come from the file
+    reopened = WalSqliteStorage(table_name="derma_agent", db_file=db_file)
+    for n in range(5):
+        assert reopened.read(f"whatsapp:+{n}#1").memory == {"n": n}
+    reopened.writer.close()
+
+
+def test_upsert_coalesces_with_a_pending_write_of_the_same_session(tmp_path, monkeypatch):
+    db_file = str(tmp_path / "agent.sqlite")
+    storage = WalSqliteStorage(table_name="derma_agent", db_file=db_file)
+    writer = storage.writer
+    # Hold the writer thread before it commits, so both upserts stay pending
+    release = threading.Event()
+    commit = writer._commit
+    monkeypatch.setattr(writer, "_commit", lambda batch: (release.wait(), commit(batch)))
+
+    storage.upsert(session(1))
+    storage.upsert(session(2))
+
+    assert list(storage._pending) == ["whatsapp:+1#1"]
+    assert storage.read("whatsapp:+1#1").session_data == {"turn": 2}
+
+    release.set()
+    writer.close()
+    # The first write committing must not drop the newer one from the pending set early
+    assert storage._pending == {}
+    stored = WalSqliteStorage(table_name="derma_agent", db_file=db_file)
+    assert stored.read("whatsapp:+1#1").session_data == {"turn": 2}
+    assert len(stored.get_all_sessions()) == 1
+    stored.writer.close()
@@ -0,0 +1,112 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from streaming import SendPool, StreamCoalescer, cut_point, deliver_stream
+
+
+async def _stream(tokens, delay: float = 0.0):
+    for token in tokens:
+        await asyncio.sleep(delay)
+        yield token
+
+
+def test_cut_point_prefers_the_strongest_boundary():
+    text = "One sentence. Another one.\n\nNext section starts here"
+    assert text[:cut_point(text, 5, 100)].endswith("\n\n")
+    assert cut_point("no boundary at all", 5, 100) == 0
+    # Only a space is left, and only when asked for the weakest kind
+    assert cut_point("no boundary at all", 5, 100, weakest=3) == len("no boundary at ")
+
+
+def test_stream_is_coalesced_into_few_ordered_messages():
+    sent: List[str] = []
+
+    async def deliver(text: str) -> None:
+        sent.append(text)
+
+    text = "".join(f"Sentence number {i} of the answer. " for i in range(60))
+    tokens = text.split(" ")
+    stats = asyncio.run(deliver_stream(_stream([t + " " for t in tokens]), deliver, pool=SendPool(2)))
+    assert stats.chunks == len(tokens)
+    assert 1 < stats.messages < 10
+    assert " ".join(sent).split() == text.split()
+    # The first segment is short, so the patient sees something early
+    assert len(sent[0]) < 400
+    assert all(len(message) <= 1600 for message in sent)
+
+
+def test_latency_timer_flushes_a_quiet_stream():
+    sent: List[str] = []
+
+    async def deliver(text: str) -> None:
+        sent.append(text)
+
+    async def scenario():
+        async def slow():
+            yield "A short first sentence. "
+            await asyncio.sleep(0.3)
+            yield "And the rest."
+
+        return await deliver_stream(slow(), deliver, max_latency=0.05, pool=SendPool(2))
+
+    stats = asyncio.run(scenario())
+    assert sent == ["A short first sentence.", "And the rest."]
+    assert stats.messages == 2
+
+
+def test_segments_queued_behind_a_slow_send_are_merged():
+    sent: List[str] = []
+
+    async def scenario():
+        async def deliver(text: str) -> None:
+            await asyncio.sleep(0.05)
+            sent.append(text)
+
+        coalescer = StreamCoalescer(deliver, target_chars=10, first_target_chars=10, pool=SendPool(1))
+        for n in range(5):
+            coalescer.feed(f"Segment {n} is here. ")
+        return await coalescer.close()
+
+    stats = asyncio.run(scenario())
+    assert stats.segments == 5
+    assert stats.messages == len(sent) < 5
+    assert "\n\n".join(sent).split() == " ".join(f"Segment {n} is here." for n in range(5)).split()
+
+
+def test_stream_errors_are_raised_after_delivering_what_arrived():
+    sent: List[str] = []
+
+    async def deliver(text: str) -> None:
+        sent.append(text)
+
+    async def broken():
+        yield "Partial answer. "
+        raise ValueError("stream broke")
+
+    with pytest.raises(ValueError):
+        asyncio.run(deliver_stream(broken(), deliver, pool=SendPool(2)))
+    assert sent == ["Partial answer."]
+
+
+def test_failed_delivery_stops_reading_the_stream():
+    closed = []
+
+    async def endless():
+        try:
+            while True:
+                await asyncio.sleep(0.001)
+                yield "More text to send. "
+        finally:
+            closed.append(True)
+
+    async def deliver(text: str) -> None:
+        raise RuntimeError("Twilio down")
+
+    async def scenario():
+        await asyncio.wait_for(deliver_stream(endless(), deliver, first_target_chars=10, pool=SendPool(2)), 5)
+
+    with pytest.raises(RuntimeError, match="Twilio down"):
+        asyncio.run(scenario())
+    assert closed == [True]
@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tool_cache import ProviderError, ProviderGuard, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def fallback(reason: str) -> str:
+    return f"fallback: {reason}"
+
+
+def test_results_are_cached_until_their_ttl():
+    clock = Clock()
+    guard = ProviderGuard("test", ttl=60, stale_ttl=0, clock=clock)
+    calls = []
+
+    def fetch():
+        calls.append(clock.now)
+        return f"result {len(calls)}"
+
+    assert guard.call("tinea", fetch, fallback) == "result 1"
+    clock.now += 59
+    assert guard.call("tinea", fetch, fallback) == "result 1"
+    clock.now += 2
+    assert guard.call("tinea", fetch, fallback) == "result 2"
+    assert guard.stats()["hits"] == 1 and guard.stats()["misses"] == 2
+
+
+def test_concurrent_lookups_share_one_provider_call():
+    guard = ProviderGuard("test", rate=100, burst=100)
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = [pool.submit(guard.call, "acne", fetch, fallback) for _ in range(8)]
+        deadline = time.monotonic() + 5
+        while guard.stats()["coalesced"] < 7 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        assert [f.result() for f in results] == ["result"] * 8
+    assert len(calls) == 1
+    assert guard.stats()["coalesced"] == 7
+
+
+def test_token_bucket_throttles_misses():
+    clock = Clock()
+    guard = ProviderGuard("test", rate=1, burst=2, max_wait=0, clock=clock)
+
+    assert guard.call("a", lambda: "a", fallback) == "a"
+    assert guard.call("b", lambda: "b", fallback) == "b"
+    assert guard.call("c", lambda: "c", fallback) == "fallback: test rate limit reached"
+    # Cache hits take no token
+    assert guard.call("a", lambda: "a again", fallback) == "a"
+    clock.now += 1
+    assert guard.call("c", lambda: "c", fallback) == "c"
+    assert guard.stats()["throttled"] == 1
+
+
+def test_token_bucket_refills_up_to_its_burst():
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    assert [bucket.acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 100
+    assert [bucket.acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_stale_results_are_served_while_the_provider_fails():
+    clock = Clock()
+    guard = ProviderGuard("test", ttl=60, stale_ttl=600, clock=clock)
+    down = False
+
+    def fetch():
+        if down:
+            raise ProviderError("connection refused")
+        return "result"
+
+    assert guard.call("eczema", fetch, fallback) == "result"
+    down = True
+    clock.now += 120
+    assert guard.call("eczema", fetch, fallback) == "result"
+    assert guard.stats()["stale"] == 1 and guard.stats()["errors"] == 1
+    # Past the stale window, and for queries never cached, there is only the fallback
+    clock.now += 600
+    assert guard.call("eczema", fetch, fallback) == "fallback: test unavailable: connection refused"
+    assert guard.call("psoriasis", fetch, fallback) == "fallback: test unavailable: connection refused"
@@ -0,0 +1,19 @@
+import pytest
+
+from skin.vector_index import VectorIndexConfig
+
+
+def test_index_type_from_env(monkeypatch):
+    monkeypatch.setenv("KB_ANN_INDEX_TYPE", "ivf_hnsw_sq")
+    monkeypatch.setenv("KB_ANN_NPROBES", "12")
+    config = VectorIndexConfig.from_env()
+    assert (config.index_type, config.nprobes) == ("IVF_HNSW_SQ", 12)
+
+    monkeypatch.delenv("KB_ANN_INDEX_TYPE")
+    assert VectorIndexConfig.from_env().index_type == "IVF_PQ"
+
+
+def test_unknown_index_type_is_rejected(monkeypatch):
+    monkeypatch.setenv("KB_ANN_INDEX_TYPE", "hnsw")
+    with pytest.raises(ValueError, match="KB_ANN_INDEX_TYPE"):
+        VectorIndexConfig.from_env()
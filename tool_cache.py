@@ -0,0 +1,315 @@
+"""
+Cached, rate-limited PubMed and DuckDuckGo tools.
+
+    python -m tool_cache        # exercise the cache against a local fake provider
+
+Drop-in subclasses of agno's PubmedTools and DuckDuckGoTools. Every lookup goes
+through the provider's ProviderGuard, which does the following:
+
+* caches results by normalised query, with a TTL and LRU eviction past `max_entries`;
+* coalesces identical concurrent lookups into one provider call (single flight);
+* takes a token from the provider's token bucket before calling out, waiting at
+  most `max_wait` seconds for one;
+* serves an expired entry, for up to `stale_ttl` past its TTL, when the provider
+  fails or the bucket is empty.
+
+Guards are shared per provider across all agents in the process, so the cache
+and the rate limits are too.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from agno.tools.duckduckgo import DuckDuckGoTools
+from agno.tools.pubmed import PubmedTools
+
+from skin.query_cache import normalize_query
+from telemetry import get_logger
+
+log = get_logger(__name__)
+
+
+class ProviderError(Exception):
+    pass
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: int, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token if one is available; otherwise return the seconds until one is."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self, max_wait: float = 0.0) -> bool:
+        deadline = self.clock() + max_wait
+        while True:
+            wait = self._reserve()
+            if wait == 0.0:
+                return True
+            if self.clock() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class ProviderGuard:
+    """Cache, single flight, rate limit and stale fallback in front of one provider."""
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = 86400.0,
+        stale_ttl: float = 7 * 86400.0,
+        max_entries: int = 1024,
+        rate: float = 1.0,
+        burst: int = 3,
+        max_wait: float = 2.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_wait = max_wait
+        self.clock = clock
+        self.bucket = TokenBucket(rate, burst, clock=clock)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._lock = threading.Lock()
+        self.counts = {"hits": 0, "misses": 0, "coalesced": 0, "stale": 0, "throttled": 0, "errors": 0}
+
+    def _lookup(self, key: Hashable) -> Tuple[Optional[Any], bool]:
+        """(value, fresh) for `key`; value is None once it is past its stale window."""
+        item = self._entries.get(key)
+        if item is None:
+            return None, False
+        age = self.clock() - item[0]
+        if age > self.ttl + self.stale_ttl:
+            del self._entries[key]
+            return None, False
+        self._entries.move_to_end(key)
+        return item[1], age <= self.ttl
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (self.clock(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def call(self, key: Hashable, fetch: Callable[[], Any], fallback: Callable[[str], Any]) -> Any:
+        """
+        The cached result for `key`, calling `fetch` at most once at a time per key.
+
+        `fetch` raises on failure. When it fails, or no token is free, and there
+        is no stale entry to serve, the result is `fallback(reason)`.
+        """
+        with self._lock:
+            value, fresh = self._lookup(key)
+            if fresh:
+                self.counts["hits"] += 1
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.counts["misses"] += 1
+            else:
+                self.counts["coalesced"] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self._fetch(key, fetch, fallback, stale=value)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _fetch(self, key: Hashable, fetch: Callable[[], Any], fallback: Callable[[str], Any], stale: Optional[Any]) -> Any:
+        if not self.bucket.acquire(self.max_wait):
+            self.counts["throttled"] += 1
+            reason = f"{self.name} rate limit reached"
+        else:
+            try:
+                value = fetch()
+            except Exception as e:
+                self.counts["errors"] += 1
+                reason = f"{self.name} unavailable: {e}"
+            else:
+                self._store(key, value)
+                return value
+        if stale is not None:
+            self.counts["stale"] += 1
+            log.warning(f"{reason}; serving cached result")
+            return stale
+        log.warning(reason)
+        return fallback(reason)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counts["hits"] + self.counts["misses"] + self.counts["coalesced"]
+            return {
+                "entries": len(self._entries),
+                **self.counts,
+                "hit_rate": round((self.counts["hits"] + self.counts["coalesced"]) / lookups, 4) if lookups else 0.0,
+                "tokens": round(self.bucket.tokens, 2),
+            }
+
+
+_guards: Dict[str, ProviderGuard] = {}
+_guards_lock = threading.Lock()
+
+# NCBI allows 3 requests/s without an API key and a search is two requests
+_DEFAULTS = {
+    "pubmed": {"ttl": 86400.0, "rate": 1.5, "burst": 3},
+    "duckduckgo": {"ttl": 6 * 3600.0, "rate": 1.0, "burst": 3},
+}
+
+
+def guard_for(provider: str) -> ProviderGuard:
+    """
+    The process-wide guard for `provider`.
+
+    Settings come from <PROVIDER>_CACHE_TTL, <PROVIDER>_RATE and <PROVIDER>_BURST,
+    plus TOOL_CACHE_SIZE, TOOL_STALE_TTL and TOOL_MAX_WAIT for every provider.
+    """
+    with _guards_lock:
+        guard = _guards.get(provider)
+        if guard is None:
+            defaults = _DEFAULTS.get(provider, {"ttl": 3600.0, "rate": 1.0, "burst": 3})
+            prefix = provider.upper()
+            guard = _guards[provider] = ProviderGuard(
+                provider,
+                ttl=float(os.getenv(f"{prefix}_CACHE_TTL", defaults["ttl"])),
+                rate=float(os.getenv(f"{prefix}_RATE", defaults["rate"])),
+                burst=int(os.getenv(f"{prefix}_BURST", defaults["burst"])),
+                stale_ttl=float(os.getenv("TOOL_STALE_TTL", str(7 * 86400))),
+                max_entries=int(os.getenv("TOOL_CACHE_SIZE", "1024")),
+                max_wait=float(os.getenv("TOOL_MAX_WAIT", "2")),
+            )
+        return guard
+
+
+def tool_cache_stats() -> Dict[str, Dict[str, Any]]:
+    with _guards_lock:
+        return {name: guard.stats() for name, guard in _guards.items()}
+
+
+class CachedPubmedTools(PubmedTools):
+    def __init__(self, guard: Optional[ProviderGuard] = None, **kwargs):
+        self.guard = guard or guard_for("pubmed")
+        super().__init__(**kwargs)
+
+    def search_pubmed(self, query: str, max_results: Optional[int] = 10) -> str:
+        max_results = max_results or self.max_results or 10
+
+        def fetch() -> str:
+            result = super(CachedPubmedTools, self).search_pubmed(query, max_results)
+            # PubmedTools reports failures as a result string
+            if result.startswith("Could not fetch articles"):
+                raise ProviderError(result)
+            return result
+
+        key = ("search_pubmed", normalize_query(query), max_results, self.results_expanded)
+        return self.guard.call(key, fetch, lambda reason: f"Could not fetch articles. Error: {reason}")
+
+    search_pubmed.__doc__ = PubmedTools.search_pubmed.__doc__
+
+
+class CachedDuckDuckGoTools(DuckDuckGoTools):
+    def __init__(self, guard: Optional[ProviderGuard] = None, **kwargs):
+        self.guard = guard or guard_for("duckduckgo")
+        super().__init__(**kwargs)
+
+    def _guarded(self, tool: str, fetch: Callable[[], str], query: str, max_results: int) -> str:
+        key = (tool, normalize_query(query), self.fixed_max_results or max_results, self.modifier)
+        return self.guard.call(key, fetch, lambda reason: json.dumps({"error": reason}))
+
+    def duckduckgo_search(self, query: str, max_results: int = 5) -> str:
+        return self._guarded(
+            "duckduckgo_search", lambda: super(CachedDuckDuckGoTools, self).duckduckgo_search(query, max_results), query, max_results
+        )
+
+    def duckduckgo_news(self, query: str, max_results: int = 5) -> str:
+        return self._guarded(
+            "duckduckgo_news", lambda: super(CachedDuckDuckGoTools, self).duckduckgo_news(query, max_results), query, max_results
+        )
+
+    duckduckgo_search.__doc__ = DuckDuckGoTools.duckduckgo_search.__doc__
+    duckduckgo_news.__doc__ = DuckDuckGoTools.duckduckgo_news.__doc__
+
+
+class FakeProvider:
+    """Local stand-in for a search backend: fixed latency, countable calls, switchable outage."""
+
+    def __init__(self, latency: float = 0.2):
+        self.latency = latency
+        self.calls = 0
+        self.down = False
+        self._lock = threading.Lock()
+
+    def search(self, query: str) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if self.down:
+            raise ProviderError("connection refused")
+        return json.dumps([{"title": f"Result for {query}"}])
+
+
+def main() -> int:
+    from concurrent.futures import ThreadPoolExecutor
+
+    provider = FakeProvider(latency=0.2)
+    guard = ProviderGuard("fake", ttl=0.5, stale_ttl=60, rate=5, burst=2, max_wait=0.1)
+
+    def lookup(query: str) -> str:
+        return guard.call(("search", normalize_query(query)), lambda: provider.search(query), lambda reason: json.dumps({"error": reason}))
+
+    queries = ["Tinea corporis treatment?", "tinea corporis   treatment", "acne vulgaris first-line"] * 10
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lookup, queries))
+    print(f"[INFO] Burst of {len(queries)} lookups: {provider.calls} provider calls, {guard.stats()}")
+
+    time.sleep(0.6)
+    provider.down = True
+    print(f"[INFO] Provider down, expired entry: {lookup('acne vulgaris first-line')}")
+    print(f"[INFO] Provider down, never cached: {lookup('psoriasis biologics')}")
+    print(json.dumps(guard.stats(), indent=1))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
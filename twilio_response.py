@@ -1,40 +1,33 @@
-from agno.agent import Agent
 import os
-from agno.models.groq import Groq
-from agno.storage.sqlite import SqliteStorage
-from fastapi import FastAPI, Request, Form
-from agno.tools.duckduckgo import DuckDuckGoTools
-from agno.tools.pubmed import PubmedTools
-from agno.tools.twilio import TwilioTools
-from skin.skin_kb import DermaKnowledgeBase
+import sys
+import asyncio
+from fastapi import APIRouter, FastAPI, Request, Form
 from fastapi.responses import PlainTextResponse
 
-from agno.memory.v2.db.sqlite import SqliteMemoryDb
-from agno.memory.v2.memory import Memory
 #handle images
-from image import upload_to_cloudinary
+from contextlib import asynccontextmanager
+from http_client import client_lifespan
+from media import earlier_reply, media_store, remember_reply, twilio_attachments, twilio_images
+from media_store import media_router
+from idempotency import store_from_env
+from sessions import forget_session_runs, registry_from_env
+from startup import Components, health_router, import_module, startup_mode
+from telemetry import get_logger, metrics_router, observe_run, span, start_trace
 
 #Twilio imports
-import base64
-import requests
 from typing import Optional
 from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
-from clinical_tools import get_clinical_input, ClinicalInfo
 
 from dotenv import load_dotenv
 load_dotenv()
 
+log = get_logger(__name__)
+
 #api_key = os.getenv("GOOGLE_API_KEY")
 account_sid = os.getenv("TWILIO_ACCOUNT_SID")
 auth_token = os.getenv("TWILIO_AUTH_TOKEN")
 twilio_phone_number = os.getenv("TWILIO_PHONE_NUMBER")
 
-client = Client(account_sid, auth_token)
-
-agent_memory = Memory(
-    db=SqliteMemoryDb(table_name="derma_user_memory", db_file="./derma_agent.sqlite")
-)
 agent_storage: str = "tmp/agents.db"
 
 # def load_derma_kb():
@@ -50,15 +43,53 @@ agent_storage: str = "tmp/agents.db"
 
 # kb = load_derma_kb()
 
-app = FastAPI()
-
-derma_agent = Agent(
+# Seconds between session/memory retention passes (see retention.py); 0 disables it
+retention_interval = float(os.getenv("RETENTION_INTERVAL", "3600"))
+
+async def run_retention(interval: float) -> None:
+    retention = await import_module("retention")
+    await retention.retention_loop(interval)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The agent is built on first use (see startup.py)
+    warmup = startup_mode()
+    if warmup == "blocking":
+        await components.warm()
+    warm_task = asyncio.create_task(components.warm()) if warmup == "background" else None
+    retention_task = asyncio.create_task(run_retention(retention_interval)) if retention_interval > 0 else None
+    # Shared, pooled HTTP client for media downloads
+    async with client_lifespan():
+        yield
+    for task in (warm_task, retention_task):
+        if task:
+            task.cancel()
+    # Commit any agent session writes still queued
+    if "sqlite_store" in sys.modules:
+        sys.modules["sqlite_store"].close_writers()
+
+# Finished TwiML by MessageSid, so Twilio retries never re-run the agent
+webhook_responses = store_from_env()
+
+async def create_agent():
+    # agno, the Groq SDK and the toolkits are only needed from here on
+    for name in ("agno.agent", "agno.models.groq", "agno.memory.v2.memory", "agno.tools.twilio", "tool_cache", "sqlite_store"):
+        await import_module(name)
+    from agno.agent import Agent
+    from agno.memory.v2.memory import Memory
+    from agno.models.groq import Groq
+    from sqlite_store import WalSqliteMemoryDb, WalSqliteStorage
+    from tool_cache import CachedDuckDuckGoTools, CachedPubmedTools
+
+    agent_memory = Memory(
+        db=WalSqliteMemoryDb(table_name="derma_user_memory", db_file="./derma_agent.sqlite")
+    )
+    return Agent(
         name="Derma Agent",
         model=Groq(id="meta-llama/llama-4-scout-17b-16e-instruct"), 
-        tools=[DuckDuckGoTools(), PubmedTools()],
+        tools=[CachedDuckDuckGoTools(), CachedPubmedTools()],
         memory=agent_memory,
         enable_user_memories=True,
-        session_id="derma_whatsapp_session",
         # knowledge=kb.get_knowledge_base(),
         show_tool_calls=True,
         instructions=[
@@ -94,84 +125,124 @@ derma_agent = Agent(
         Always prioritize evidence-based reasoning.
         """
         ],
-        storage=SqliteStorage(table_name="derma_agent", db_file="./derma_agent.sqlite"),
+        storage=WalSqliteStorage(table_name="derma_agent", db_file="./derma_agent.sqlite"),
         add_datetime_to_instructions=True,
         add_history_to_messages=True,
         num_history_responses=5,
         markdown=True,
     )
 
-def download_image(media_url, account_sid, auth_token):
-    
-    response = requests.get(media_url, auth=(account_sid, auth_token))
-    if response.status_code == 200:
-        return response.content
-    else:
-        print(f"Failed to download image: {response.status_code}, {response.content}")
-        return None
+components = Components()
+components.register("agent", create_agent)
 
+# Current conversation session per sender (see sessions.py)
+user_sessions = {}
+session_registry = registry_from_env(
+    user_sessions,
+    on_expire=lambda session_id: forget_session_runs(components.peek("agent"), session_id),
+)
 
+router = APIRouter()
 
-@app.post("/twilio/whatsapp", response_class=PlainTextResponse)
+@router.post("/twilio/whatsapp", response_class=PlainTextResponse)
 async def whatsapp_webhook(
     request: Request,
     From: str = Form(...),
     Body: Optional[str] = Form(None),
     MediaUrl0: Optional[str] = Form(None),
     MediaContentType0: Optional[str] = Form(None),
+    MessageSid: Optional[str] = Form(None),
 ):
-    body_text = Body or ""
-    print(f"Incoming from {From}: {body_text}")
-    print(f"Media URL: {MediaUrl0}, Content Type: {MediaContentType0}")
+    start_trace(MessageSid)
+    log.info("Incoming WhatsApp message", extra={"fields": {"sender": From, "chars": len(Body or "")}})
+    with span("webhook.parse"):
+        form = await request.form()
+    try:
+        # Retries of the same MessageSid attach to the first run or replay its TwiML
+        content = await webhook_responses.run(MessageSid, lambda: answer_whatsapp_message(form, From, Body))
+    except Exception as e:
+        log.error(f"Agent error: {e}")
+        response = MessagingResponse()
+        response.message("Sorry, there was an error processing your request.")
+        content = str(response)
+
+    return PlainTextResponse(content=content, media_type="application/xml")
+
+
+async def answer_whatsapp_message(form, From: str, Body: Optional[str]) -> str:
+    """TwiML answer for one WhatsApp message and its attachments."""
+    MediaUrl0 = form.get("MediaUrl0")
+    MediaContentType0 = form.get("MediaContentType0")
+    log.debug("Media URL: %s, Content Type: %s", MediaUrl0, MediaContentType0)
 
     messages = []
 
     if Body and Body.strip():
         messages.append({"role": "user", "content": Body.strip()})
 
-    if MediaUrl0:
-        print(f"MediaUrl0 received from Twilio webhook: '{MediaUrl0}'")
-        image_bytes = download_image(MediaUrl0, account_sid, auth_token)
-        if image_bytes:
-            # Upload to Cloudinary to get a public URL
-            cloud_url = upload_to_cloudinary(image_bytes)
-            print(f"[DEBUG] Cloudinary returned URL: {cloud_url}")
-            if not cloud_url:
-                print("[ERROR] Cloudinary upload failed or returned no URL!")
+    # Every MediaUrlN attachment is downloaded, downsampled and re-hosted
+    # concurrently, off the event loop; pictures the sender already sent reuse
+    # their earlier upload
+    attachments = twilio_attachments(form)
+    images = []
+    if attachments:
+        log.debug("%d media attachment(s) received from Twilio webhook", len(attachments))
+        hosted = await twilio_images(attachments, auth=(account_sid, auth_token), sender=From)
+        images = [image for image in hosted if image]
+        log.debug("Hosted %d of %d image(s)", len(images), len(hosted))
+        earlier = earlier_reply(images, Body or "") if len(images) == len(hosted) else None
+        if earlier:
+            log.info("Sender resent the same picture(s); replaying the earlier analysis", extra={"fields": {"sender": From}})
+            response = MessagingResponse()
+            response.message(earlier)
+            return str(response)
+        image_parts = [{"type": "image_url", "image_url": {"url": image.url}} for image in images]
+        if image_parts:
             messages.append({
                 "role": "user",
-                "content": [
-                    {"type": "text", "text": Body.strip() if Body else ""},
-                    {"type": "image_url", "image_url": {"url": cloud_url}}
-                ]
+                "content": [{"type": "text", "text": Body.strip() if Body else ""}, *image_parts]
             })
-
-        else:
+        if len(images) < len(hosted):
             messages.append({"role": "user", "content": "User sent an image, but it could not be downloaded."})
 
-
-        if not messages:
-            messages.append({"role": "user", "content": "No message content received."})
-
-    try:
-        agent_response = await derma_agent.arun(
-            messages=messages,
-            user_id=From,
-            tools=[TwilioTools()]
-        )
-        print(f"[DEBUG] Full agent_response: {agent_response}")
-        assistant_reply = next(
-            (msg.content for msg in agent_response.messages if msg.role == "assistant"),
-            "Sorry, I couldn’t process your message."
-        )
-
-        response = MessagingResponse()
-        response.message(assistant_reply)
-        print(f"Response to {From}: {assistant_reply}")
-
-    except Exception as e:
-        print("Agent error:", e)
-        response = MessagingResponse()
-        response.message("Sorry, there was an error processing your request.")
-
-    return PlainTextResponse(content=str(response), media_type="application/xml")
+    if not messages:
+        messages.append({"role": "user", "content": "No message content received."})
+
+    # One session per sender and conversation; a sender's turns run one at a time
+    derma_agent = await components.get("agent")
+    from agno.tools.twilio import TwilioTools
+
+    session = session_registry.session_for(From, Body or "")
+    async with session.lock:
+        with span("agent.run", session=session.session_id) as fields:
+            agent_response = await derma_agent.arun(
+                messages=messages,
+                session_id=session.session_id,
+                user_id=From,
+                tools=[TwilioTools()]
+            )
+            fields.update(observe_run(agent_response))
+    assistant_reply = next(
+        (msg.content for msg in agent_response.messages if msg.role == "assistant"),
+        "Sorry, I couldn’t process your message."
+    )
+    remember_reply(images, Body or "", assistant_reply)
+
+    response = MessagingResponse()
+    response.message(assistant_reply)
+    log.debug("Response to %s: %s", From, assistant_reply)
+    return str(response)
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    # /healthz and /readyz (see startup.py)
+    app.include_router(health_router(components))
+    # Signed URLs for images kept in the local media store (MEDIA_BACKEND=local)
+    app.include_router(media_router(media_store))
+    # Stage latency histograms and model/tool counters (see telemetry.py)
+    app.include_router(metrics_router())
+    app.include_router(router)
+    return app
+
+app = create_app()